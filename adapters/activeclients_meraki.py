@@ -1,7 +1,9 @@
 """Provides an implementation of ActiveClients port for a Meraki powered network."""
 import logging
+from typing import Dict
 from typing import List
 import meraki
+from adapters import meraki_vlans
 from netorg_core import ports
 
 class ActiveClientsAdapter(ports.ActiveClientsPort):
@@ -16,21 +18,22 @@ class ActiveClientsAdapter(ports.ActiveClientsPort):
             supress_logging = False
         self.dashboard = meraki.DashboardAPI(config['api_key'], suppress_logging=supress_logging)
         self.serial_id = config['serial_id']
-        self.vlan_id   = str(config['vlan_id'])
+        self.vlan_ids  = [vlan['id'] for vlan in meraki_vlans.get_vlans(config)]
 
     # overriding abstract method
     def load(self) -> List[ports.ActiveClient]:
-        list_of_active_clients: List[ports.ActiveClient] = []
+        return ports.from_columns(self.load_columns(), ports.ActiveClient)
+
+    # overriding method
+    def load_columns(self) -> Dict[str, list]:
         device_clients = self.dashboard.devices.getDeviceClients(self.serial_id)
         # pylint: disable=line-too-long
-        filtered_for_vlan = [ device_client for device_client in device_clients if str(device_client['vlan']) == self.vlan_id]
-        for device_client in filtered_for_vlan:
-            active_client = ports.ActiveClient(
-                mac=device_client['mac'],
-                #name=device_client['dhcpHostname'], # Is this used?
-                name=device_client['description'],
-                ip_address=device_client['ip']
-            )
-            list_of_active_clients.append(active_client)
-        self.__logger.debug(f"ActiveClientsMerakiAdapter.load() returned {len(list_of_active_clients)} active clients")
-        return list_of_active_clients
+        filtered_for_vlan = [ device_client for device_client in device_clients if str(device_client['vlan']) in self.vlan_ids]
+        columns_of_active_clients = {
+            'mac': [device_client['mac'] for device_client in filtered_for_vlan],
+            #'name': [device_client['dhcpHostname'] ...], # Is this used?
+            'name': [device_client['description'] for device_client in filtered_for_vlan],
+            'ip_address': [device_client['ip'] for device_client in filtered_for_vlan]
+        }
+        self.__logger.debug(f"ActiveClientsMerakiAdapter.load() returned {len(filtered_for_vlan)} active clients")
+        return columns_of_active_clients
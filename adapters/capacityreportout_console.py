@@ -0,0 +1,55 @@
+"""Provides a console based adapter for outputting network space capacity reports."""
+import json
+from netorg_core import ports
+
+class CapacityReportOutAdapter(ports.CapacityReportOutPort):
+    """Provides a console based adapter for outputting network space capacity reports."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, config: dict, output_format: str = 'text') -> None:
+        self.output_format = output_format
+
+    # overriding abstract method
+    def write(self,capacity_reports: list):
+        if self.output_format == 'json':
+            print(json.dumps([capacity_report.to_dict() for capacity_report in capacity_reports], indent=2))
+        elif self.output_format == 'jsonl':
+            for capacity_report in capacity_reports:
+                print(json.dumps(capacity_report.to_dict()))
+        else:
+            print(CapacityReportOutAdapter.format_text(capacity_reports))
+
+    @staticmethod
+    def format_text(capacity_reports: list) -> str:
+        """Format the capacity reports for people to read."""
+        lines = []
+        for capacity_report in capacity_reports:
+            lines.append(f'VLAN {capacity_report.vlan_id} ({capacity_report.subnet}) is {capacity_report.get_percent_used():.2f}% full: '
+                         f'{capacity_report.used} used, {capacity_report.get_free()} free of {capacity_report.size}'
+                         f'{CapacityReportOutAdapter.format_excluded(capacity_report.size, capacity_report.used, capacity_report.get_free())}')
+            if capacity_report.largest_free_block:
+                first, last = capacity_report.largest_free_block
+                lines.append(f'   Largest free block: {first} - {last} ({capacity_report.get_largest_free_block_size()} addresses), '
+                             f'fragmentation {capacity_report.get_fragmentation():.2f}%')
+            else:
+                lines.append('   No free addresses')
+            if capacity_report.free_block_histogram:
+                histogram = ', '.join(f'{bucket}+: {count}' for bucket, count in capacity_report.free_block_histogram.items())
+                lines.append(f'   Free blocks by size: {histogram}')
+            if capacity_report.group_occupancy:
+                groups = ', '.join(f'{group}: {count}' for group, count in capacity_report.group_occupancy.items())
+                lines.append(f'   Addresses by group: {groups}')
+        if len(capacity_reports) > 1:
+            size = sum(capacity_report.size for capacity_report in capacity_reports)
+            used = sum(capacity_report.used for capacity_report in capacity_reports)
+            free = sum(capacity_report.get_free() for capacity_report in capacity_reports)
+            percent_used = used / (used + free) * 100.0 if used + free else 0.0
+            lines.append(f'All {len(capacity_reports)} VLANs are {percent_used:.2f}% full: {used} used, {free} free of {size}'
+                         f'{CapacityReportOutAdapter.format_excluded(size, used, free)}')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def format_excluded(size: int, used: int, free: int) -> str:
+        """Format how many addresses are excluded, neither used nor free, if any are."""
+        excluded = size - used - free
+        return f' ({excluded} excluded)' if excluded else ''
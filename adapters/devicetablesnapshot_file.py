@@ -0,0 +1,101 @@
+"""Provides saving/loading of a columnar snapshot of the device table to a file."""
+import json
+import logging
+import mmap
+import os
+import os.path
+import struct
+import time
+from datetime import datetime
+from netorg_core import devicetable
+from netorg_core import ports
+
+# magic, version, when the snapshot was taken (seconds since the epoch), length of the JSON index
+HEADER = struct.Struct('<8sIdI')
+MAGIC = b'NETORGDT'
+VERSION = 1
+# Strings are stored one column at a time, separated by NUL
+SEPARATOR = '\0'
+
+def encode_snapshot(columns: dict, taken_at: float) -> bytes:
+    """Encode the columns of a device table (see DeviceTable.to_columns()) as a snapshot."""
+    index = {'rows': len(next(iter(columns.values()), [])), 'columns': []}
+    blobs = []
+    offset = 0
+    for column, values in columns.items():
+        if column in devicetable.FLAGS:
+            kind, blob = 'bool', bytes(bool(value) for value in values)
+        else:
+            kind, blob = 'str', SEPARATOR.join(values).encode('utf8')
+        index['columns'].append([column, kind, offset, len(blob)])
+        blobs.append(blob)
+        offset += len(blob)
+    encoded_index = json.dumps(index).encode('utf8')
+    return HEADER.pack(MAGIC, VERSION, taken_at, len(encoded_index)) + encoded_index + b''.join(blobs)
+
+def decode_snapshot(snapshot) -> tuple:
+    """Decode a snapshot (bytes or a memory map) into when it was taken and its columns,
+    or return None if it is not a snapshot this version can read."""
+    if len(snapshot) < HEADER.size:
+        return None
+    magic, version, taken_at, index_length = HEADER.unpack_from(snapshot, 0)
+    if magic != MAGIC or version != VERSION:
+        return None
+    index = json.loads(bytes(snapshot[HEADER.size:HEADER.size + index_length]).decode('utf8'))
+    data_start = HEADER.size + index_length
+    columns = {}
+    for column, kind, offset, length in index['columns']:
+        blob = snapshot[data_start + offset:data_start + offset + length]
+        if kind == 'bool':
+            columns[column] = [bool(value) for value in blob]
+        elif index['rows']:
+            columns[column] = bytes(blob).decode('utf8').split(SEPARATOR)
+        else:
+            columns[column] = []
+    return taken_at, columns
+
+class DeviceTableSnapshotAdapter(ports.DeviceTableSnapshotPort):
+    """Keeps the snapshot in a file next to devices.yml (devices.snapshot), or at device_table_snapshot.
+    Another setting and file name keep another snapshot, e.g. the changes cursor (devices.changes)."""
+    # pylint: disable=logging-fstring-interpolation
+
+    def __init__(self, config: dict, setting: str = 'device_table_snapshot', default_filename: str = 'devices.snapshot') -> None:
+        self.__logger = logging.getLogger("netorg")
+        self.filename = config.get(setting) or os.path.join(
+            os.path.dirname(config['devices_yml']), default_filename)
+
+    # overriding abstract method
+    def save(self,device_table: devicetable.DeviceTable) -> None:
+        snapshot = encode_snapshot(device_table.to_columns(), time.time())
+        # Write a new file and swap it in, so that readers always see a whole snapshot
+        temporary_filename = f'{self.filename}.tmp'
+        with open(temporary_filename, 'wb') as snapshot_file:
+            snapshot_file.write(snapshot)
+        os.replace(temporary_filename, self.filename)
+        self.__logger.debug(f"DeviceTableSnapshotAdapter.save() saved {device_table.get_size()} devices to {self.filename}")
+
+    # overriding abstract method
+    def load(self,max_age: float,backend: str = None) -> devicetable.DeviceTable:
+        if not os.path.exists(self.filename):
+            self.__logger.debug(f"DeviceTableSnapshotAdapter.load() {self.filename} not found")
+            return None
+        with open(self.filename, 'rb') as snapshot_file:
+            if os.fstat(snapshot_file.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+                decoded = decode_snapshot(snapshot)
+        if decoded is None:
+            self.__logger.debug(f"DeviceTableSnapshotAdapter.load() {self.filename} is not a snapshot")
+            return None
+        taken_at, columns = decoded
+        age = time.time() - taken_at
+        if age > max_age:
+            self.__logger.debug(f"DeviceTableSnapshotAdapter.load() snapshot is {age:.0f}s old")
+            return None
+        self.__logger.debug(f"DeviceTableSnapshotAdapter.load() using the snapshot taken at {datetime.fromtimestamp(taken_at)}")
+        return devicetable.DeviceTable(columns, backend=backend)
+
+    # overriding abstract method
+    def clear(self) -> None:
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -1,9 +1,11 @@
 """Provides loading/saving of fixed IP reservations. """
+import contextlib
 import logging
 import re
+from typing import Dict
 from typing import List
 import meraki
-from deepdiff import DeepDiff
+from adapters import meraki_vlans
 from netorg_core import devicetable
 from netorg_core import networkspace
 from netorg_core import ports
@@ -20,39 +22,109 @@ class FixedIpReservationsAdapter(ports.FixedIpReservationsPort):
             supress_logging = False
         self.dashboard = meraki.DashboardAPI(config['api_key'], suppress_logging=supress_logging)
         self.network_id = config['network_id']
-        self.vlan_id = str(config['vlan_id'])
-        self.vlan_subnet = config['vlan_subnet']
+        self.vlans = meraki_vlans.get_vlans(config)
+        self.allocation_policy = config.get('allocation_policy', networkspace.HASHED)
+        self.group_headroom = config.get('group_headroom', 4)
+        # The network space pool held by locked(), if any
+        self.__locked_pool = None
 
     # overriding abstract method
     def load(self) -> List[ports.FixedIpReservation]:
-        list_of_fixed_ip_reservations: List[ports.FixedIpReservation] = []
-        vlan = self.dashboard.appliance.getNetworkApplianceVlan(self.network_id, str(self.vlan_id))
-        reservations = vlan['fixedIpAssignments']
-        if reservations:
-            for mac, reservation_details in reservations.items():
-                fixed_ip_reservation = ports.FixedIpReservation(
-                    mac=mac,
-                    name=reservation_details['name'],
-                    ip_address=reservation_details['ip']
-                )
-                list_of_fixed_ip_reservations.append(fixed_ip_reservation)
-        self.__logger.debug(f"FixedIpReservationsMerakiAdapter.load() returned {len(list_of_fixed_ip_reservations)} fixed IP reservations")
-        return list_of_fixed_ip_reservations
+        return ports.from_columns(self.load_columns(), ports.FixedIpReservation)
+
+    # overriding method
+    def load_columns(self) -> Dict[str, list]:
+        columns_of_fixed_ip_reservations = ports.to_columns([], ports.FixedIpReservation)
+        for vlan_config in self.vlans:
+            vlan = self.dashboard.appliance.getNetworkApplianceVlan(self.network_id, vlan_config['id'])
+            reservations = vlan['fixedIpAssignments']
+            if reservations:
+                columns_of_fixed_ip_reservations['mac'].extend(reservations.keys())
+                columns_of_fixed_ip_reservations['name'].extend(details['name'] for details in reservations.values())
+                columns_of_fixed_ip_reservations['ip_address'].extend(details['ip'] for details in reservations.values())
+        self.__logger.debug(f"FixedIpReservationsMerakiAdapter.load() returned {len(columns_of_fixed_ip_reservations['mac'])} fixed IP reservations")
+        return columns_of_fixed_ip_reservations
+
+    # overriding method
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the lock on each VLAN's persisted network space until the reservations are saved. The
+        reservations loaded meanwhile then hold every address in use, so saving them can also release the
+        addresses that are no longer reserved."""
+        network_space_pool = FixedIpReservationsAdapter.__create_network_space_pool(self.vlans)
+        try:
+            with network_space_pool.locked():
+                self.__locked_pool = network_space_pool
+                yield self
+        finally:
+            self.__locked_pool = None
+            network_space_pool.close()
 
     # overriding abstract method
     def save(self,device_table: devicetable.DeviceTable) -> None:
-        network_mapper = networkspace.NetworkMapper(self.vlan_subnet,device_table)
-        network_mapper.map_to_network_space()
-        self.__logger.info(f'Network space is {network_mapper.get_percent_used():.2f}% full')
-        new_fixed_ip_reservations = FixedIpReservationsAdapter.__generate_fixed_ip_reservations(device_table)
-        before_vlan = self.dashboard.appliance.getNetworkApplianceVlan(self.network_id, str(self.vlan_id))
-        old_fixed_ip_reservations = before_vlan['fixedIpAssignments']
-        FixedIpReservationsAdapter.__show_diffs(old_fixed_ip_reservations, new_fixed_ip_reservations)
-        # pylint: disable=unused-variable
-        response = self.dashboard.appliance.updateNetworkApplianceVlan(
-            self.network_id, self.vlan_id,
-            fixedIpAssignments=new_fixed_ip_reservations)
-        self.__logger.debug(f"FixedIpReservationsAdapter.save() response from Meraki {response}")
+        network_space_pool = self.__locked_pool or FixedIpReservationsAdapter.__create_network_space_pool(self.vlans)
+        network_mapper = networkspace.NetworkPoolMapper(
+            network_space_pool, device_table,
+            allocation_policy=self.allocation_policy,
+            group_headroom=self.group_headroom,
+            release_unused=self.__locked_pool is not None)
+        try:
+            network_mapper.map_to_network_space()
+            for vlan_utilization in network_mapper.get_utilization():
+                self.__logger.info(f'{vlan_utilization}')
+            if len(self.vlans) > 1:
+                self.__logger.info(f'Network space across {len(self.vlans)} VLANs is {network_mapper.get_percent_used():.2f}% full')
+        finally:
+            if network_space_pool is not self.__locked_pool:
+                network_space_pool.close()
+        all_fixed_ip_reservations = FixedIpReservationsAdapter.__generate_fixed_ip_reservations(device_table)
+        for vlan_config in self.vlans:
+            vlan_id = vlan_config['id']
+            new_fixed_ip_reservations = {
+                mac: reservation for mac, reservation in all_fixed_ip_reservations.items()
+                if network_space_pool.get_vlan_for_address(reservation['ip']) == vlan_id}
+            before_vlan = self.dashboard.appliance.getNetworkApplianceVlan(self.network_id, vlan_id)
+            old_fixed_ip_reservations = before_vlan['fixedIpAssignments']
+            if len(self.vlans) > 1:
+                self.__logger.info(f'VLAN {vlan_id}:')
+            FixedIpReservationsAdapter.__show_diffs(old_fixed_ip_reservations, new_fixed_ip_reservations)
+            # pylint: disable=unused-variable
+            response = self.dashboard.appliance.updateNetworkApplianceVlan(
+                self.network_id, vlan_id,
+                fixedIpAssignments=new_fixed_ip_reservations)
+            self.__logger.debug(f"FixedIpReservationsAdapter.save() response from Meraki for VLAN {vlan_id} {response}")
+
+    # overriding method
+    def get_subnets(self) -> List[str]:
+        return [vlan['subnet'] for vlan in self.vlans]
+
+    # overriding method
+    def get_capacity(self,device_table: devicetable.DeviceTable) -> list:
+        # Reporting never writes to the persisted network spaces
+        network_space_pool = FixedIpReservationsAdapter.__create_network_space_pool(self.vlans, read_only=True)
+        network_mapper = networkspace.NetworkPoolMapper(
+            network_space_pool, device_table,
+            allocation_policy=self.allocation_policy,
+            group_headroom=self.group_headroom)
+        try:
+            network_mapper.reconcile()
+            return network_mapper.get_capacity_reports()
+        finally:
+            network_space_pool.close()
+
+    @staticmethod
+    def __create_network_space_pool(vlans: List[dict], read_only: bool = False) -> networkspace.NetworkSpacePool:
+        """Create a network space for each VLAN. read_only network spaces never write to their state files."""
+        network_space_pool = networkspace.NetworkSpacePool()
+        for vlan in vlans:
+            network_space_pool.add_vlan(
+                vlan['id'], vlan['subnet'],
+                space_type=vlan['network_space'],
+                exclusions=vlan['exclusions'],
+                groups=vlan['groups'],
+                state_file=vlan['state_file'],
+                read_only=read_only)
+        return network_space_pool
 
     @staticmethod
     def __generate_fixed_ip_reservations(device_table: devicetable.DeviceTable) -> dict:
@@ -60,27 +132,24 @@ class FixedIpReservationsAdapter(ports.FixedIpReservationsPort):
         # pylint: disable=invalid-name
         logger = logging.getLogger("netorg")
         ip_reservations_dict = {}
-        df = device_table.get_df()
-        skip_these_macs = df.query("not known and reserved and not active").mac.unique().tolist()
-        macs = df.mac.unique().tolist()
-        for mac in macs :
-            if mac not in skip_these_macs:
-                device_df = df.query('mac == @mac')
-                if device_df.shape[0] == 1:
-                    ip = device_df.iloc[0]['ip']
-                    name = device_df.iloc[0]['name']
-                    ip_reservations_dict[mac] = {
-                        'ip': ip,
-                        'name': name
-                    }
-            else:
-                logger.debug(f'FixedIpReservationsAdapter: skipping {mac}')
+        retired = device_table.get_retired()
+        for mac in dict.fromkeys(device_table.get_macs(retired)):
+            logger.debug(f'FixedIpReservationsAdapter: skipping {mac}')
+        reserve = ~retired & device_table.get_unique_mac()
+        for mac, ip, name in zip(device_table.get_macs(reserve), device_table.get_ips(reserve), device_table.get_names(reserve)):
+            ip_reservations_dict[mac] = {
+                'ip': ip,
+                'name': name
+            }
         return ip_reservations_dict
 
     @staticmethod
     def __show_diffs(old_fixed_ip_reservations, new_fixed_ip_reservations):
         """Show the before and after differences to the fixed IP reservations."""
         logger = logging.getLogger("netorg")
+        # deepdiff imports pandas if it is installed, so only import it when there is something to compare
+        # pylint: disable=import-outside-toplevel
+        from deepdiff import DeepDiff
         diff = DeepDiff(old_fixed_ip_reservations, new_fixed_ip_reservations)
         if diff:
             logger.info("Fixed IP reservation differences are as follows:")
@@ -0,0 +1,29 @@
+"""Provides the VLANs of a Meraki powered network that netorg organizes, shared by the Meraki adapters."""
+import os.path
+from typing import List
+
+def get_vlans(config: dict) -> List[dict]:
+    """Return the VLANs to organize. Each has an id, subnet, exclusions, network_space, groups and state_file.
+    The 'vlans' setting lists several VLANs, otherwise the single vlan_id/vlan_subnet is used.
+    With persist_network_space, a bitmap network space is kept in a state file next to devices.yml."""
+    vlans = config.get('vlans') or [{
+        'id': config['vlan_id'],
+        'subnet': config['vlan_subnet'],
+        'exclusions': config.get('vlan_exclusions', [])}]
+    persist = config.get('persist_network_space', False)
+    result = []
+    for vlan in vlans:
+        exclusions = vlan.get('exclusions', [])
+        default_network_space = 'interval' if exclusions else 'bitmap' if persist else 'set'
+        network_space = vlan.get('network_space', config.get('network_space', default_network_space))
+        state_file = None
+        if persist and network_space == 'bitmap':
+            state_file = os.path.join(os.path.dirname(config['devices_yml']), f'vlan-{vlan["id"]}.bitmap')
+        result.append({
+            'id': str(vlan['id']),
+            'subnet': vlan['subnet'],
+            'exclusions': exclusions,
+            'network_space': network_space,
+            'groups': vlan.get('groups', []),
+            'state_file': state_file})
+    return result
@@ -0,0 +1,30 @@
+"""Provides a JSON Lines adapter for outputting the devices found by a scan."""
+import json
+import sys
+from typing import Iterable
+from netorg_core import ports
+
+class ScanFindingsOutAdapter(ports.ScanFindingsOutPort):
+    """Writes one JSON object per line for each device found by a scan, to stdout or a file,
+    as the findings are produced."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, config: dict, filename: str = None) -> None:
+        self.filename = filename
+
+    # overriding abstract method
+    def write(self,scan_findings: Iterable[ports.ScanFinding]):
+        if self.filename:
+            with open(self.filename, 'w', encoding='utf8') as scan_findings_file:
+                ScanFindingsOutAdapter.write_jsonl(scan_findings, scan_findings_file)
+        else:
+            ScanFindingsOutAdapter.write_jsonl(scan_findings, sys.stdout)
+            sys.stdout.flush()
+
+    @staticmethod
+    def write_jsonl(scan_findings: Iterable[ports.ScanFinding], out) -> None:
+        """Write each finding as a line of JSON."""
+        encoder = json.JSONEncoder(ensure_ascii=False)
+        for scan_finding in scan_findings:
+            out.write(encoder.encode(scan_finding._asdict()))
+            out.write('\n')
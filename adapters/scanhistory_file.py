@@ -0,0 +1,313 @@
+"""Provides a compact history of the state of every device at each scan, in a columnar file per day."""
+import collections
+import itertools
+import json
+import logging
+import mmap
+import os
+import os.path
+import struct
+from datetime import date
+from datetime import datetime
+from typing import Iterable
+from typing import List
+from netorg_core import ports
+
+# magic, version, length of the JSON index
+HEADER = struct.Struct('<8sII')
+MAGIC = b'NETORGHS'
+VERSION = 1
+SUFFIX = '.history'
+# MACs are stored one after another, separated by NUL
+SEPARATOR = b'\0'
+# The other columns are arrays of fixed size values, one per run
+KINDS = {'state': 'B', 'first': 'd', 'last': 'd', 'scans': 'I'}
+# Scans appended since the day was last compacted follow the runs, each as
+# magic, when it was taken, length of its {state: count} JSON, length of its changes JSON
+SEGMENT = struct.Struct('<4sdII')
+SEGMENT_MAGIC = b'NHSD'
+
+def encode_day(runs: dict, scans: list) -> bytes:
+    """Encode a day of history: its runs (a list per column of ports.StateRun)
+    and its scans (a [taken_at, {state: count}] per scan)."""
+    count = len(runs['mac'])
+    blobs = [SEPARATOR.join(mac.encode('utf8') for mac in runs['mac'])]
+    index = {'runs': count, 'scans': scans, 'columns': [['mac', 0, len(blobs[0])]]}
+    offset = len(blobs[0])
+    for column, kind in KINDS.items():
+        blobs.append(struct.pack(f'<{count}{kind}', *runs[column]))
+        index['columns'].append([column, offset, len(blobs[-1])])
+        offset += len(blobs[-1])
+    encoded_index = json.dumps(index).encode('utf8')
+    return HEADER.pack(MAGIC, VERSION, len(encoded_index)) + encoded_index + b''.join(blobs)
+
+def decode_index(day) -> dict:
+    """Decode the index of a day of history (bytes or a memory map), or return None if it is not
+    history this version can read. The index holds the scans, and where each column is, relative to 'start'."""
+    if len(day) < HEADER.size:
+        return None
+    magic, version, index_length = HEADER.unpack_from(day, 0)
+    if magic != MAGIC or version != VERSION:
+        return None
+    index = json.loads(bytes(day[HEADER.size:HEADER.size + index_length]).decode('utf8'))
+    index['start'] = HEADER.size + index_length
+    index['scans'] = [(taken_at, {int(state): count for state, count in counts.items()}) for taken_at, counts in index['scans']]
+    return index
+
+def decode_column(day, index: dict, column: str) -> tuple:
+    """Decode one column of the runs of a day of history."""
+    _, offset, length = next(entry for entry in index['columns'] if entry[0] == column)
+    start = index['start'] + offset
+    if column == 'mac':
+        return tuple(bytes(day[start:start + length]).decode('utf8').split('\0')) if index['runs'] else ()
+    return struct.unpack_from(f"<{index['runs']}{KINDS[column]}", day, start)
+
+def decode_column_row(day, index: dict, column: str, row: int):
+    """Decode one value of a column of the runs of a day of history."""
+    _, offset, _ = next(entry for entry in index['columns'] if entry[0] == column)
+    kind = KINDS[column]
+    return struct.unpack_from(f'<{kind}', day, index['start'] + offset + row * struct.calcsize(f'<{kind}'))[0]
+
+def find_runs(day, index: dict, mac: str) -> list:
+    """Return the rows of the runs of a MAC in a day of history, without decoding every MAC."""
+    _, offset, length = index['columns'][0]
+    start = index['start'] + offset
+    macs = bytes(day[start:start + length])
+    needle = mac.encode('utf8')
+    rows = []
+    position = macs.find(needle)
+    row, counted_to = 0, 0
+    while position >= 0:
+        end = position + len(needle)
+        if (position == 0 or macs[position - 1] == 0) and (end == len(macs) or macs[end] == 0):
+            row += macs.count(SEPARATOR, counted_to, position)
+            counted_to = position
+            rows.append(row)
+        position = macs.find(needle, end)
+    return rows
+
+def encode_segment(taken_at: float, counts: dict, changed: dict, removed: list) -> bytes:
+    """Encode a scan to append to a day of history: how many devices were in each state, the devices
+    that are new or changed state since the previous scan ({mac: state}) and the MACs that have gone."""
+    encoded_counts = json.dumps(counts).encode('utf8')
+    encoded_changes = json.dumps({'changed': changed, 'removed': removed}).encode('utf8')
+    return SEGMENT.pack(SEGMENT_MAGIC, taken_at, len(encoded_counts), len(encoded_changes)) + encoded_counts + encoded_changes
+
+def decode_segments(day, index: dict, changes: bool = True) -> list:
+    """Decode the scans appended to a day of history since it was compacted, as a (taken_at, counts, changes)
+    per scan, where changes is ({mac: state}, set of removed MACs), or None unless asked for.
+    A scan cut short, e.g. by a crash while it was appended, and anything after it are ignored."""
+    segments = []
+    position = index['start'] + sum(length for _, _, length in index['columns'])
+    while position + SEGMENT.size <= len(day):
+        magic, taken_at, counts_length, changes_length = SEGMENT.unpack_from(day, position)
+        start = position + SEGMENT.size
+        position = start + counts_length + changes_length
+        if magic != SEGMENT_MAGIC or position > len(day):
+            break
+        counts = {int(state): count for state, count in json.loads(bytes(day[start:start + counts_length])).items()}
+        decoded_changes = None
+        if changes:
+            decoded_changes = json.loads(bytes(day[start + counts_length:position]))
+            decoded_changes = (decoded_changes['changed'], set(decoded_changes['removed']))
+        segments.append((taken_at, counts, decoded_changes))
+    return segments
+
+def fold_segments(runs: dict, scans: list, segments: list) -> None:
+    """Fold the scans appended to a day of history into its runs (a list per column) and scans, in place."""
+    times = [taken_at for taken_at, _ in scans]
+    # The row of the run of each device seen at the latest scan, and the scan that run's last and scans are up to
+    open_runs = {mac: (row, len(times) - 1) for row, mac in enumerate(runs['mac']) if runs['last'][row] == times[-1]}
+    for taken_at, counts, (changed, removed) in segments:
+        for mac in itertools.chain(changed, removed):
+            if mac in open_runs:
+                row, up_to = open_runs.pop(mac)
+                runs['last'][row] = times[-1]
+                runs['scans'][row] += len(times) - 1 - up_to
+        times.append(taken_at)
+        scans.append((taken_at, counts))
+        for mac, state in changed.items():
+            open_runs[mac] = (len(runs['mac']), len(times) - 1)
+            for column, value in zip(runs, (mac, state, taken_at, taken_at, 1)):
+                runs[column].append(value)
+    for row, up_to in open_runs.values():
+        runs['last'][row] = times[-1]
+        runs['scans'][row] += len(times) - 1 - up_to
+
+def fold_timeline(mac: str, runs: list, last_scan: float, segments: list) -> list:
+    """Fold the scans appended to a day of history into the runs (ports.StateRun) of one MAC."""
+    runs = list(runs)
+    current = runs[-1] if runs and runs[-1].last == last_scan else None
+    for taken_at, _, (changed, removed) in segments:
+        if mac in changed:
+            current = ports.StateRun(mac, changed[mac], taken_at, taken_at, 1)
+            runs.append(current)
+        elif mac in removed:
+            current = None
+        elif current:
+            current = current._replace(last=taken_at, scans=current.scans + 1)
+            runs[-1] = current
+    return runs
+
+class ScanHistoryAdapter(ports.ScanHistoryPort):
+    """Keeps the history in a directory next to devices.yml (history), or at scan_history, with a file per day
+    (e.g. 2026-10-18.history). A day's file holds, per device, a run for each stretch of consecutive scans
+    in the same state, and how many devices were in each state at each scan, so queries only read the days
+    they ask about, and counts only read each day's index.
+
+    After a day's first scan, each scan is appended to the file as just the devices that changed, so a tick
+    writes what changed rather than the whole day. Reads fold the appended scans in as they go, and the day
+    is compacted back into runs when the next day's history starts."""
+    # pylint: disable=logging-fstring-interpolation
+
+    def __init__(self, config: dict) -> None:
+        self.__logger = logging.getLogger("netorg")
+        self.directory = config.get('scan_history') or os.path.join(
+            os.path.dirname(config['devices_yml']), 'history')
+        # The file last appended to, its size after that, and the state of each device at that scan
+        self.__last = None
+
+    # overriding abstract method
+    def append(self,taken_at: float,macs: List[str],states: List[int]) -> None:
+        filename = self.__get_filename(datetime.fromtimestamp(taken_at).date())
+        states_by_mac = {}
+        for mac, state in zip(macs, states):
+            states_by_mac.setdefault(mac, state)
+        counts = dict(collections.Counter(states_by_mac.values()))
+        os.makedirs(self.directory, exist_ok=True)
+        previous_states = self.__get_previous_states(filename)
+        if previous_states is None:
+            self.__compact_previous_day(filename)
+            runs = {'mac': list(states_by_mac), 'state': list(states_by_mac.values()), 'first': [taken_at] * len(states_by_mac),
+                    'last': [taken_at] * len(states_by_mac), 'scans': [1] * len(states_by_mac)}
+            size = self.__write_day(filename, runs, [(taken_at, counts)])
+            self.__logger.debug(f"ScanHistoryAdapter.append() recorded {len(states_by_mac)} devices to {filename}")
+        else:
+            changed = {mac: state for mac, state in states_by_mac.items() if previous_states.get(mac) != state}
+            removed = [mac for mac in previous_states if mac not in states_by_mac]
+            with open(filename, 'ab') as day_file:
+                day_file.write(encode_segment(taken_at, counts, changed, removed))
+                size = day_file.tell()
+            self.__logger.debug(f"ScanHistoryAdapter.append() recorded {len(states_by_mac)} devices, "
+                                f"{len(changed)} changed and {len(removed)} gone, to {filename}")
+        self.__last = (filename, size, states_by_mac)
+
+    # overriding abstract method
+    def get_timeline(self,mac: str,start: float,end: float) -> Iterable[ports.StateRun]:
+        pending = None
+        previous_scan = None
+        for day, index in self.__map_days(start, end):
+            runs = [ports.StateRun(mac, *(decode_column_row(day, index, column, row) for column in KINDS))
+                    for row in find_runs(day, index, mac)]
+            segments = decode_segments(day, index)
+            if segments:
+                runs = fold_timeline(mac, runs, index['scans'][-1][0], segments)
+            first_scan = index['scans'][0][0] if index['scans'] else None
+            for run in runs:
+                # A run cut off at midnight carries on from the previous day
+                if (pending and run.first == first_scan and pending.last == previous_scan
+                        and pending.state == run.state):
+                    pending = pending._replace(last=run.last, scans=pending.scans + run.scans)
+                    continue
+                if pending and pending.last >= start and pending.first <= end:
+                    yield pending
+                pending = run
+            if segments:
+                previous_scan = segments[-1][0]
+            elif index['scans']:
+                previous_scan = index['scans'][-1][0]
+        if pending and pending.last >= start and pending.first <= end:
+            yield pending
+
+    # overriding abstract method
+    def get_state_counts(self,start: float,end: float) -> Iterable[ports.StateCounts]:
+        for day, index in self.__map_days(start, end):
+            for taken_at, counts in itertools.chain(
+                    index['scans'], ((taken_at, counts) for taken_at, counts, _ in decode_segments(day, index, changes=False))):
+                if start <= taken_at <= end:
+                    yield ports.StateCounts(taken_at, counts)
+
+    def __get_previous_states(self, filename: str) -> dict:
+        """Return the state of each device at the latest scan in a day's file, or None if there is no history
+        for the day yet. The states this adapter last appended are used as long as no one else has appended since."""
+        if not os.path.exists(filename):
+            return None
+        if self.__last and self.__last[0] == filename and os.path.getsize(filename) == self.__last[1]:
+            return self.__last[2]
+        runs, scans, _ = self.__read_day(filename)
+        if not scans:
+            return None
+        return {mac: state for mac, state, last in zip(runs['mac'], runs['state'], runs['last']) if last == scans[-1][0]}
+
+    def __compact_previous_day(self, filename: str) -> None:
+        """Compact the latest day before a day's file, now that no more scans will be appended to it."""
+        earlier = [entry for entry in os.listdir(self.directory)
+                   if entry.endswith(SUFFIX) and entry < os.path.basename(filename)]
+        if not earlier:
+            return
+        previous_filename = os.path.join(self.directory, max(earlier))
+        runs, scans, appended = self.__read_day(previous_filename)
+        if not appended:
+            return
+        self.__write_day(previous_filename, runs, scans)
+        self.__logger.debug(f"ScanHistoryAdapter compacted {len(scans)} scans in {len(runs['mac'])} runs to {previous_filename}")
+
+    @staticmethod
+    def __read_day(filename: str) -> tuple:
+        """Return the runs (a list per column) and scans of a day's file, with the appended scans folded in,
+        and how many scans had been appended."""
+        with open(filename, 'rb') as day_file:
+            day = day_file.read()
+        index = decode_index(day)
+        if index is None:
+            return {column: [] for column in ['mac'] + list(KINDS)}, [], 0
+        runs = {column: list(decode_column(day, index, column)) for column in ['mac'] + list(KINDS)}
+        scans = index['scans']
+        segments = decode_segments(day, index)
+        if segments:
+            fold_segments(runs, scans, segments)
+        return runs, scans, len(segments)
+
+    @staticmethod
+    def __write_day(filename: str, runs: dict, scans: list) -> int:
+        """Write a day's file, returning its size."""
+        encoded_day = encode_day(runs, scans)
+        # Write a new file and swap it in, so that readers always see a whole day
+        temporary_filename = f'{filename}.tmp'
+        with open(temporary_filename, 'wb') as day_file:
+            day_file.write(encoded_day)
+        os.replace(temporary_filename, filename)
+        return len(encoded_day)
+
+    def __map_days(self, start: float, end: float):
+        """Yield a memory map and the index of each day's file from start to end that this version can read."""
+        for filename in self.__get_filenames(start, end):
+            with open(filename, 'rb') as day_file:
+                if os.fstat(day_file.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(day_file.fileno(), 0, access=mmap.ACCESS_READ) as day:
+                    index = decode_index(day)
+                    if index is not None:
+                        yield day, index
+
+    def __get_filename(self, day: date) -> str:
+        return os.path.join(self.directory, f'{day.isoformat()}{SUFFIX}')
+
+    def __get_filenames(self, start: float, end: float) -> list:
+        """Return the files of the days from start to end that there is history for, in date order."""
+        if not os.path.isdir(self.directory):
+            self.__logger.debug(f"ScanHistoryAdapter {self.directory} not found")
+            return []
+        first_day = datetime.fromtimestamp(start).date()
+        last_day = datetime.fromtimestamp(end).date()
+        filenames = []
+        for entry in sorted(os.listdir(self.directory)):
+            if not entry.endswith(SUFFIX):
+                continue
+            try:
+                day = date.fromisoformat(entry[:-len(SUFFIX)])
+            except ValueError:
+                continue
+            if first_day <= day <= last_day:
+                filenames.append(os.path.join(self.directory, entry))
+        return filenames
@@ -0,0 +1,63 @@
+"""Responsible for loading the user's scan rules from a YAML file."""
+import hashlib
+import json
+import logging
+import os
+import os.path
+import yaml
+from netorg_core import ports
+
+class ScanRulesAdapter(ports.ScanRulesPort):
+    """Loads the scan rules from scan_rules.yml next to devices.yml, or from the scan_rules setting.
+    The parsed rules are kept as JSON in scan_rules.cache next to the rules file (or at scan_rules_cache)
+    with the digest of the rules file, so that the YAML is only parsed again when the rules file changes."""
+    # pylint: disable=logging-fstring-interpolation
+
+    def __init__(self, config: dict) -> None:
+        self.__logger = logging.getLogger("netorg")
+        self.filename = config.get('scan_rules') or os.path.join(
+            os.path.dirname(config['devices_yml']), 'scan_rules.yml')
+        self.cache_filename = config.get('scan_rules_cache') or os.path.join(
+            os.path.dirname(self.filename), 'scan_rules.cache')
+
+    # overriding abstract method
+    def load(self) -> ports.ScanRules:
+        if not os.path.exists(self.filename):
+            self.__logger.debug(f"ScanRulesAdapter.load() {self.filename} not found")
+            return ports.ScanRules('', [])
+        with open(self.filename, 'rb') as scan_rules_file:
+            contents = scan_rules_file.read()
+        digest = hashlib.sha256(contents).hexdigest()
+        scan_rules = self.__load_cache(digest)
+        if scan_rules is None:
+            yaml_data = yaml.safe_load(contents) or {}
+            rules = yaml_data.get('rules') or []
+            if not isinstance(rules, list):
+                raise ValueError(f'{self.filename}: rules must be a list')
+            scan_rules = ports.ScanRules(digest, rules)
+            self.__logger.debug(f"ScanRulesAdapter.load() loaded {len(rules)} scan rules from {self.filename}")
+            self.__save_cache(scan_rules)
+        return scan_rules
+
+    def __load_cache(self, digest: str) -> ports.ScanRules:
+        """Return the cached rules if they were parsed from a rules file with this digest, otherwise None."""
+        try:
+            with open(self.cache_filename, 'r', encoding='utf8') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cache, dict) or cache.get('digest') != digest or not isinstance(cache.get('rules'), list):
+            return None
+        self.__logger.debug(f"ScanRulesAdapter.load() loaded {len(cache['rules'])} scan rules from {self.cache_filename}")
+        return ports.ScanRules(digest, cache['rules'])
+
+    def __save_cache(self, scan_rules: ports.ScanRules) -> None:
+        """Keep the parsed rules for the next run. Rules that JSON cannot hold are just not cached."""
+        temporary_filename = f'{self.cache_filename}.tmp'
+        try:
+            encoded = json.dumps(scan_rules._asdict())
+            with open(temporary_filename, 'w', encoding='utf8') as cache_file:
+                cache_file.write(encoded)
+            os.replace(temporary_filename, self.cache_filename)
+        except (OSError, TypeError, ValueError) as error:
+            self.__logger.debug(f"ScanRulesAdapter could not cache the rules in {self.cache_filename}: {error}")
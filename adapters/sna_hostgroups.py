@@ -2,8 +2,8 @@
 import logging
 import re
 import json
-from deepdiff import DeepDiff
 from netorg_core import devicetable
+from netorg_core import networkspace
 from netorg_core import ports
 
 # pylint: disable=logging-fstring-interpolation
@@ -29,7 +29,7 @@ class SecureNetworkAnalyticsHostGroupManagementAdapter(ports.SecureNetworkAnalyt
     # overriding abstract method
     def update_host_groups(self,device_table: devicetable.DeviceTable) -> None:
         if self.__is_configured():
-            hostgroups = self.__build_hostgroups(device_table.get_df())
+            hostgroups = self.__build_hostgroups(device_table)
             self.__sna_session_port.login(
                     self.host,
                     self.username,
@@ -45,37 +45,23 @@ class SecureNetworkAnalyticsHostGroupManagementAdapter(ports.SecureNetworkAnalyt
             return False
         return True
 
-    def __build_hostgroups(self, df):
-        """From the specified DataFrame, build a dictionary of hostgroups.
+    def __build_hostgroups(self, device_table):
+        """From the specified device table, build a dictionary of hostgroups.
+        Contiguous IPs are collapsed into CIDRs.
         Returns something similar to the following:
         hostgroups = {
-            'Lights': ['192.168.128.10', '192.168.128.191', '192.168.128.192'],
+            'Lights': ['192.168.128.10', '192.168.128.192/31'],
             'Eero':   ['192.168.128.11'],
             'Ring': ['192.168.128.15', '192.168.128.16', '192.168.128.17'],
             'Laptops': ['192.168.128.190']
         }
         """
-        # pylint: disable=invalid-name
         hostgroups = {}
-        groups = self.__get_groups(df)
-        for group_name in groups :
-            hostgroups[group_name] = self.__get_device_ips_in_group(df,group_name)
+        for group_name in device_table.get_group_names() :
+            list_of_ips = device_table.get_ips(device_table.get_rows_for_group(group_name))
+            hostgroups[group_name] = networkspace.summarize_addresses(list_of_ips)
         return hostgroups
 
-    def __get_groups(self, df) -> list :
-        """Produce a list of all unique groups in the device table."""
-        # pylint: disable=invalid-name
-        return df.group.unique().tolist()
-
-    def __get_device_ips_in_group(self, df, group_name) -> list:
-        """Produce a list of all device IPs in specified group."""
-        # pylint: disable=unused-variable
-        # pylint: disable=invalid-name
-        list_of_ips = []
-        for index, row in df.query(f'group == "{group_name}"').iterrows():
-            list_of_ips.append(row["ip"])
-        return list_of_ips
-
 class SnaHostGroupManager:
     """Facade for the Secure Network Analytics Host Group REST API."""
 
@@ -120,6 +106,9 @@ class SnaHostGroupManager:
 
     def analyze_changes(self, old, new): # Tested
         """Analyze the changes between what currently exists and the new modifications."""
+        # deepdiff imports pandas if it is installed, so only import it when there is something to compare
+        # pylint: disable=import-outside-toplevel
+        from deepdiff import DeepDiff
         diff = DeepDiff(old, new)
         self.hostgroups_to_create_set = SnaHostGroupManager.get_hostgroups_to_create(diff)
         self.hostgroups_to_update_set = SnaHostGroupManager.get_hostgroups_to_update(diff)
@@ -0,0 +1,77 @@
+"""
+Benchmark for loading many devices into a device table.
+
+Run from $NETORG_HOME:
+    python3 -m benchmarks.bench_devicetableloader [--devices 1000000]
+"""
+import argparse
+import time
+from typing import List
+from netorg_core import devicetableloader
+from netorg_core import ports
+
+def generate_mac(i: int) -> str:
+    """Generate a MAC for the i'th device."""
+    return f'02:00:{(i >> 24) & 0xff:02x}:{(i >> 16) & 0xff:02x}:{(i >> 8) & 0xff:02x}:{i & 0xff:02x}'
+
+def generate_ip(i: int) -> str:
+    """Generate an IP address for the i'th device."""
+    return f'10.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}'
+
+class KnownDevicesBenchAdapter(ports.KnownDevicesPort):
+    """Every other device is known."""
+
+    def __init__(self, number_of_devices: int) -> None:
+        self.known_devices = [ports.KnownDevice(name=f'device-{i}', mac=generate_mac(i), group=f'group-{i % 50}')
+                              for i in range(0, number_of_devices, 2)]
+
+    def load(self) -> List[ports.KnownDevice]:
+        return self.known_devices
+
+    def save(self, device_table) -> None:
+        pass
+
+class ActiveClientsBenchAdapter(ports.ActiveClientsPort):
+    """Every third device is active."""
+
+    def __init__(self, number_of_devices: int) -> None:
+        self.active_clients = [ports.ActiveClient(mac=generate_mac(i), name=f'client-{i}', ip_address=generate_ip(i))
+                               for i in range(0, number_of_devices, 3)]
+
+    def load(self) -> List[ports.ActiveClient]:
+        return self.active_clients
+
+class FixedIpReservationsBenchAdapter(ports.FixedIpReservationsPort):
+    """Every third device, offset by one, is reserved."""
+
+    def __init__(self, number_of_devices: int) -> None:
+        self.fixed_ip_reservations = [ports.FixedIpReservation(mac=generate_mac(i), name=f'reserved-{i}', ip_address=generate_ip(i))
+                                      for i in range(1, number_of_devices, 3)]
+
+    def load(self) -> List[ports.FixedIpReservation]:
+        return self.fixed_ip_reservations
+
+    def save(self, device_table) -> None:
+        pass
+
+def bench_load(number_of_devices: int) -> float:
+    """Time DeviceTableLoader.load_all()."""
+    device_table_loader = devicetableloader.DeviceTableLoader(
+        known_devices_port=KnownDevicesBenchAdapter(number_of_devices),
+        active_clients_port=ActiveClientsBenchAdapter(number_of_devices),
+        fixed_ip_reservations_port=FixedIpReservationsBenchAdapter(number_of_devices))
+    start = time.perf_counter()
+    device_table_loader.load_all()
+    return time.perf_counter() - start
+
+def main():
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description='Benchmark device table loading.')
+    parser.add_argument("--devices", type=int, default=1000000)
+    args = parser.parse_args()
+    for number_of_devices in (args.devices // 100, args.devices // 10, args.devices):
+        elapsed = bench_load(number_of_devices)
+        print(f'load_all {number_of_devices} devices: {elapsed:.3f}s')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark for mapping many new devices into a network space.
+
+Run from $NETORG_HOME:
+    python3 -m benchmarks.bench_networkmapper [--devices 50000] [--cidr 10.1.0.0/16]
+"""
+import argparse
+import time
+from netorg_core import devicetable
+from netorg_core import networkspace
+
+def generate_new_devices(number_of_devices: int) -> devicetable.DeviceTable:
+    """Generate a device table of known devices that do not have an IP."""
+    data = [{
+        'mac': f'02:00:{(i >> 24) & 0xff:02x}:{(i >> 16) & 0xff:02x}:{(i >> 8) & 0xff:02x}:{i & 0xff:02x}',
+        'known': True,
+        'reserved': False,
+        'active': False,
+        'ip': '',
+        'group': 'unclassified',
+        'name': f'device-{i}'} for i in range(number_of_devices)]
+    return devicetable.DeviceTable(data)
+
+def bench_allocate(cidr: str, space_type: str, number_of_devices: int) -> float:
+    """Time allocate_address() alone."""
+    start = time.perf_counter()
+    network_space = networkspace.create_network_space(cidr, space_type)
+    for _ in range(number_of_devices):
+        network_space.allocate_address()
+    return time.perf_counter() - start
+
+def bench_map(cidr: str, space_type: str, number_of_devices: int, allocation_policy: str) -> float:
+    """Time NetworkMapper.map_to_network_space() for a table of new devices."""
+    device_table = generate_new_devices(number_of_devices)
+    start = time.perf_counter()
+    network_mapper = networkspace.NetworkMapper(cidr, device_table, space_type, allocation_policy=allocation_policy)
+    network_mapper.map_to_network_space()
+    return time.perf_counter() - start
+
+def main():
+    """Run the benchmarks and print the timings."""
+    parser = argparse.ArgumentParser(description='Benchmark network space allocation.')
+    parser.add_argument("--devices", type=int, default=50000)
+    parser.add_argument("--cidr", default="10.1.0.0/16")
+    args = parser.parse_args()
+    for space_type in networkspace.NETWORK_SPACE_TYPES:
+        elapsed = bench_allocate(args.cidr, space_type, args.devices)
+        print(f'{space_type:>8} allocate_address x {args.devices} in {args.cidr}: {elapsed:.3f}s')
+    for allocation_policy in (networkspace.SEQUENTIAL, networkspace.HASHED):
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            elapsed = bench_map(args.cidr, space_type, args.devices, allocation_policy)
+            print(f'{space_type:>8} map_to_network_space ({allocation_policy}) {args.devices} new devices in {args.cidr}: {elapsed:.3f}s')
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,34 @@
 """This is the main module for Netorg."""
 import argparse
+import datetime
 import logging
 import sys
 from adapters import activeclients_meraki
+from adapters import capacityreportout_console
 from adapters import configuration_jsonfile
 from adapters import configurationwizard_console
 from adapters import configurationwizard_sna_console
 from adapters import devicetableout_console
+from adapters import devicetablesnapshot_file
 from adapters import fixedipreservations_meraki
 from adapters import knowndevices_yamlfile
+from adapters import scanfindingsout_jsonl
+from adapters import scanhistory_file
+from adapters import scanrules_yamlfile
 from adapters import sna_hostgroups
 from adapters import sna_session
 from netorg_core import app
+from netorg_core import devicetable
+from netorg_core import devicetableloader
+from netorg_core import history
+from netorg_core import validation
+from netorg_core import watch
 
-def init_logging(debug_flag: bool) -> None:
+def init_logging(debug_flag: bool, info_to_stderr: bool = False) -> None:
     """ Initialize logging so that
            only debug, info -> stdout (and only stdout)
            only warning, error, critical -> stderr (and only stderr)
+        info_to_stderr sends debug and info to stderr too, leaving stdout to machine-readable output.
     """
     class InfoFilter(logging.Filter):
         # pylint: disable=too-few-public-methods
@@ -25,7 +37,7 @@ def init_logging(debug_flag: bool) -> None:
             return record.levelno in (logging.DEBUG, logging.INFO)
 
     logger = logging.getLogger("netorg")
-    info_channel = logging.StreamHandler(sys.stdout)
+    info_channel = logging.StreamHandler(sys.stderr if info_to_stderr else sys.stdout)
     info_channel.addFilter(InfoFilter())
     if debug_flag:
         logger.setLevel(logging.DEBUG)
@@ -49,9 +61,14 @@ def init_logging(debug_flag: bool) -> None:
     logger.addHandler(info_channel)
     logger.addHandler(error_channel)
 
-def create_net_organizer_app(debug_flag: bool) -> app.NetOrganizerApp:
-    """Create the NetOrganizerApp object."""
-    init_logging(debug_flag)
+def create_net_organizer_app(debug_flag: bool, output_format: str = 'text', backend: str = None,
+                             snapshot_max_age: float = None, output: str = None) -> app.NetOrganizerApp:
+    """Create the NetOrganizerApp object.
+    backend, if given, overrides the device_table_backend setting.
+    snapshot_max_age, if given, is how old (in seconds) a device table snapshot may be and still be used.
+    With the jsonl output_format, scan findings are streamed to output (a file name) or stdout."""
+    # pylint: disable=too-many-arguments
+    init_logging(debug_flag, info_to_stderr=output_format in ('json', 'jsonl'))
     configuration_port = configuration_jsonfile.NetorgConfigurationAdapter()
     config = configuration_port.load()
     net_organizer_app = app.NetOrganizerApp(
@@ -62,7 +79,19 @@ def create_net_organizer_app(debug_flag: bool) -> app.NetOrganizerApp:
         sna_hostgroup_port=sna_hostgroups.SecureNetworkAnalyticsHostGroupManagementAdapter(
             config,
             sna_session_port=sna_session.SecureNetworkAnalyticsSessionAdapter()
-        )
+        ),
+        capacity_report_out_port=capacityreportout_console.CapacityReportOutAdapter(config, output_format),
+        load_concurrency=config.get('load_concurrency', devicetableloader.DEFAULT_LOAD_CONCURRENCY),
+        device_table_backend=backend or config.get('device_table_backend', devicetable.DEFAULT_BACKEND),
+        device_table_snapshot_port=devicetablesnapshot_file.DeviceTableSnapshotAdapter(config),
+        device_table_changes_cursor_port=devicetablesnapshot_file.DeviceTableSnapshotAdapter(
+            config, 'device_table_changes_cursor', 'devices.changes'),
+        snapshot_max_age=snapshot_max_age,
+        validation_policy=config.get('validation_policy', validation.ABORT),
+        scan_rules_port=scanrules_yamlfile.ScanRulesAdapter(config),
+        scan_findings_out_port=scanfindingsout_jsonl.ScanFindingsOutAdapter(config, output) if output_format == 'jsonl' else None,
+        watch_jitter=config.get('watch_jitter', watch.DEFAULT_JITTER),
+        scan_history_port=scanhistory_file.ScanHistoryAdapter(config)
     )
     return net_organizer_app
 
@@ -77,6 +106,16 @@ def do_configure() -> None:
     net_organizer_configurator = configuration_jsonfile.NetorgConfigurationAdapter()
     net_organizer_configurator.save(merged)
 
+def positive_float(value: str) -> float:
+    """Parse a finite number of seconds that must be more than zero."""
+    try:
+        number = float(value)
+    except ValueError as exception:
+        raise argparse.ArgumentTypeError(f'{value} is not a number') from exception
+    if not 0 < number < float('inf'):
+        raise argparse.ArgumentTypeError(f'{value} is not a positive number of seconds')
+    return number
+
 def get_parser() -> argparse.ArgumentParser:
     """Build and return an CLI argument parser."""
     parser = argparse.ArgumentParser(description='Organize your network.')
@@ -101,26 +140,121 @@ def get_parser() -> argparse.ArgumentParser:
         "-e", "--export",
         help="Export the device table",
         action="store_true")
+    group.add_argument(
+        "--capacity",
+        help="Report how full each VLAN's network space is, without changing anything.",
+        action="store_true")
+    group.add_argument(
+        "-w", "--watch",
+        help="Keep running, loading the device table every --interval seconds and reporting only the devices that changed.",
+        action="store_true")
+    group.add_argument(
+        "--history",
+        help="Report how many devices were in each scan finding, by day, or with a MAC the device's state over time and when it was last active.",
+        nargs="?",
+        const="",
+        metavar="MAC")
+    parser.add_argument(
+        "--since",
+        help=f"With --history, the first day to report on (default {history.DEFAULT_DAYS} days ago).",
+        metavar="YYYY-MM-DD",
+        type=datetime.date.fromisoformat)
+    parser.add_argument(
+        "--until",
+        help="With --history, the last day to report on (default today).",
+        metavar="YYYY-MM-DD",
+        type=datetime.date.fromisoformat)
+    parser.add_argument(
+        "--interval",
+        help=f"With --watch, how many seconds between loads of the device table (default {watch.DEFAULT_INTERVAL}).",
+        metavar="SECONDS",
+        type=positive_float,
+        default=watch.DEFAULT_INTERVAL)
+    parser.add_argument(
+        "--format",
+        help="Output format. --capacity takes text, json or jsonl; --scan takes text or jsonl, which writes one JSON object per line for each device found.",
+        choices=['text', 'json', 'jsonl'],
+        default='text')
+    parser.add_argument(
+        "--output",
+        help="With --scan --format jsonl, write to this file instead of stdout.",
+        metavar="FILE")
+    parser.add_argument(
+        "--backend",
+        help="How the device table is held. \"python\" starts faster on small networks. Overrides the device_table_backend setting.",
+        choices=devicetable.BACKENDS)
+    parser.add_argument(
+        "--changes",
+        help="With --export, export only the devices added, removed or changed since the last --export --changes, flagging which columns changed.",
+        action="store_true")
+    snapshot_group = parser.add_mutually_exclusive_group()
+    snapshot_group.add_argument(
+        "--offline",
+        help="Use the device table snapshot from the last run instead of loading devices.yml and Meraki (--scan, --export, --capacity).",
+        action="store_true")
+    snapshot_group.add_argument(
+        "--max-age",
+        help="Use the device table snapshot from the last run if it is at most SECONDS old (--scan, --export, --capacity).",
+        metavar="SECONDS",
+        type=float)
     return parser
 
+def check_output_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Reject --format and --output where they would be ignored."""
+    if args.format != 'text' and not (args.capacity or args.scan):
+        parser.error('--format can only be used with --capacity or --scan')
+    if args.scan and args.format not in ('text', 'jsonl'):
+        parser.error(f'--scan supports --format text or jsonl, not {args.format}')
+    if args.output is not None and not (args.scan and args.format == 'jsonl'):
+        parser.error('--output can only be used with --scan --format jsonl')
+
+def get_snapshot_max_age(args: argparse.Namespace) -> float:
+    """Return how old a device table snapshot may be and still be used, or None to not use one."""
+    if args.offline:
+        return float('inf')
+    return args.max_age
+
+def get_history_period(args: argparse.Namespace) -> tuple:
+    """Return the start and end (seconds since the epoch) of the days to report the history of."""
+    until = args.until or datetime.date.today()
+    since = args.since or until - datetime.timedelta(days=history.DEFAULT_DAYS)
+    return (datetime.datetime.combine(since, datetime.time.min).timestamp(),
+            datetime.datetime.combine(until, datetime.time.max).timestamp())
+
 def main():
     """The main program for netorg CLI."""
     parser = get_parser()
     args = parser.parse_args()
+    check_output_args(parser, args)
     debug_flag = False
     if args.verbose:
         debug_flag = True
     if args.configure:
         do_configure()
     elif args.scan:
-        net_organizer_app = create_net_organizer_app(debug_flag)
+        net_organizer_app = create_net_organizer_app(debug_flag, args.format, args.backend, get_snapshot_max_age(args), args.output)
         net_organizer_app.do_scan()
     elif args.organize:
-        net_organizer_app = create_net_organizer_app(debug_flag)
+        net_organizer_app = create_net_organizer_app(debug_flag, backend=args.backend)
         net_organizer_app.do_organize()
     elif args.export:
+        if args.changes and get_snapshot_max_age(args) is not None:
+            parser.error('--changes cannot be used with --offline or --max-age: the changes are worked out from a fresh load')
+        net_organizer_app = create_net_organizer_app(debug_flag, backend=args.backend, snapshot_max_age=get_snapshot_max_age(args))
+        net_organizer_app.do_export(args.changes)
+    elif args.capacity:
+        net_organizer_app = create_net_organizer_app(debug_flag, args.format, args.backend, get_snapshot_max_age(args))
+        net_organizer_app.do_capacity()
+    elif args.history is not None:
         net_organizer_app = create_net_organizer_app(debug_flag)
-        net_organizer_app.do_export()
+        start, end = get_history_period(args)
+        net_organizer_app.do_history(start, end, args.history or None)
+    elif args.watch:
+        net_organizer_app = create_net_organizer_app(debug_flag, backend=args.backend)
+        try:
+            net_organizer_app.do_watch(args.interval)
+        except KeyboardInterrupt:
+            pass
     else:
         parser.print_help(sys.stderr)
 
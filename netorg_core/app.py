@@ -2,12 +2,22 @@
 The main NetOrganizerApp which supports all the top-level use cases.
 Should be dependent only on ports - never directly adapaters.
 """
+import logging
+import time
+from netorg_core import devicetable
+from netorg_core import devicetablechanges
 from netorg_core import devicetableloader
+from netorg_core import history
+from netorg_core import networkspace
 from netorg_core import ports
 from netorg_core import scan
+from netorg_core import scanrules
+from netorg_core import validation
+from netorg_core import watch
 
 class NetOrganizerApp():
     """The main NetOrganizerApp which supports all the top-level use cases."""
+    # pylint: disable=logging-fstring-interpolation
 
     # pylint: disable=too-many-arguments
     def __init__(self,
@@ -15,38 +25,234 @@ class NetOrganizerApp():
                  active_clients_port: ports.ActiveClientsPort,
                  fixed_ip_reservations_port: ports.FixedIpReservationsPort,
                  device_table_csv_out_port: ports.DeviceTableCsvOutPort,
-                 sna_hostgroup_port: ports.SecureNetworkAnalyticsHostGroupManagementPort) -> None:
+                 sna_hostgroup_port: ports.SecureNetworkAnalyticsHostGroupManagementPort,
+                 capacity_report_out_port: ports.CapacityReportOutPort = None,
+                 load_concurrency: int = devicetableloader.DEFAULT_LOAD_CONCURRENCY,
+                 device_table_backend: str = None,
+                 device_table_snapshot_port: ports.DeviceTableSnapshotPort = None,
+                 device_table_changes_cursor_port: ports.DeviceTableSnapshotPort = None,
+                 snapshot_max_age: float = None,
+                 validation_policy: str = validation.ABORT,
+                 scan_rules_port: ports.ScanRulesPort = None,
+                 scan_findings_out_port: ports.ScanFindingsOutPort = None,
+                 watch_jitter: float = watch.DEFAULT_JITTER,
+                 scan_history_port: ports.ScanHistoryPort = None) -> None:
+        if validation_policy not in validation.VALIDATION_POLICIES:
+            raise ValueError(f'unknown validation policy {validation_policy}')
+        self.__logger = logging.getLogger("netorg")
         self.known_devices_port = known_devices_port
         self.active_clients_port = active_clients_port
         self.fixed_ip_reservations_port = fixed_ip_reservations_port
         self.device_table_csv_out_port = device_table_csv_out_port
         self.sna_hostgroup_port = sna_hostgroup_port
+        self.capacity_report_out_port = capacity_report_out_port
+        self.load_concurrency = load_concurrency
+        self.device_table_backend = device_table_backend
+        self.device_table_snapshot_port = device_table_snapshot_port
+        # The device table as of the last export of the changes, which only that reads and moves on
+        self.device_table_changes_cursor_port = device_table_changes_cursor_port
+        # Use a snapshot up to this many seconds old instead of loading from the ports;
+        # None never uses one, infinity always does (offline)
+        self.snapshot_max_age = snapshot_max_age
+        # What organize does about duplicate and out-of-subnet addresses: abort, or reassign them
+        self.validation_policy = validation_policy
+        self.scan_rules_port = scan_rules_port
+        # If given, scan streams its findings here rather than reporting them
+        self.scan_findings_out_port = scan_findings_out_port
+        # How much watch spreads each wait either way, as a fraction of it
+        self.watch_jitter = watch_jitter
+        # If given, each scan (and watch tick) records the state of every device here
+        self.scan_history_port = scan_history_port
 
     def do_scan(self) -> None:
-        """Perform a scan."""
-        device_table = self.__load_device_table()
-        self.known_devices_port.save(device_table)
-        scanner = scan.NetorgScanner(device_table)
+        """Perform a scan. Working from the snapshot, nothing is written back: devices.yml
+        may have been edited since the snapshot was taken."""
+        device_table, _, loaded_at = self.__load()
+        if loaded_at is not None:
+            self.__record_history(device_table, loaded_at)
+            self.known_devices_port.save(device_table)
+        rules = scanrules.compile_rules(self.scan_rules_port.load()) if self.scan_rules_port else []
+        scanner = scan.NetorgScanner(device_table, rules)
+        if self.scan_findings_out_port:
+            self.scan_findings_out_port.write(scanner.stream())
+            return
         scanner.run()
         scanner.report()
 
     def do_organize(self) -> None:
-        """Organize the network."""
-        device_table = self.__load_device_table()
-        self.known_devices_port.save(device_table)
-        self.fixed_ip_reservations_port.save(device_table)
+        """Organize the network. Nothing is changed if the device table has conflicts,
+        unless the validation policy is to give the conflicting devices new addresses.
+        Runs sharing state take turns from loading the reservations to saving them."""
+        with self.fixed_ip_reservations_port.locked():
+            device_table_loader = self.__create_device_table_loader()
+            device_table = device_table_loader.load_all()
+            self.__apply_validation_policy(device_table, device_table_loader.validation_report)
+            self.known_devices_port.save(device_table)
+            self.fixed_ip_reservations_port.save(device_table)
         if self.sna_hostgroup_port:
             self.sna_hostgroup_port.update_host_groups(device_table)
+        # Organizing changes the reservations, so any snapshot is now out of date
+        if self.device_table_snapshot_port:
+            self.device_table_snapshot_port.clear()
+
+    def do_export(self, changes: bool = False) -> None:
+        """Export the devices table, or with changes only the devices that changed since the last time
+        the changes were exported. The changes are always worked out from a fresh load."""
+        if not changes:
+            device_table, _, _ = self.__load()
+            self.device_table_csv_out_port.write(device_table.to_csv())
+            return
+        if self.snapshot_max_age is not None:
+            raise ValueError('the changes are worked out from a fresh load, so cannot be exported from the snapshot')
+        cursor_port = self.device_table_changes_cursor_port
+        device_table, device_table_changes, _ = self.__load(cursor_port)
+        if device_table_changes is None:
+            # Without a previous export to compare with, every device is new
+            device_table_changes = devicetablechanges.DeviceTableChanges(None, device_table)
+        self.device_table_csv_out_port.write(device_table_changes.to_csv())
+        if cursor_port:
+            cursor_port.save(device_table)
 
-    def do_export(self) -> None:
-        """Export the devices table."""
+    def do_capacity(self) -> None:
+        """Report on the capacity of the network space without changing anything."""
         device_table = self.__load_device_table()
-        self.device_table_csv_out_port.write(device_table.get_df().to_csv())
+        self.capacity_report_out_port.write(self.fixed_ip_reservations_port.get_capacity(device_table))
+
+    def do_watch(self, interval: float = watch.DEFAULT_INTERVAL, ticks: int = None) -> None:
+        """Load the device table every interval seconds, reporting only the devices that changed since the last tick,
+        e.g. going from not active to active. The ports (and so their sessions) are kept between ticks.
+        A load that fails is retried with exponential backoff; every wait is jittered (see watch.get_delay()).
+        ticks, if given, is how many times to load the device table, otherwise watch until interrupted."""
+        previous_device_table = None
+        failures = 0
+        tick = 0
+        while True:
+            tick += 1
+            try:
+                previous_device_table = self.__watch_tick(previous_device_table)
+                failures = 0
+            except Exception as error: # pylint: disable=broad-except
+                failures += 1
+                self.__logger.warning(f'watch: loading the device table failed ({failures} in a row): {error}')
+            if ticks is not None and tick >= ticks:
+                return
+            delay = watch.get_delay(interval, failures, self.watch_jitter)
+            self.__logger.debug(f'watch: next tick in {delay:.1f}s')
+            time.sleep(delay)
+
+    def __watch_tick(self, previous_device_table):
+        """Load the device table and report what changed since the previous one (on the first tick,
+        since the snapshot, if there is one). The snapshot is kept up to date. Returns the device table."""
+        start = time.perf_counter()
+        loaded_at = time.time()
+        if previous_device_table is None:
+            device_table_loader = self.__create_device_table_loader(self.device_table_snapshot_port)
+            device_table = device_table_loader.load_all()
+            changes = device_table_loader.changes if device_table_loader.previous_device_table is not None else None
+        else:
+            device_table = self.__create_device_table_loader().load_all()
+            changes = devicetablechanges.DeviceTableChanges(previous_device_table, device_table)
+        if self.device_table_snapshot_port:
+            self.device_table_snapshot_port.save(device_table)
+        self.__record_history(device_table, loaded_at)
+        if changes is None:
+            self.__logger.info(f'watch: watching {device_table.get_size()} devices')
+            return device_table
+        descriptions = watch.describe_changes(changes)
+        for description in descriptions:
+            self.__logger.info(description)
+        self.__logger.debug(f'watch: {len(descriptions)} devices changed, in {time.perf_counter() - start:.3f}s')
+        return device_table
+
+    def do_history(self, start: float, end: float, mac: str = None) -> None:
+        """Report on the history from start to end (seconds since the epoch): with a MAC, the device's state
+        over time and when it was last active, otherwise how many devices were in each finding, by day."""
+        if not self.scan_history_port:
+            raise ValueError('no scan history to report on')
+        period = f'between {history.format_time(start)} and {history.format_time(end)}'
+        if mac:
+            mac = devicetable.normalize_mac(mac)
+            timeline = list(self.scan_history_port.get_timeline(mac, start, end))
+            if not timeline:
+                self.__logger.info(f'No history of {mac} {period}')
+                return
+            for run in timeline:
+                self.__logger.info(f'{history.format_time(run.first)} to {history.format_time(run.last)}: '
+                                   f'{history.describe_state(run.state)} ({run.scans} scans)')
+            last_active = history.get_last_active(timeline)
+            if last_active is None:
+                self.__logger.info(f'{mac} was not active {period}')
+            else:
+                self.__logger.info(f'{mac} was last active at {history.format_time(last_active)}')
+            return
+        days = history.count_findings_by_day(self.scan_history_port.get_state_counts(start, end))
+        if not days:
+            self.__logger.info(f'No history {period}')
+            return
+        for day, (scans, findings) in days.items():
+            self.__logger.info(f'{day} ({scans} scans), the most devices at a scan that were:')
+            for finding, count in findings.items():
+                if count:
+                    self.__logger.info(f'   {finding}: {count}')
+
+    def __record_history(self, device_table, taken_at: float) -> None:
+        """Record the state of every device in the history, if there is one."""
+        if self.scan_history_port:
+            self.scan_history_port.append(taken_at, device_table.get_macs(), history.get_states(device_table))
 
     def __load_device_table(self):
         """Load the device table."""
-        device_table_loader = devicetableloader.DeviceTableLoader(
+        device_table, _, _ = self.__load()
+        return device_table
+
+    def __load(self, previous_device_table_port: ports.DeviceTableSnapshotPort = None) -> tuple:
+        """Load the device table, from the snapshot if there is a recent enough one,
+        otherwise from the ports (then snapshot it). Returns it along with the changes since the device table
+        held by previous_device_table_port (None without one) and when it was loaded from the ports
+        (None if it came from the snapshot). The changes are only worked out when loading from the ports."""
+        snapshot_port = self.device_table_snapshot_port
+        if snapshot_port and self.snapshot_max_age is not None:
+            device_table = snapshot_port.load(self.snapshot_max_age, self.device_table_backend)
+            if device_table is not None:
+                return device_table, None, None
+            if self.snapshot_max_age == float('inf'):
+                raise ValueError('no device table snapshot to work offline with, run without --offline first')
+        loaded_at = time.time()
+        device_table_loader = self.__create_device_table_loader(previous_device_table_port)
+        device_table = device_table_loader.load_all()
+        if snapshot_port:
+            snapshot_port.save(device_table)
+        return device_table, device_table_loader.changes, loaded_at
+
+    def __create_device_table_loader(self, previous_device_table_port: ports.DeviceTableSnapshotPort = None):
+        """Create a loader for the device table; given a port holding a previous device table,
+        the loader also works out the changes since it."""
+        return devicetableloader.DeviceTableLoader(
             self.known_devices_port,
             self.active_clients_port,
-            self.fixed_ip_reservations_port)
-        return device_table_loader.load_all()
+            self.fixed_ip_reservations_port,
+            self.load_concurrency,
+            self.device_table_backend,
+            previous_device_table_port)
+
+    def __apply_validation_policy(self, device_table, validation_report) -> None:
+        """Report the issues found in the device table, then either abort on any conflicts
+        or clear the conflicting addresses so that the devices are given new ones."""
+        for issue in validation_report.get_issues(validation.LEASE_DRIFT):
+            self.__logger.info(f'for {issue.name} reservation {issue.ip_address} differs to current lease {issue.detail}, using {issue.ip_address}')
+        conflicts = validation_report.get_conflicts()
+        if not conflicts:
+            return
+        for issue in conflicts:
+            if issue.kind == validation.DUPLICATE_IP:
+                self.__logger.warning(f'{issue.name} ({issue.mac}) has {issue.ip_address}, as does {issue.detail}')
+            else:
+                self.__logger.warning(f'{issue.name} ({issue.mac}) has {issue.ip_address}, which is outside the network space')
+        if self.validation_policy == validation.REASSIGN:
+            rows = validation_report.get_rows_to_reassign()
+            self.__logger.warning(f'giving {len(rows)} devices a new address')
+            device_table.set_ips(rows, [''] * len(rows))
+            return
+        out_of_range = [issue.ip_address for issue in validation_report.get_issues(validation.OUT_OF_SUBNET)]
+        duplicates = list(dict.fromkeys(issue.ip_address for issue in validation_report.get_issues(validation.DUPLICATE_IP)))
+        raise networkspace.InvalidAddresses(out_of_range, duplicates)
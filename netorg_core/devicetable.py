@@ -1,14 +1,218 @@
 """All the things associated with Loading, building and accessing a device table."""
-import pandas as pd
-from pandas import DataFrame
-
-# pylint: disable=too-few-public-methods
-class DeviceTable :
-    """The device table is the heart of Network Organizer."""
-    def __init__(self,data) -> None:
-        # pylint: disable=invalid-name
-        self.__df = pd.DataFrame(data)
-
-    def get_df(self) -> DataFrame:
-        """Return the DataFrame."""
-        return self.__df
+import ipaddress
+import sys
+from abc import ABC, abstractmethod
+
+COLUMNS = ['mac', 'known', 'reserved', 'active', 'ip', 'group', 'name']
+FLAGS = {'known': 1, 'reserved': 2, 'active': 4}
+# The bit added to a device's FLAGS bits for its state if it is in the unclassified group
+UNCLASSIFIED = 8
+HEX_DIGITS = frozenset('0123456789abcdef')
+# The sources in precedence order, with the columns of their batches
+SOURCES = {
+    'known': ['mac', 'name', 'group'],
+    'active': ['mac', 'name', 'ip_address'],
+    'reserved': ['mac', 'name', 'ip_address']}
+BACKENDS = ['pandas', 'python']
+DEFAULT_BACKEND = 'pandas'
+
+def encode_mac(mac: str):
+    """Return a lowercase colon-separated MAC as an int, or None if it is not one."""
+    if len(mac) != 17 or mac[2::3] != ':::::':
+        return None
+    digits = mac.replace(':', '')
+    if not HEX_DIGITS.issuperset(digits):
+        return None
+    return int(digits, 16)
+
+def normalize_mac(mac: str) -> str:
+    """Return a MAC in lowercase colon-separated form, e.g. 'AA-BB-CC-DD-EE-FF' or 'aabb.ccdd.eeff'
+    as 'aa:bb:cc:dd:ee:ff'. Anything else, e.g. another kind of device identifier, is returned as it is."""
+    if len(mac) == 17 and mac[2::3] == ':::::' and HEX_DIGITS.issuperset(mac.replace(':', '')):
+        return mac
+    digits = mac.lower().replace(':', '').replace('-', '').replace('.', '')
+    if len(digits) != 12 or not HEX_DIGITS.issuperset(digits):
+        return mac
+    return ':'.join(digits[position:position + 2] for position in range(0, 12, 2))
+
+def normalize_macs(macs: list) -> list:
+    """Return a list of MACs normalized (see normalize_mac()), interning the ones that change
+    so that a device in several sources holds one string. A list that is already all
+    lowercase colon-separated MACs, the usual case, is checked in one go and returned as it is."""
+    try:
+        joined = ''.join(macs).encode('ascii')
+    except (TypeError, UnicodeEncodeError):
+        joined = None
+    if joined is not None and len(joined) == 17 * len(macs) \
+            and all(joined[position::17] == b':' * len(macs) for position in range(2, 17, 3)) \
+            and not joined.translate(None, b':0123456789abcdef'):
+        return macs
+    return [sys.intern(normalize_mac(mac)) if isinstance(mac, str) else mac for mac in macs]
+
+def format_mac(code: int) -> str:
+    """Return the colon-separated MAC for an int."""
+    digits = f'{code:012x}'
+    return ':'.join(digits[position:position + 2] for position in range(0, 12, 2))
+
+def encode_ipv4(ip_address: str):
+    """Return a dotted-quad IPv4 address as an int, or None if it is not one."""
+    parts = ip_address.split('.')
+    if len(parts) != 4:
+        return None
+    address = 0
+    for part in parts:
+        if not part.isdigit() or len(part) > 3 or (len(part) > 1 and part[0] == '0'):
+            return None
+        octet = int(part)
+        if octet > 255:
+            return None
+        address = (address << 8) | octet
+    return address
+
+def format_ipv4(address: int) -> str:
+    """Return the dotted-quad IPv4 address for an int."""
+    return f'{address >> 24}.{(address >> 16) & 0xff}.{(address >> 8) & 0xff}.{address & 0xff}'
+
+def is_in_subnets(ip_address: str, subnets: list) -> bool:
+    """Return True if the address is in one of the subnets (ipaddress networks)."""
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return False
+    return any(address in subnet for subnet in subnets)
+
+def get_backend(backend=None) -> type:
+    """Return the DeviceTable class of the 'pandas' or 'python' backend.
+    Backends are imported on first use, so the python backend never imports pandas."""
+    # pylint: disable=import-outside-toplevel
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'pandas':
+        from netorg_core import devicetable_pandas
+        return devicetable_pandas.PandasDeviceTable
+    if backend == 'python':
+        from netorg_core import devicetable_python
+        return devicetable_python.PythonDeviceTable
+    raise ValueError(f'unknown device table backend {backend}')
+
+class DeviceTable(ABC) :
+    """The device table is the heart of Network Organizer.
+
+    DeviceTable(data, backend) creates the table, from a list of dicts, a
+    dict of columns or a DataFrame with the COLUMNS, using one of the
+    BACKENDS: 'pandas' holds the devices in compact columns and suits large
+    networks; 'python' holds them in lists and does not import pandas, so
+    small runs start quickly.
+
+    Devices are selected by a boolean mask, as returned by has_ip(),
+    get_in_state() etc. and combined with ~, & and |, or by a list of rows.
+    """
+    # pylint: disable=missing-function-docstring
+
+    def __new__(cls, data=None, backend=None):
+        # pylint: disable=unused-argument
+        if cls is DeviceTable:
+            cls = get_backend(backend)
+        return super().__new__(cls)
+
+    @classmethod
+    @abstractmethod
+    def from_batches(cls, batches: dict) -> 'DeviceTable':
+        """Merge batches of columns from the SOURCES, keyed on MAC: a device is known, active
+        and/or reserved if its MAC appears in that source; the name comes from the first
+        source holding the device; a reservation overrides the IP of the current lease
+        (see validation.validate() for the leases that differ)."""
+
+    @abstractmethod
+    def get_df(self):
+        """Return the device table as a pandas DataFrame of strings and booleans."""
+
+    @abstractmethod
+    def to_columns(self) -> dict:
+        """Return the device table as a list of strings or booleans per column, in column order.
+        DeviceTable(columns, backend) recreates it."""
+
+    @abstractmethod
+    def to_csv(self) -> str:
+        pass
+
+    @abstractmethod
+    def get_size(self) -> int:
+        pass
+
+    @abstractmethod
+    def get_flag(self, flag: str):
+        pass
+
+    @abstractmethod
+    def get_states(self):
+        """Return the state of each device, in device table order, as an array of small ints (with tolist()):
+        the sum of the device's FLAGS bits, plus UNCLASSIFIED if it is in the unclassified group."""
+
+    @abstractmethod
+    def get_in_state(self, mask: int, value: int, states=None):
+        """Return a mask of the devices whose state & mask == value. Passing the states,
+        as returned by get_states(), saves working them out again for each selection."""
+
+    @abstractmethod
+    def get_rows(self, mask) -> list:
+        """Return the rows selected by a boolean mask, in device table order."""
+
+    @abstractmethod
+    def get_retired(self):
+        pass
+
+    @abstractmethod
+    def get_unique_mac(self):
+        pass
+
+    @abstractmethod
+    def to_mask(self, rows):
+        pass
+
+    @abstractmethod
+    def has_ip(self, column='ip'):
+        pass
+
+    @abstractmethod
+    def get_duplicate_ip(self, column='ip'):
+        """Return a mask of the devices whose address another device also has."""
+
+    @abstractmethod
+    def get_outside(self, subnets: list, column='ip'):
+        """Return a mask of the devices with an address in none of the subnets (ipaddress networks)."""
+
+    @abstractmethod
+    def get_in_groups(self, groups: list):
+        """Return a mask of the devices in any of the groups."""
+
+    @abstractmethod
+    def get_name_match(self, pattern):
+        """Return a mask of the devices whose name matches the pattern (a compiled regular expression) anywhere."""
+
+    @abstractmethod
+    def get_group_names(self) -> list:
+        pass
+
+    @abstractmethod
+    def get_rows_for_group(self, group: str):
+        pass
+
+    @abstractmethod
+    def get_macs(self, rows=None) -> list:
+        pass
+
+    @abstractmethod
+    def get_ips(self, rows=None, column='ip') -> list:
+        pass
+
+    @abstractmethod
+    def get_names(self, rows=None) -> list:
+        pass
+
+    @abstractmethod
+    def get_groups(self, rows=None) -> list:
+        pass
+
+    @abstractmethod
+    def set_ips(self, rows, ip_addresses, column='ip') -> None:
+        pass
@@ -0,0 +1,331 @@
+"""The pandas backend of the device table."""
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from netorg_core import devicetable
+from netorg_core.devicetable import COLUMNS, FLAGS, SOURCES, UNCLASSIFIED
+
+# MAC codes at or above this are indexes into the table's identifiers that are not lowercase colon-separated MACs
+OTHER_MAC_BASE = 1 << 48
+MAC_PATTERN = r'[0-9a-f]{2}(?::[0-9a-f]{2}){5}'
+OCTET_PATTERN = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+IPV4_PATTERN = rf'{OCTET_PATTERN}(?:\.{OCTET_PATTERN}){{3}}'
+
+def encode_mac_column(macs: pd.Series) -> tuple:
+    """Vectorized encode_mac(): return the codes of a column of strings and a mask of the lowercase colon-separated MACs."""
+    valid = macs.str.fullmatch(MAC_PATTERN).fillna(False).to_numpy(dtype=bool)
+    codes = np.zeros(len(macs), dtype=np.uint64)
+    if valid.any():
+        # Pad each MAC to 8 bytes and decode them all at once
+        digits = ('0000' + macs[valid].str.replace(':', '', regex=False)).str.cat()
+        codes[valid] = np.frombuffer(bytes.fromhex(digits), dtype='>u8')
+    return codes, valid
+
+def encode_ipv4_column(ip_addresses: pd.Series) -> tuple:
+    """Vectorized encode_ipv4(): return the addresses of a column of strings and a mask of the dotted-quad IPv4 addresses."""
+    valid = ip_addresses.str.fullmatch(IPV4_PATTERN).fillna(False).to_numpy(dtype=bool)
+    addresses = np.zeros(len(ip_addresses), dtype=np.uint32)
+    if valid.any():
+        octets = ip_addresses[valid].str.split('.', expand=True).to_numpy(dtype=np.uint32)
+        addresses[valid] = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+    return addresses, valid
+
+class PandasDeviceTable(devicetable.DeviceTable) :
+    """The device table held in pandas.
+
+    Devices are held in compact columns: the MAC as a uint64, the IPv4
+    address as a nullable UInt32, the group as a categorical and the
+    known/reserved/active flags packed into a uint8. Identifiers that are
+    not lowercase colon-separated MACs, and address columns that are not
+    all IPv4 (e.g. IPv6), are kept as they are. get_df() renders the
+    familiar string columns for callers that want them.
+
+    Each group's rows are found through an index that is built on first
+    use, so walking a group does not scan the whole table.
+    """
+    def __init__(self, data, backend='pandas') -> None:
+        # pylint: disable=invalid-name
+        # pylint: disable=unused-argument
+        df = data if isinstance(data, DataFrame) else pd.DataFrame(data)
+        self.__other_macs = []
+        self.__other_mac_codes = {}
+        self.__columns = list(COLUMNS) + [column for column in df.columns if column not in COLUMNS]
+        compact = {'mac': pd.Series(self.__encode_macs(self.__get_strings(df, 'mac')), dtype='uint64')}
+        flags = np.zeros(len(df), dtype=np.uint8)
+        for flag, bit in FLAGS.items():
+            if flag in df.columns:
+                flags[df[flag].fillna(False).astype(bool).to_numpy()] |= bit
+        compact['flags'] = pd.Series(flags)
+        compact['group'] = pd.Categorical(self.__get_strings(df, 'group'))
+        compact['name'] = pd.Series(self.__get_strings(df, 'name'), dtype=object)
+        for column in self.__columns:
+            if column == 'ip' or column not in compact and column not in FLAGS:
+                compact[column] = PandasDeviceTable.__encode_addresses(self.__get_strings(df, column))
+        self.__df = pd.DataFrame(compact)
+        # Built on first use; the group column never changes after construction
+        self.__group_index = None
+
+    @classmethod
+    def from_batches(cls, batches) -> 'PandasDeviceTable':
+        """Merge the sources with one outer join keyed on MAC."""
+        frames = {source: PandasDeviceTable.__get_frame(source, batches[source]) for source in SOURCES}
+        # Devices are in the order they are first seen
+        macs = pd.unique(pd.concat([pd.Series(batch['mac'], dtype=object) for source in SOURCES for batch in batches[source]]
+                                   + [pd.Series([], dtype=object)], ignore_index=True))
+        joined = pd.concat(
+            [frame.add_prefix(f'{source}_').assign(**{source: True}) for source, frame in frames.items()],
+            axis=1, join='outer', sort=False).reindex(macs)
+        known = joined['known'].notna().to_numpy()
+        active = joined['active'].notna().to_numpy()
+        reserved = joined['reserved'].notna().to_numpy()
+        name = np.where(known, joined['known_name'], np.where(active, joined['active_name'], joined['reserved_name']))
+        lease_ip = np.where(active, joined['active_ip_address'], '')
+        ip = np.where(reserved, joined['reserved_ip_address'], lease_ip)
+        return cls(pd.DataFrame({
+            'mac': macs,
+            'known': known,
+            'reserved': reserved,
+            'active': active,
+            'ip': ip,
+            'group': np.where(known, joined['known_group'], 'unclassified'),
+            'name': name}))
+
+    def get_df(self) -> DataFrame:
+        """Return the device table rendered as a DataFrame of strings and booleans.
+        This is a copy; use set_ips() to change the device table."""
+        return pd.DataFrame(self.to_columns(), columns=self.__columns)
+
+    def to_columns(self) -> dict:
+        """Return the device table rendered as a list of strings or booleans per column."""
+        rendered = {}
+        for column in self.__columns:
+            if column == 'mac':
+                rendered[column] = self.get_macs()
+            elif column in FLAGS:
+                rendered[column] = self.get_flag(column).tolist()
+            elif column == 'group':
+                rendered[column] = self.__df['group'].astype(object).tolist()
+            else:
+                rendered[column] = self.__get_column_strings(column, None)
+        return rendered
+
+    def get_compact_df(self) -> DataFrame:
+        """Return the compact columns (mac, flags, ip, group, name and any others).
+        Do not modify it; use set_ips() instead."""
+        return self.__df
+
+    def get_size(self) -> int:
+        """Return the number of devices."""
+        return len(self.__df)
+
+    def get_flag(self, flag: str) -> pd.Series:
+        """Return a boolean Series for the known, reserved or active flag."""
+        return (self.__df['flags'] & FLAGS[flag]) != 0
+
+    def get_states(self) -> np.ndarray:
+        """Return the state of each device (FLAGS bits, plus UNCLASSIFIED) as an array."""
+        return self.__df['flags'].to_numpy() | np.where(
+            (self.__df['group'] == 'unclassified').to_numpy(), UNCLASSIFIED, 0).astype(np.uint8)
+
+    def get_in_state(self, mask: int, value: int, states=None) -> pd.Series:
+        """Return a boolean Series of the devices whose state & mask == value, over the whole array at once."""
+        if states is None:
+            states = self.get_states()
+        return pd.Series((states & mask) == value, index=self.__df.index)
+
+    def get_rows(self, mask) -> list:
+        """Return the rows selected by a boolean mask."""
+        return PandasDeviceTable.__to_positions(mask).tolist()
+
+    def get_retired(self) -> pd.Series:
+        """Return a boolean Series of the devices whose MAC belongs to a retired device,
+        i.e. one that is reserved but neither known nor active."""
+        flags = self.__df['flags']
+        retired = flags == FLAGS['reserved']
+        return self.__df['mac'].isin(self.__df.loc[retired, 'mac'])
+
+    def get_unique_mac(self) -> pd.Series:
+        """Return a boolean Series of the devices whose MAC appears only once."""
+        return ~self.__df['mac'].duplicated(keep=False)
+
+    def to_mask(self, rows) -> pd.Series:
+        """Return a boolean mask (e.g. a list of booleans) as a Series aligned with the device table."""
+        return pd.Series(np.asarray(rows, dtype=bool), index=self.__df.index)
+
+    def get_group_names(self) -> list:
+        """Return the groups in the order they first appear in the device table."""
+        return list(self.__get_group_index())
+
+    def get_rows_for_group(self, group: str) -> np.ndarray:
+        """Return the rows of the devices in the group, in device table order."""
+        return self.__get_group_index().get(group, np.empty(0, dtype=np.intp))
+
+    def has_ip(self, column='ip') -> pd.Series:
+        """Return a boolean Series of the devices that have an address in the column."""
+        if column not in self.__df.columns:
+            return pd.Series(False, index=self.__df.index)
+        values = self.__df[column]
+        if PandasDeviceTable.__is_compact(values):
+            return values.notna()
+        return values != ''
+
+    def get_duplicate_ip(self, column='ip') -> pd.Series:
+        """Return a boolean Series of the devices whose address another device also has."""
+        if column not in self.__df.columns:
+            return pd.Series(False, index=self.__df.index)
+        return self.__df[column].duplicated(keep=False) & self.has_ip(column)
+
+    def get_outside(self, subnets: list, column='ip') -> pd.Series:
+        """Return a boolean Series of the devices with an address in none of the subnets (ipaddress networks)."""
+        has_ip = self.has_ip(column)
+        if not has_ip.any():
+            return has_ip
+        values = self.__df[column]
+        if not PandasDeviceTable.__is_compact(values):
+            return pd.Series([ip_address != '' and not devicetable.is_in_subnets(ip_address, subnets)
+                              for ip_address in values.tolist()], index=self.__df.index)
+        addresses = values.fillna(0).to_numpy(dtype=np.uint32)
+        inside = np.zeros(len(addresses), dtype=bool)
+        for subnet in subnets:
+            if subnet.version == 4:
+                inside |= (addresses & np.uint32(int(subnet.netmask))) == np.uint32(int(subnet.network_address))
+        return has_ip & ~inside
+
+    def get_in_groups(self, groups: list) -> pd.Series:
+        """Return a boolean Series of the devices in any of the groups."""
+        return self.__df['group'].isin(groups)
+
+    def get_name_match(self, pattern) -> pd.Series:
+        """Return a boolean Series of the devices whose name matches the pattern (a compiled regular expression) anywhere."""
+        return self.__df['name'].str.contains(pattern, regex=True).fillna(False).astype(bool)
+
+    def get_macs(self, rows=None) -> list:
+        """Return the MACs of the devices (all, or those selected by a boolean mask or rows) as strings."""
+        codes = self.__select(self.__df['mac'], rows)
+        return [devicetable.format_mac(code) if code < OTHER_MAC_BASE else self.__other_macs[code - OTHER_MAC_BASE]
+                for code in codes.tolist()]
+
+    def get_ips(self, rows=None, column='ip') -> list:
+        """Return the addresses of the devices (all, or those selected by a boolean mask or rows) as strings."""
+        if column not in self.__df.columns:
+            return [''] * len(self.__select(self.__df['mac'], rows))
+        return self.__get_column_strings(column, rows)
+
+    def get_names(self, rows=None) -> list:
+        """Return the names of the devices (all, or those selected by a boolean mask or rows)."""
+        return self.__select(self.__df['name'], rows).tolist()
+
+    def get_groups(self, rows=None) -> list:
+        """Return the groups of the devices (all, or those selected by a boolean mask or rows)."""
+        return self.__select(self.__df['group'], rows).astype(object).tolist()
+
+    def set_ips(self, rows, ip_addresses, column='ip') -> None:
+        """Set the addresses of the devices selected by a boolean mask or rows, in order."""
+        ip_addresses = list(ip_addresses)
+        if column not in self.__df.columns:
+            self.__df[column] = PandasDeviceTable.__encode_addresses([''] * len(self.__df))
+            self.__columns.append(column)
+        positions = PandasDeviceTable.__to_positions(rows)
+        values = self.__df[column]
+        if PandasDeviceTable.__is_compact(values):
+            encoded = [devicetable.encode_ipv4(ip_address) if ip_address else None for ip_address in ip_addresses]
+            if None not in [code for code, ip_address in zip(encoded, ip_addresses) if ip_address]:
+                values = values.copy()
+                values.iloc[positions] = pd.array(encoded, dtype='UInt32')
+                self.__df[column] = values
+                return
+            self.__df[column] = pd.Series(self.__get_column_strings(column, None), dtype=object)
+        strings = self.__df[column].copy()
+        strings.iloc[positions] = ip_addresses
+        self.__df[column] = strings
+
+    def to_csv(self) -> str:
+        """Return the device table as CSV."""
+        return self.get_df().to_csv()
+
+    def encode_mac(self, mac: str) -> int:
+        """Return the code used for a MAC (or other device identifier) in the mac column, or None if not present."""
+        code = devicetable.encode_mac(mac)
+        if code is not None:
+            return code
+        return self.__other_mac_codes.get(mac)
+
+    @staticmethod
+    def __get_frame(source, batches) -> pd.DataFrame:
+        """Return the source's columns indexed by MAC, one row per MAC."""
+        columns = SOURCES[source]
+        frames = [pd.DataFrame({column: batch[column] for column in columns}, dtype=object) for batch in batches]
+        frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns, dtype=object)
+        if not frame['mac'].duplicated().any():
+            return frame.set_index('mac')
+        if source == 'known':
+            # A later known device replaces an earlier one
+            return frame.drop_duplicates('mac', keep='last').set_index('mac')
+        # A later lease or reservation only changes the IP
+        first = frame.drop_duplicates('mac', keep='first').set_index('mac')
+        last = frame.drop_duplicates('mac', keep='last').set_index('mac')
+        first['ip_address'] = last['ip_address'].reindex(first.index)
+        return first
+
+    def __encode_macs(self, macs) -> np.ndarray:
+        codes, valid = encode_mac_column(macs)
+        for position in np.flatnonzero(~valid).tolist():
+            mac = macs.iat[position]
+            code = self.__other_mac_codes.get(mac)
+            if code is None:
+                code = OTHER_MAC_BASE + len(self.__other_macs)
+                self.__other_macs.append(mac)
+                self.__other_mac_codes[mac] = code
+            codes[position] = code
+        return codes
+
+    def __get_group_index(self) -> dict:
+        if self.__group_index is None:
+            categorical = self.__df['group'].array
+            codes = categorical.codes
+            order = np.argsort(codes, kind='stable')
+            boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+            rows_by_group = {categorical.categories[codes[rows[0]]]: rows
+                             for rows in np.split(order, boundaries) if len(rows)}
+            self.__group_index = dict(sorted(rows_by_group.items(), key=lambda item: item[1][0]))
+        return self.__group_index
+
+    def __get_column_strings(self, column, rows) -> list:
+        values = self.__select(self.__df[column], rows)
+        if PandasDeviceTable.__is_compact(values):
+            return ['' if address is pd.NA else devicetable.format_ipv4(address) for address in values.tolist()]
+        return values.tolist()
+
+    @staticmethod
+    def __encode_addresses(ip_addresses) -> pd.Series:
+        """Encode IPv4 addresses as a nullable UInt32 column, or keep the strings if they are not all IPv4."""
+        ip_addresses = pd.Series(ip_addresses, dtype=object)
+        addresses, valid = encode_ipv4_column(ip_addresses)
+        missing = (ip_addresses == '').to_numpy(dtype=bool)
+        if not (valid | missing).all():
+            return ip_addresses
+        return pd.Series(pd.arrays.IntegerArray(addresses, missing))
+
+    @staticmethod
+    def __is_compact(values) -> bool:
+        return str(values.dtype) == 'UInt32'
+
+    @staticmethod
+    def __select(values, rows):
+        return values if rows is None else values.iloc[PandasDeviceTable.__to_positions(rows)]
+
+    @staticmethod
+    def __to_positions(rows) -> np.ndarray:
+        """Return a boolean mask, or a list of rows, as an array of rows."""
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            return np.flatnonzero(rows)
+        return rows.astype(np.intp)
+
+    @staticmethod
+    def __get_strings(df, column) -> pd.Series:
+        # pylint: disable=invalid-name
+        if column not in df.columns:
+            return pd.Series([''] * len(df), dtype=object)
+        values = df[column].reset_index(drop=True)
+        return values.where(values.notna(), '').astype(str).astype(object)
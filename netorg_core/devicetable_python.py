@@ -0,0 +1,250 @@
+"""The pure Python backend of the device table, for runs that should not wait for pandas to import."""
+import array
+import csv
+import io
+from netorg_core import devicetable
+from netorg_core.devicetable import COLUMNS, FLAGS, SOURCES, UNCLASSIFIED
+
+class Mask(list):
+    """A list of booleans that can be combined with ~, & and | like a pandas boolean Series."""
+
+    def __invert__(self) -> 'Mask':
+        return Mask(not value for value in self)
+
+    def __and__(self, other) -> 'Mask':
+        return Mask(value and bool(other_value) for value, other_value in zip(self, other))
+
+    def __or__(self, other) -> 'Mask':
+        return Mask(value or bool(other_value) for value, other_value in zip(self, other))
+
+    def sum(self) -> int:
+        """Return the number of selected devices."""
+        return sum(1 for value in self if value)
+
+    def tolist(self) -> list:
+        """Return the mask as a list."""
+        return list(self)
+
+class PythonDeviceTable(devicetable.DeviceTable) :
+    """The device table held in Python lists, with the flags packed into an array of bytes.
+
+    Each group's rows are found through an index that is built on first
+    use, so walking a group does not scan the whole table.
+    """
+    def __init__(self, data, backend='python') -> None:
+        # pylint: disable=unused-argument
+        if hasattr(data, 'to_dict'):
+            data = data.to_dict('records')
+        elif isinstance(data, dict):
+            data = [dict(zip(data, values)) for values in zip(*data.values())]
+        extra_columns = []
+        for row in data:
+            extra_columns.extend(column for column in row if column not in COLUMNS and column not in extra_columns)
+        self.__columns = list(COLUMNS) + extra_columns
+        self.__macs = [PythonDeviceTable.__get_string(row, 'mac') for row in data]
+        self.__flags = array.array('B', [
+            sum(bit for flag, bit in FLAGS.items() if row.get(flag) is True or row.get(flag) == 1) for row in data])
+        self.__groups = [PythonDeviceTable.__get_string(row, 'group') for row in data]
+        self.__names = [PythonDeviceTable.__get_string(row, 'name') for row in data]
+        self.__addresses = {column: [PythonDeviceTable.__get_string(row, column) for row in data]
+                            for column in self.__columns if column == 'ip' or column not in FLAGS and column not in COLUMNS}
+        # Built on first use; the group column never changes after construction
+        self.__group_index = None
+
+    @classmethod
+    def from_batches(cls, batches) -> 'PythonDeviceTable':
+        """Merge the sources one device at a time."""
+        first_seen = {}
+        first = {source: {} for source in SOURCES}
+        last = {source: {} for source in SOURCES}
+        for source, columns in SOURCES.items():
+            for batch in batches[source]:
+                for values in zip(*[batch[column] for column in columns]):
+                    first_seen.setdefault(values[0], None)
+                    first[source].setdefault(values[0], values)
+                    last[source][values[0]] = values
+        data = []
+        for mac in first_seen:
+            known = last['known'].get(mac)
+            active = last['active'].get(mac)
+            reserved = last['reserved'].get(mac)
+            if known is not None:
+                name = known[1]
+            elif active is not None:
+                name = first['active'][mac][1]
+            else:
+                name = first['reserved'][mac][1]
+            lease_ip = active[2] if active is not None else ''
+            ip = reserved[2] if reserved is not None else lease_ip
+            data.append({
+                'mac': mac,
+                'known': known is not None,
+                'reserved': reserved is not None,
+                'active': active is not None,
+                'ip': ip,
+                'group': known[2] if known is not None else 'unclassified',
+                'name': name})
+        return cls(data)
+
+    def get_df(self):
+        """Return the device table as a pandas DataFrame of strings and booleans (this imports pandas)."""
+        # pylint: disable=import-outside-toplevel
+        import pandas as pd
+        return pd.DataFrame(self.to_columns(), columns=self.__columns)
+
+    def to_columns(self) -> dict:
+        """Return the device table as a list of strings or booleans per column."""
+        rendered = self.__get_rendered_columns()
+        return {column: list(rendered[column]) for column in self.__columns}
+
+    def to_csv(self) -> str:
+        """Return the device table as CSV, in the same layout as pandas."""
+        rendered = self.__get_rendered_columns()
+        csv_file = io.StringIO()
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow([''] + self.__columns)
+        for row, values in enumerate(zip(*[rendered[column] for column in self.__columns])):
+            writer.writerow([row] + list(values))
+        return csv_file.getvalue()
+
+    def get_size(self) -> int:
+        """Return the number of devices."""
+        return len(self.__macs)
+
+    def get_flag(self, flag: str) -> Mask:
+        """Return a mask of the devices with the known, reserved or active flag."""
+        bit = FLAGS[flag]
+        return Mask(flags & bit != 0 for flags in self.__flags)
+
+    def get_states(self) -> array.array:
+        """Return the state of each device (FLAGS bits, plus UNCLASSIFIED) as an array of bytes."""
+        return array.array('B', (flags | UNCLASSIFIED if group == 'unclassified' else flags
+                                 for flags, group in zip(self.__flags, self.__groups)))
+
+    def get_in_state(self, mask: int, value: int, states=None) -> Mask:
+        """Return a mask of the devices whose state & mask == value."""
+        if states is None:
+            states = self.get_states()
+        return Mask(state & mask == value for state in states)
+
+    def get_rows(self, mask) -> list:
+        """Return the rows selected by a boolean mask."""
+        return PythonDeviceTable.__to_positions(mask)
+
+    def get_retired(self) -> Mask:
+        """Return a mask of the devices whose MAC belongs to a retired device,
+        i.e. one that is reserved but neither known nor active."""
+        retired_macs = {mac for mac, flags in zip(self.__macs, self.__flags) if flags == FLAGS['reserved']}
+        return Mask(mac in retired_macs for mac in self.__macs)
+
+    def get_unique_mac(self) -> Mask:
+        """Return a mask of the devices whose MAC appears only once."""
+        counts = {}
+        for mac in self.__macs:
+            counts[mac] = counts.get(mac, 0) + 1
+        return Mask(counts[mac] == 1 for mac in self.__macs)
+
+    def to_mask(self, rows) -> Mask:
+        """Return a boolean mask (e.g. a list of booleans) as a Mask."""
+        return Mask(bool(value) for value in rows)
+
+    def has_ip(self, column='ip') -> Mask:
+        """Return a mask of the devices that have an address in the column."""
+        if column not in self.__addresses:
+            return Mask([False] * len(self.__macs))
+        return Mask(ip_address != '' for ip_address in self.__addresses[column])
+
+    def get_duplicate_ip(self, column='ip') -> Mask:
+        """Return a mask of the devices whose address another device also has."""
+        if column not in self.__addresses:
+            return Mask([False] * len(self.__macs))
+        counts = {}
+        for ip_address in self.__addresses[column]:
+            counts[ip_address] = counts.get(ip_address, 0) + 1
+        return Mask(ip_address != '' and counts[ip_address] > 1 for ip_address in self.__addresses[column])
+
+    def get_outside(self, subnets: list, column='ip') -> Mask:
+        """Return a mask of the devices with an address in none of the subnets (ipaddress networks)."""
+        if column not in self.__addresses:
+            return Mask([False] * len(self.__macs))
+        return Mask(ip_address != '' and not devicetable.is_in_subnets(ip_address, subnets)
+                    for ip_address in self.__addresses[column])
+
+    def get_in_groups(self, groups: list) -> Mask:
+        """Return a mask of the devices in any of the groups."""
+        groups = set(groups)
+        return Mask(group in groups for group in self.__groups)
+
+    def get_name_match(self, pattern) -> Mask:
+        """Return a mask of the devices whose name matches the pattern (a compiled regular expression) anywhere."""
+        return Mask(pattern.search(name) is not None for name in self.__names)
+
+    def get_group_names(self) -> list:
+        """Return the groups in the order they first appear in the device table."""
+        return list(self.__get_group_index())
+
+    def get_rows_for_group(self, group: str) -> list:
+        """Return the rows of the devices in the group, in device table order."""
+        return self.__get_group_index().get(group, [])
+
+    def get_macs(self, rows=None) -> list:
+        """Return the MACs of the devices (all, or those selected by a boolean mask or rows)."""
+        return PythonDeviceTable.__select(self.__macs, rows)
+
+    def get_ips(self, rows=None, column='ip') -> list:
+        """Return the addresses of the devices (all, or those selected by a boolean mask or rows)."""
+        if column not in self.__addresses:
+            return [''] * len(PythonDeviceTable.__select(self.__macs, rows))
+        return PythonDeviceTable.__select(self.__addresses[column], rows)
+
+    def get_names(self, rows=None) -> list:
+        """Return the names of the devices (all, or those selected by a boolean mask or rows)."""
+        return PythonDeviceTable.__select(self.__names, rows)
+
+    def get_groups(self, rows=None) -> list:
+        """Return the groups of the devices (all, or those selected by a boolean mask or rows)."""
+        return PythonDeviceTable.__select(self.__groups, rows)
+
+    def set_ips(self, rows, ip_addresses, column='ip') -> None:
+        """Set the addresses of the devices selected by a boolean mask or rows, in order."""
+        if column not in self.__addresses:
+            self.__addresses[column] = [''] * len(self.__macs)
+            self.__columns.append(column)
+        addresses = self.__addresses[column]
+        for row, ip_address in zip(PythonDeviceTable.__to_positions(rows), ip_addresses):
+            addresses[row] = ip_address
+
+    def __get_rendered_columns(self) -> dict:
+        rendered = {'mac': self.__macs, 'group': self.__groups, 'name': self.__names}
+        for flag in FLAGS:
+            rendered[flag] = self.get_flag(flag).tolist()
+        rendered.update(self.__addresses)
+        return rendered
+
+    def __get_group_index(self) -> dict:
+        if self.__group_index is None:
+            self.__group_index = {}
+            for row, group in enumerate(self.__groups):
+                self.__group_index.setdefault(group, []).append(row)
+        return self.__group_index
+
+    @staticmethod
+    def __select(values, rows) -> list:
+        if rows is None:
+            return list(values)
+        return [values[row] for row in PythonDeviceTable.__to_positions(rows)]
+
+    @staticmethod
+    def __to_positions(rows) -> list:
+        """Return a boolean mask, or a list of rows, as a list of rows."""
+        rows = list(rows)
+        if rows and isinstance(rows[0], bool):
+            return [row for row, selected in enumerate(rows) if selected]
+        return [int(row) for row in rows]
+
+    @staticmethod
+    def __get_string(row, column) -> str:
+        value = row.get(column)
+        if value is None or value != value:
+            return ''
+        return str(value)
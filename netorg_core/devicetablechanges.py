@@ -0,0 +1,114 @@
+"""What changed in the device table between one run and the next."""
+import csv
+import io
+from netorg_core import devicetable
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+class DeviceTableChanges :
+    """The devices added, removed and changed between a previous and a current device table.
+
+    Devices are matched on MAC. A device is changed if any other column
+    differs, and get_changed_columns() says which. Downstream consumers can
+    work through just these devices instead of diffing whole tables.
+    """
+
+    def __init__(self, previous: devicetable.DeviceTable, current: devicetable.DeviceTable) -> None:
+        """previous is None if there is nothing to compare with, in which case every device is added."""
+        previous_columns = previous.to_columns() if previous is not None else {'mac': []}
+        current_columns = current.to_columns()
+        self.columns = list(current_columns) + [
+            column for column in previous_columns if column not in current_columns]
+        previous_rows = DeviceTableChanges.__get_rows(previous_columns, self.columns)
+        current_rows = DeviceTableChanges.__get_rows(current_columns, self.columns)
+        self.__rows = {}
+        self.__changed_columns = {}
+        self.__previous_rows = {}
+        for mac, row in current_rows.items():
+            previous_row = previous_rows.get(mac)
+            if previous_row is None:
+                self.__rows[mac] = (ADDED, row)
+                continue
+            changed_columns = [column for column in self.columns if row[column] != previous_row[column]]
+            if changed_columns:
+                self.__rows[mac] = (CHANGED, row)
+                self.__changed_columns[mac] = changed_columns
+                self.__previous_rows[mac] = previous_row
+        for mac, row in previous_rows.items():
+            if mac not in current_rows:
+                self.__rows[mac] = (REMOVED, row)
+
+    def __len__(self) -> int:
+        return len(self.__rows)
+
+    def is_empty(self) -> bool:
+        """Return True if nothing changed."""
+        return not self.__rows
+
+    def get_macs(self, change: str = None) -> list:
+        """Return the MACs of the devices that were added, removed or changed (or all of these)."""
+        return [mac for mac, (row_change, _) in self.__rows.items() if change is None or row_change == change]
+
+    def get_added(self) -> list:
+        """Return the MACs of the devices that are new since the previous device table."""
+        return self.get_macs(ADDED)
+
+    def get_removed(self) -> list:
+        """Return the MACs of the devices that are no longer in the device table."""
+        return self.get_macs(REMOVED)
+
+    def get_changed(self) -> list:
+        """Return the MACs of the devices with a column that differs from the previous device table."""
+        return self.get_macs(CHANGED)
+
+    def get_changed_columns(self, mac: str) -> list:
+        """Return the columns that differ for a changed device (all of them if it was added or removed)."""
+        change, _ = self.__rows[mac]
+        if change == CHANGED:
+            return list(self.__changed_columns[mac])
+        return [column for column in self.columns if column != 'mac']
+
+    def get_transitions(self, mac: str) -> list:
+        """Return (column, previous value, current value) for each column that differs for a changed device."""
+        _, row = self.__rows[mac]
+        previous_row = self.__previous_rows.get(mac, {})
+        return [(column, previous_row[column], row[column]) for column in self.__changed_columns.get(mac, [])]
+
+    def get_row(self, mac: str) -> dict:
+        """Return the columns of a device that was added, changed (as it is now) or removed (as it was)."""
+        _, row = self.__rows[mac]
+        return dict(row)
+
+    def to_records(self) -> list:
+        """Return a dict per device holding the change, the device's columns (as they were
+        for a removed device) and a <column>_changed flag per column."""
+        records = []
+        for mac, (change, row) in self.__rows.items():
+            changed_columns = self.get_changed_columns(mac)
+            record = {'change': change}
+            record.update(row)
+            for column in self.columns:
+                if column != 'mac':
+                    record[f'{column}_changed'] = column in changed_columns
+            records.append(record)
+        return records
+
+    def to_csv(self) -> str:
+        """Return the changes as CSV, one row per device (see to_records())."""
+        csv_file = io.StringIO()
+        fieldnames = ['change'] + self.columns + [f'{column}_changed' for column in self.columns if column != 'mac']
+        writer = csv.DictWriter(csv_file, fieldnames=fieldnames, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(self.to_records())
+        return csv_file.getvalue()
+
+    @staticmethod
+    def __get_rows(columns: dict, all_columns: list) -> dict:
+        """Return the rows of the columns keyed on MAC (the first, if a MAC appears more than once)."""
+        values = [columns.get(column, [''] * len(columns['mac'])) for column in all_columns]
+        rows = {}
+        for row in zip(*values):
+            rows.setdefault(row[0], dict(zip(all_columns, row)))
+        return rows
@@ -1,49 +1,48 @@
 """Responsible for loading the DeviceTable."""
+import concurrent.futures
 import logging
+import time
 from netorg_core import ports
 from netorg_core import devicetable
+from netorg_core import devicetablechanges
+from netorg_core import validation
 
 # pylint: disable=logging-fstring-interpolation
 # pylint: disable=too-few-public-methods
+# pylint: disable=too-many-instance-attributes
+
+DEFAULT_LOAD_CONCURRENCY = 3
 
 class DeviceTableBuilder :
-    """Efficiently Build a DeviceTable."""
-
-    def __init__(self) -> None:
-        self.__devices_dict = {}
-
-    @staticmethod
-    def generate_new_record() -> dict:
-        """Generate a new record with default values."""
-        return {
-            'known': False,
-            'reserved': False,
-            'active': False,
-            'ip': '',
-            'group': 'unclassified',
-            'name': ''}
-
-    def get_details(self,mac) -> dict:
-        """For a given device identified by it's MAC, return the details."""
-        if mac in self.__devices_dict:
-            return self.__devices_dict[mac]
-        self.__devices_dict[mac] = {}
-        return self.__devices_dict[mac]
-
-    def set_details(self,mac,details) -> None:
-        """Set the details for a given device identified by it's MAC."""
-        self.__devices_dict[mac] = details
+    """Efficiently Build a DeviceTable.
+
+    Each source adds batches of columns, and build() merges them in one go
+    (see DeviceTable.from_batches()). MACs are normalized as they are added,
+    so "AA-BB-..." and "aa:bb:..." are the same device.
+    """
+
+    def __init__(self, backend=None) -> None:
+        """backend is one of devicetable.BACKENDS (the default if None)."""
+        self.__backend = backend
+        self.__batches = {source: [] for source in devicetable.SOURCES}
+
+    def add_batch(self, source: str, batch: dict) -> None:
+        """Add a batch of columns (mac, name and group or ip_address) from the known, active or reserved source,
+        e.g. as returned by a port's load_columns()."""
+        columns = {column: batch[column] for column in devicetable.SOURCES[source]}
+        columns['mac'] = devicetable.normalize_macs(columns['mac'])
+        self.__batches[source].append(columns)
+
+    def get_leases(self) -> dict:
+        """Return the IP of each active device's current lease (the last one added), by MAC."""
+        leases = {}
+        for batch in self.__batches['active']:
+            leases.update(zip(batch['mac'], batch['ip_address']))
+        return leases
 
     def build(self) -> devicetable.DeviceTable:
         """Build the DeviceTable."""
-        data = []
-        # pylint: disable=consider-using-dict-items
-        for mac in self.__devices_dict:
-            details = self.__devices_dict[mac]
-            device_mac_dict = {'mac': mac}
-            merged = {**device_mac_dict,**details}
-            data.append(merged)
-        return devicetable.DeviceTable(data)
+        return devicetable.get_backend(self.__backend).from_batches(self.__batches)
 
 class DeviceTableLoader :
     """Load data into the DeviceTable."""
@@ -51,69 +50,69 @@ class DeviceTableLoader :
     def __init__(self,
                  known_devices_port: ports.KnownDevicesPort,
                  active_clients_port: ports.ActiveClientsPort,
-                 fixed_ip_reservations_port: ports.FixedIpReservationsPort) -> None:
+                 fixed_ip_reservations_port: ports.FixedIpReservationsPort,
+                 load_concurrency: int = DEFAULT_LOAD_CONCURRENCY,
+                 backend: str = None,
+                 previous_device_table_port: ports.DeviceTableSnapshotPort = None) -> None:
+        """load_concurrency is how many of the ports are loaded from at the same time.
+        backend is the devicetable backend to build the DeviceTable with.
+        previous_device_table_port, if given, holds the previous device table to work out the changes against;
+        without it the changes are not worked out."""
+        # pylint: disable=too-many-arguments
         self.__logger = logging.getLogger("netorg")
-        self.device_table_builder = DeviceTableBuilder()
+        self.device_table_builder = DeviceTableBuilder(backend)
         self.known_devices_port = known_devices_port
         self.active_clients_port = active_clients_port
         self.fixed_ip_reservations_port = fixed_ip_reservations_port
+        self.load_concurrency = max(1, load_concurrency)
+        self.previous_device_table_port = previous_device_table_port
+        self.backend = backend
+        self.previous_device_table = None
+        # The changes since the previous device table, and the issues found in the device table, once loaded
+        self.changes = None
+        self.validation_report = None
 
     def load_all(self) -> devicetable.DeviceTable :
-        """Load everything into the DeviceTable."""
-        self.__load_known()
-        self.__load_active_clients()
-        self.__load_fixed_ip_reservations()
-        return self.device_table_builder.build()
+        """Load everything into the DeviceTable.
+        The ports are loaded from concurrently; build() merges them in precedence order.
+        validation_report is then set to the issues found in the DeviceTable and,
+        with a previous device table port, changes to what changed since the previous device table."""
+        loaders = {
+            'known devices': self.__load_known,
+            'active clients': self.__load_active_clients,
+            'fixed IP reservations': self.__load_fixed_ip_reservations}
+        if self.previous_device_table_port:
+            loaders['previous device table'] = self.__load_previous_device_table
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.load_concurrency) as executor:
+            futures = [executor.submit(self.__timed, description, loader) for description, loader in loaders.items()]
+            for future in futures:
+                future.result()
+        device_table = self.device_table_builder.build()
+        self.validation_report = validation.validate(
+            device_table, self.fixed_ip_reservations_port.get_subnets(), self.device_table_builder.get_leases())
+        self.__logger.debug(f'DeviceTableLoader: validated the device table: {self.validation_report}')
+        if self.previous_device_table_port:
+            self.changes = devicetablechanges.DeviceTableChanges(self.previous_device_table, device_table)
+            self.__logger.debug(f'DeviceTableLoader: {len(self.changes)} devices changed since the previous device table')
+        return device_table
+
+    def __timed(self, description, loader) -> None:
+        start = time.perf_counter()
+        loader()
+        self.__logger.debug(f'DeviceTableLoader: loaded {description} in {time.perf_counter() - start:.3f}s')
+
+    def __load_previous_device_table(self) -> None:
+        """Load the previous device table, however old."""
+        self.previous_device_table = self.previous_device_table_port.load(float('inf'), self.backend)
 
     def __load_known(self) -> None:
         """Load known devices into the DeviceTable."""
-        known_devices = self.known_devices_port.load()
-        for known_device in known_devices :
-            # All we know at this point is the device is known
-            record = DeviceTableBuilder.generate_new_record()
-            record['known'] = True
-            record['group'] = known_device.group
-            record['name'] = known_device.name
-            self.device_table_builder.set_details(known_device.mac, record)
+        self.device_table_builder.add_batch('known', self.known_devices_port.load_columns())
 
     def __load_active_clients(self) -> None:
         """Load active clients into the DeviceTable."""
-        active_clients = self.active_clients_port.load()
-        for active_client in active_clients :
-            record = self.device_table_builder.get_details(active_client.mac)
-            if record:
-                # device has been loaded already
-                record['active'] = True
-                record['ip'] = active_client.ip_address
-                self.device_table_builder.set_details(active_client.mac, record)
-            else:
-                # Seeing device for the first time
-                record = DeviceTableBuilder.generate_new_record()
-                record['active'] = True
-                record['ip'] = active_client.ip_address
-                record['name'] = active_client.name
-                self.device_table_builder.set_details(active_client.mac, record)
+        self.device_table_builder.add_batch('active', self.active_clients_port.load_columns())
 
     def __load_fixed_ip_reservations(self) -> None:
         """Load fixed IP reservations into the DeviceTable."""
-        # pylint: disable=line-too-long
-        fixed_ip_reservations = self.fixed_ip_reservations_port.load()
-        if fixed_ip_reservations:
-            #for mac, fixed_ip_reservation_details in fixed_ip_reservations.items():
-            for fixed_ip_reservation in fixed_ip_reservations:
-                record = self.device_table_builder.get_details(fixed_ip_reservation.mac)
-                if record:
-                    record['reserved'] = True
-                    if record['ip']:
-                        if record['ip'] != fixed_ip_reservation.ip_address:
-                            self.__logger.info(f'DeviceTableLoader: for {record["name"]} reservation {fixed_ip_reservation.ip_address} differs to current lease {record["ip"]}')
-                            self.__logger.info(f'DeviceTableLoader: using {fixed_ip_reservation.ip_address}')
-                    record['ip'] = fixed_ip_reservation.ip_address
-                    self.device_table_builder.set_details(fixed_ip_reservation.mac, record)
-                else :
-                    # Seeing device for the first time
-                    record = DeviceTableBuilder.generate_new_record()
-                    record['reserved'] = True
-                    record['ip'] = fixed_ip_reservation.ip_address
-                    record['name'] = fixed_ip_reservation.name
-                    self.device_table_builder.set_details(fixed_ip_reservation.mac, record)
+        self.device_table_builder.add_batch('reserved', self.fixed_ip_reservations_port.load_columns())
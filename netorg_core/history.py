@@ -0,0 +1,50 @@
+"""The history of the device table: the state of every device at each scan, and questions about it over time.
+
+A device's state is its known, reserved, active and unclassified flags (see
+DeviceTable.get_states()), so the history can answer both "when was
+this MAC last active?" and "how many unclassified devices were there?".
+"""
+from datetime import datetime
+from typing import Dict
+from typing import List
+from netorg_core import devicetable
+from netorg_core import ports
+from netorg_core import scan
+
+# How many days back --history reports on by default
+DEFAULT_DAYS = 30
+
+def get_states(device_table: devicetable.DeviceTable) -> List[int]:
+    """Return the state of each device in the device table."""
+    return device_table.get_states().tolist()
+
+def count_findings(counts: Dict[int, int]) -> Dict[str, int]:
+    """Return how many devices are in each of scan's built-in findings, given how many are in each state."""
+    return scan.classify(lambda mask, value: sum(count for state, count in counts.items() if state & mask == value))
+
+def count_findings_by_day(state_counts) -> Dict[str, tuple]:
+    """Return, for each day (e.g. '2026-10-18') of an iterable of ports.StateCounts, how many scans there were
+    and the most devices in each finding at any one of those scans."""
+    days = {}
+    for taken_at, counts in state_counts:
+        day = datetime.fromtimestamp(taken_at).date().isoformat()
+        scans, most = days.get(day, (0, {}))
+        findings = count_findings(counts)
+        days[day] = (scans + 1, {finding: max(count, most.get(finding, 0)) for finding, count in findings.items()})
+    return days
+
+def get_last_active(timeline: List[ports.StateRun]) -> float:
+    """Return when a device was last seen active in its timeline, or None if it never was."""
+    active = [run.last for run in timeline if run.state & devicetable.FLAGS['active']]
+    return max(active) if active else None
+
+def describe_state(state: int) -> str:
+    """Describe a state, e.g. "known, reserved, not active"."""
+    flags = [flag if state & bit else f'not {flag}' for flag, bit in devicetable.FLAGS.items()]
+    if state & devicetable.UNCLASSIFIED:
+        flags.append('unclassified')
+    return ', '.join(flags)
+
+def format_time(seconds: float) -> str:
+    """Format seconds since the epoch as local time to the second."""
+    return datetime.fromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')
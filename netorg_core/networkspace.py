@@ -1,11 +1,254 @@
 """Provides allocation of unique IP addresses in a network space."""
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+from collections.abc import Set
+import bisect
+import contextlib
+import hashlib
+import heapq
 import ipaddress
+import itertools
+import mmap
+import os
+import re
+import struct
+try:
+    import fcntl
+except ImportError: # pragma: no cover - not available on Windows
+    fcntl = None
 
 # pylint: disable=missing-class-docstring
 class NetworkIsOutOfSpace(Exception):
     pass
 
-class Ipv4PrivateNetworkSpace :
+class InvalidAddresses(ValueError):
+    """One or more addresses in a batch could not be allocated."""
+
+    def __init__(self, out_of_range: list, duplicates: list) -> None:
+        self.out_of_range = out_of_range
+        self.duplicates = duplicates
+        problems = []
+        if out_of_range:
+            problems.append(f'not in network space: {", ".join(out_of_range)}')
+        if duplicates:
+            problems.append(f'already in use: {", ".join(duplicates)}')
+        super().__init__('; '.join(problems))
+
+class AddressView(Set):
+    """A read-only set of addresses that is computed on demand rather than materialized."""
+
+    def __init__(self, contains, iterate, size) -> None:
+        self.__contains = contains
+        self.__iterate = iterate
+        self.__size = size
+
+    def __contains__(self, ip_address) -> bool:
+        return self.__contains(ip_address)
+
+    def __iter__(self):
+        return self.__iterate()
+
+    def __len__(self) -> int:
+        return self.__size()
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+class NetworkSpace(ABC):
+    """Allocation of unique IP addresses in a network space."""
+
+    @abstractmethod
+    def allocate_address(self) -> str:
+        """Allocate an IP address."""
+
+    @abstractmethod
+    def allocate_specific_address(self, ip_address) -> str:
+        """Allocate a specific IP address."""
+
+    @abstractmethod
+    def get_address_set(self):
+        """Return the set of all addresses in the space."""
+
+    @abstractmethod
+    def get_used_set(self):
+        """Return the set of addresses that have been allocated."""
+
+    @abstractmethod
+    def get_unused_set(self):
+        """Return the set of addresses that are available to be allocated."""
+
+    def get_size(self) -> int:
+        """Return the number of addresses in the space."""
+        return len(self.get_address_set())
+
+    def get_free_count(self) -> int:
+        """Return the number of addresses available to be allocated."""
+        return len(self.get_unused_set())
+
+    def get_used_count(self) -> int:
+        """Return the number of addresses that have been allocated."""
+        return len(self.get_used_set())
+
+    def iterate_free_blocks(self, start=None):
+        """Generate the (first, last) addresses, as ints, of each contiguous block of free addresses, lowest first,
+        leaving out any addresses below start."""
+        return clip_blocks(iterate_runs(int(ipaddress.ip_address(ip_address)) for ip_address in sorted(
+            self.get_unused_set(), key=lambda ip_address: int(ipaddress.ip_address(ip_address)))), start)
+
+    def get_free_block_histogram(self) -> dict:
+        """Return the number of free blocks by size, where each size is a power of two
+        counting the blocks of at least that size and less than twice it."""
+        histogram = {}
+        for first, last in self.iterate_free_blocks():
+            bucket = get_block_bucket(last - first + 1)
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        return dict(sorted(histogram.items()))
+
+    def get_largest_free_block(self):
+        """Return the (first, last) addresses of the largest contiguous free block,
+        or None if the space is full. Ties go to the lowest block."""
+        largest, _ = self.get_free_block_summary()
+        return largest
+
+    def get_free_block_summary(self) -> tuple:
+        """Return the largest free block (see get_largest_free_block()) and the free block histogram
+        (see get_free_block_histogram()), from a single pass over the free blocks."""
+        largest = None
+        histogram = {}
+        for first, last in self.iterate_free_blocks():
+            if largest is None or last - first > largest[1] - largest[0]:
+                largest = (first, last)
+            bucket = get_block_bucket(last - first + 1)
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        if largest is not None:
+            largest = (format(ipaddress.ip_address(largest[0])), format(ipaddress.ip_address(largest[1])))
+        return largest, dict(sorted(histogram.items()))
+
+    @abstractmethod
+    def get_next_free_address(self, offset: int):
+        """Return the first free address at or after the given host offset,
+        wrapping around to the start of the space, or None if the space is full."""
+
+    def allocate_address_for(self, mac: str) -> str:
+        """Allocate an IP address for a device identified by its MAC.
+        The MAC is hashed to a preferred address and the next free address
+        from there is used, so a device lands on the same address across
+        runs and machines for as long as that address is free."""
+        ip_address = self.get_next_free_address(get_preferred_offset(mac, self.get_size()))
+        if ip_address is None:
+            raise NetworkIsOutOfSpace()
+        return self.allocate_specific_address(ip_address)
+
+    def allocate_addresses_for(self, macs: list) -> list:
+        """Allocate an IP address for each MAC. Either all of them are allocated or none are.
+        Collisions are resolved in MAC order so the result does not depend on the order given."""
+        if len(macs) > self.get_free_count():
+            raise NetworkIsOutOfSpace()
+        allocated = {mac: self.allocate_address_for(mac) for mac in sorted(set(macs))}
+        return [allocated[mac] for mac in macs]
+
+    def allocate_addresses(self, number_of_addresses: int) -> list:
+        """Allocate several IP addresses. Either all of them are allocated or none are."""
+        if number_of_addresses > self.get_free_count():
+            raise NetworkIsOutOfSpace()
+        return [self.allocate_address() for _ in range(number_of_addresses)]
+
+    def reconcile(self, ip_addresses: list, release_unused: bool = False) -> list:
+        """Make sure the given addresses, e.g. those in the device table, are allocated.
+        Addresses that are already allocated are left alone, so reconciling twice is harmless.
+        With release_unused, a persisted network space also releases the addresses that are not given
+        (see Ipv4BitmapNetworkSpace.reconcile()), the others start empty on every run."""
+        used_set = self.get_used_set()
+        seen = set()
+        duplicates = []
+        new_addresses = []
+        for ip_address in ip_addresses:
+            if ip_address in seen:
+                if ip_address not in duplicates:
+                    duplicates.append(ip_address)
+            elif ip_address not in used_set:
+                new_addresses.append(ip_address)
+            seen.add(ip_address)
+        if duplicates:
+            address_set = self.get_address_set()
+            raise InvalidAddresses([ip_address for ip_address in new_addresses if ip_address not in address_set], duplicates)
+        self.allocate_specific_addresses(new_addresses)
+        return ip_addresses
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold exclusive use of the network space, which matters only if it is shared with other processes."""
+        yield self
+
+    def close(self) -> None:
+        """Release any resources held by the network space."""
+
+    def allocate_specific_addresses(self, ip_addresses: list) -> list:
+        """Validate and allocate a batch of specific IP addresses.
+        Every out-of-range and duplicate address is reported together in a
+        single InvalidAddresses error, in which case nothing is allocated."""
+        address_set = self.get_address_set()
+        used_set = self.get_used_set()
+        out_of_range = []
+        duplicates = []
+        seen = set()
+        for ip_address in ip_addresses:
+            if ip_address not in address_set:
+                out_of_range.append(ip_address)
+            elif ip_address in seen or ip_address in used_set:
+                if ip_address not in duplicates:
+                    duplicates.append(ip_address)
+            seen.add(ip_address)
+        if out_of_range or duplicates:
+            raise InvalidAddresses(out_of_range, duplicates)
+        for ip_address in ip_addresses:
+            self.allocate_specific_address(ip_address)
+        return ip_addresses
+
+def get_preferred_offset(mac: str, size: int) -> int:
+    """Hash a MAC to a stable host offset in a space of the given size."""
+    # 64 bits covers any IPv4 space and an IPv6 /64, larger spaces need more
+    digest_size = 8 if size <= 1 << 64 else 16
+    digest = hashlib.blake2b(mac.strip().lower().encode('utf8'), digest_size=digest_size).digest()
+    return int.from_bytes(digest, 'big') % size
+
+def get_block_bucket(length: int) -> int:
+    """Return the free block histogram bucket (the largest power of two not above length)."""
+    return 1 << (length.bit_length() - 1)
+
+def iterate_runs(addresses):
+    """Generate the (first, last) of each run of consecutive ints in an ascending iterable."""
+    first = last = None
+    for address in addresses:
+        if last is not None and address == last + 1:
+            last = address
+            continue
+        if first is not None:
+            yield first, last
+        first = last = address
+    if first is not None:
+        yield first, last
+
+def clip_blocks(blocks, start):
+    """Generate the (first, last) blocks, lowest first, with any addresses below start left out."""
+    for first, last in blocks:
+        if start is None:
+            yield first, last
+        elif last >= start:
+            yield max(first, start), last
+
+def get_host_range(ip_network) -> tuple:
+    """Return the first host (as an int) and the number of hosts in a network.
+    Matches ip_network.hosts() without enumerating it."""
+    first = int(ip_network.network_address)
+    size = ip_network.num_addresses
+    if size > 2:
+        # The network and broadcast addresses are not usable hosts
+        return first + 1, size - 2
+    return first, size
+
+class Ipv4PrivateNetworkSpace(NetworkSpace) :
     """IPv4 private network space."""
 
     def __init__(self, cidr) :
@@ -13,17 +256,21 @@ class Ipv4PrivateNetworkSpace :
         if not ip_network.is_private:
             raise ValueError("CIDR must be in the private space")
         self.__cidr = cidr
-        self.__address_set = { format(item) for item in ip_network.hosts() }
+        self.__address_list = [ format(item) for item in ip_network.hosts() ]
+        self.__address_set = set(self.__address_list)
         self.__used_set = set()
+        # Every address in __address_list before this cursor is in use
+        self.__next_free = 0
 
     def allocate_address(self) :
         """Allocate an IP address."""
-        try:
-            return_address = self.get_unused_set().pop()
-            self.__used_set.add(return_address)
-            return return_address
-        except KeyError as exc:
-            raise NetworkIsOutOfSpace() from exc
+        while self.__next_free < len(self.__address_list):
+            return_address = self.__address_list[self.__next_free]
+            self.__next_free += 1
+            if return_address not in self.__used_set:
+                self.__used_set.add(return_address)
+                return return_address
+        raise NetworkIsOutOfSpace()
 
     def allocate_specific_address(self, ip_address) :
         """Allocate a specific IP address."""
@@ -42,51 +289,1262 @@ class Ipv4PrivateNetworkSpace :
         """Return the set of IPv4 addresses that have been allocated."""
         return self.__used_set
 
-    def get_unused_set(self) :
-        """Return the set of IPv4 addresses that are available to be allocated."""
-        return self.__address_set - self.__used_set
+    def get_next_free_address(self, offset):
+        size = len(self.__address_list)
+        for probe in range(size):
+            ip_address = self.__address_list[(offset + probe) % size]
+            if ip_address not in self.__used_set:
+                return ip_address
+        return None
+
+    def iterate_free_blocks(self, start=None):
+        if not self.__address_list:
+            return iter(())
+        first_host = int(ipaddress.IPv4Address(self.__address_list[0]))
+        first_index = self.__next_free if start is None else max(self.__next_free, start - first_host)
+        return iterate_runs(
+            first_host + index for index in range(first_index, len(self.__address_list))
+            if self.__address_list[index] not in self.__used_set)
+
+    def get_unused_set(self) -> AddressView:
+        """Return a view of the IPv4 addresses that are available to be allocated."""
+        return AddressView(
+            contains=lambda ip_address: ip_address in self.__address_set and ip_address not in self.__used_set,
+            iterate=lambda: (
+                ip_address for ip_address in itertools.islice(self.__address_list, self.__next_free, None)
+                if ip_address not in self.__used_set),
+            size=lambda: len(self.__address_set) - len(self.__used_set))
+
+class Ipv4BitmapNetworkSpace(NetworkSpace) :
+    """IPv4 private network space backed by a bitmap with one bit per host.
+
+    Addresses are held as host offsets and only converted to strings at the
+    API edge, so a /8 costs 2 MiB rather than millions of strings.
+    """
+
+    SCAN_CHUNK = 4096
+    EMPTY_CHUNK = bytes(SCAN_CHUNK)
+    FULL_CHUNK = b"\xff" * SCAN_CHUNK
+    # Find where a stretch of empty or full bytes ends without stepping through it byte by byte
+    SCAN_PAST = {0x00: re.compile(rb"[^\x00]"), 0xff: re.compile(rb"[^\xff]")}
+
+    def __init__(self, cidr, state_file=None, read_only=False) :
+        """state_file, if given, persists the bitmap so the next run starts from this one's allocations.
+        A read_only network space starts from the state file but never writes to it."""
+        ip_network = ipaddress.ip_network(cidr)
+        if ip_network.version != 4:
+            raise ValueError("CIDR must be IPv4")
+        if not ip_network.is_private:
+            raise ValueError("CIDR must be in the private space")
+        self.__cidr = cidr
+        self.__first_host, self.__size = get_host_range(ip_network)
+        self.__next_free_byte = 0
+        if state_file is None or (read_only and not os.path.exists(state_file)):
+            self.__state = None
+            self.__bitmap = memoryview(bytearray((self.__size + 7) // 8))
+            self.__used_count = 0
+            self.__mark_padding()
+        else:
+            self.__state = BitmapStateFile(state_file, self.__first_host, self.__size, read_only)
+            self.__bitmap = self.__state.get_bitmap()
+            if self.__state.is_new():
+                self.__mark_padding()
+            self.__used_count = self.__state.get_used_count()
+
+    def allocate_address(self) :
+        """Allocate an IP address."""
+        offset = self.__find_free_offset()
+        if offset is None:
+            raise NetworkIsOutOfSpace()
+        self.__mark_used(offset)
+        return self.__to_address(offset)
+
+    def allocate_specific_address(self, ip_address) :
+        """Allocate a specific IP address."""
+        offset = self.__to_offset(ip_address)
+        if offset is None:
+            raise ValueError(f'specified ip_address not in {self.__cidr}')
+        if self.__is_used(offset):
+            raise ValueError("specified ip_address already in use")
+        self.__mark_used(offset)
+        return ip_address
+
+    def get_address_set(self) -> AddressView:
+        """Return a view of all IPv4 addresses in the space."""
+        return AddressView(
+            contains=lambda ip_address: self.__to_offset(ip_address) is not None,
+            iterate=lambda: (self.__to_address(offset) for offset in range(self.__size)),
+            size=lambda: self.__size)
+
+    def get_used_set(self) -> AddressView:
+        """Return a view of the IPv4 addresses that have been allocated."""
+        return AddressView(
+            contains=self.__contains_used,
+            iterate=lambda: (self.__to_address(offset) for offset in self.__iterate_offsets(used=True)),
+            size=lambda: self.__used_count)
+
+    def get_unused_set(self) -> AddressView:
+        """Return a view of the IPv4 addresses that are available to be allocated."""
+        return AddressView(
+            contains=self.__contains_unused,
+            iterate=lambda: (self.__to_address(offset) for offset in self.__iterate_offsets(used=False)),
+            size=lambda: self.__size - self.__used_count)
+
+    def get_size(self) -> int:
+        return self.__size
+
+    def reconcile(self, ip_addresses: list, release_unused: bool = False) -> list:
+        """Make sure the given addresses are allocated, leaving any others that are allocated,
+        e.g. by another run sharing the state file, alone. With release_unused the allocated
+        addresses are made exactly the given ones, which is only safe when they are every
+        address in use, e.g. loaded while holding the lock. Only the bits that change are written."""
+        offsets = set()
+        out_of_range = []
+        duplicates = []
+        for ip_address in ip_addresses:
+            offset = self.__to_offset(ip_address)
+            if offset is None:
+                out_of_range.append(ip_address)
+            elif offset in offsets:
+                if ip_address not in duplicates:
+                    duplicates.append(ip_address)
+            offsets.add(offset)
+        if out_of_range or duplicates:
+            raise InvalidAddresses(out_of_range, duplicates)
+        if release_unused:
+            for offset in [offset for offset in self.__iterate_offsets(used=True) if offset not in offsets]:
+                self.__mark_free(offset)
+        for offset in offsets:
+            if not self.__is_used(offset):
+                self.__mark_used(offset)
+        return ip_addresses
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the state file lock, picking up any allocations made by other processes."""
+        if self.__state is None:
+            yield self
+            return
+        with self.__state.locked():
+            self.__used_count = self.__state.get_used_count()
+            self.__next_free_byte = 0
+            yield self
+            self.__state.flush()
+
+    def get_used_count(self) -> int:
+        return self.__used_count
+
+    def iterate_free_blocks(self, start=None):
+        start_byte = 0 if start is None else max(0, start - self.__first_host) >> 3
+        return clip_blocks(self.__iterate_free_runs(start_byte), start)
+
+    def __iterate_free_runs(self, start_byte):
+        bitmap = self.__bitmap
+        run_start = None
+        for position in range(start_byte, len(bitmap), Ipv4BitmapNetworkSpace.SCAN_CHUNK):
+            chunk = bytes(bitmap[position:position + Ipv4BitmapNetworkSpace.SCAN_CHUNK])
+            if chunk == Ipv4BitmapNetworkSpace.EMPTY_CHUNK[:len(chunk)]:
+                if run_start is None:
+                    run_start = position << 3
+                continue
+            if chunk == Ipv4BitmapNetworkSpace.FULL_CHUNK[:len(chunk)]:
+                if run_start is not None:
+                    yield self.__first_host + run_start, self.__first_host + (position << 3) - 1
+                    run_start = None
+                continue
+            index = 0
+            while index < len(chunk):
+                byte, byte_index = chunk[index], position + index
+                if byte in Ipv4BitmapNetworkSpace.SCAN_PAST:
+                    if byte == 0x00 and run_start is None:
+                        run_start = byte_index << 3
+                    elif byte == 0xff and run_start is not None:
+                        yield self.__first_host + run_start, self.__first_host + (byte_index << 3) - 1
+                        run_start = None
+                    match = Ipv4BitmapNetworkSpace.SCAN_PAST[byte].search(chunk, index)
+                    index = match.start() if match else len(chunk)
+                    continue
+                for bit in range(8):
+                    offset = (byte_index << 3) + bit
+                    if byte & (1 << bit):
+                        if run_start is not None:
+                            yield self.__first_host + run_start, self.__first_host + offset - 1
+                            run_start = None
+                    elif run_start is None:
+                        run_start = offset
+                index += 1
+        if run_start is not None:
+            yield self.__first_host + run_start, self.__first_host + self.__size - 1
+
+    def close(self) -> None:
+        if self.__state is not None:
+            self.__bitmap.release()
+            self.__state.close()
+            self.__state = None
+
+    def get_next_free_address(self, offset):
+        byte_index = offset >> 3
+        # Treat the bits below offset as used so only offset and above are considered
+        byte = self.__bitmap[byte_index] | ((1 << (offset & 7)) - 1)
+        if byte != 0xff:
+            return self.__to_address(Ipv4BitmapNetworkSpace.__lowest_free_offset(byte_index, byte))
+        for position in (byte_index + 1, 0):
+            free_byte = self.__find_free_byte(position)
+            if free_byte is not None:
+                return self.__to_address(
+                    Ipv4BitmapNetworkSpace.__lowest_free_offset(free_byte, self.__bitmap[free_byte]))
+        return None
+
+    def __to_offset(self, ip_address):
+        """Return the host offset of an address, or None if it is not in the space."""
+        try:
+            offset = int(ipaddress.IPv4Address(ip_address)) - self.__first_host
+        except ValueError:
+            return None
+        if 0 <= offset < self.__size:
+            return offset
+        return None
+
+    def __to_address(self, offset) -> str:
+        return format(ipaddress.IPv4Address(self.__first_host + offset))
+
+    def __is_used(self, offset) -> bool:
+        return bool(self.__bitmap[offset >> 3] & (1 << (offset & 7)))
+
+    def __contains_used(self, ip_address) -> bool:
+        offset = self.__to_offset(ip_address)
+        return offset is not None and self.__is_used(offset)
+
+    def __contains_unused(self, ip_address) -> bool:
+        offset = self.__to_offset(ip_address)
+        return offset is not None and not self.__is_used(offset)
+
+    def __mark_used(self, offset) -> None:
+        self.__bitmap[offset >> 3] |= 1 << (offset & 7)
+        self.__set_used_count(self.__used_count + 1)
+
+    def __mark_free(self, offset) -> None:
+        self.__bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xff
+        self.__set_used_count(self.__used_count - 1)
+        self.__next_free_byte = min(self.__next_free_byte, offset >> 3)
+
+    def __set_used_count(self, used_count) -> None:
+        self.__used_count = used_count
+        if self.__state is not None:
+            self.__state.set_used_count(used_count)
+
+    def __mark_padding(self) -> None:
+        """Mark the padding bits in the last byte as used so they are never allocated."""
+        for offset in range(self.__size, len(self.__bitmap) * 8):
+            self.__bitmap[offset >> 3] |= 1 << (offset & 7)
+
+    def __find_free_offset(self):
+        """Return the lowest free offset at or after the scan hint, or None if the space is full."""
+        byte_index = self.__find_free_byte(self.__next_free_byte)
+        if byte_index is None:
+            self.__next_free_byte = len(self.__bitmap)
+            return None
+        self.__next_free_byte = byte_index
+        return Ipv4BitmapNetworkSpace.__lowest_free_offset(byte_index, self.__bitmap[byte_index])
+
+    def __find_free_byte(self, position):
+        """Return the index of the first byte at or after position with a free bit, or None."""
+        bitmap = self.__bitmap
+        while position < len(bitmap):
+            chunk = bytes(bitmap[position:position + Ipv4BitmapNetworkSpace.SCAN_CHUNK])
+            remainder = chunk.lstrip(b'\xff')
+            if remainder:
+                return position + len(chunk) - len(remainder)
+            position += len(chunk)
+        return None
+
+    @staticmethod
+    def __lowest_free_offset(byte_index, byte) -> int:
+        return (byte_index << 3) + ((~byte & (byte + 1)).bit_length() - 1)
+
+    def __iterate_offsets(self, used: bool):
+        """Generate the offsets that are used (or unused), skipping uniform chunks."""
+        bitmap = self.__bitmap
+        skip = 0x00 if used else 0xff
+        for position in range(0, len(bitmap), Ipv4BitmapNetworkSpace.SCAN_CHUNK):
+            chunk = bytes(bitmap[position:position + Ipv4BitmapNetworkSpace.SCAN_CHUNK])
+            if chunk.count(skip) == len(chunk):
+                continue
+            for byte_index, byte in enumerate(chunk, start=position):
+                if byte == skip:
+                    continue
+                for bit in range(8):
+                    offset = (byte_index << 3) + bit
+                    if offset < self.__size and bool(byte & (1 << bit)) == used:
+                        yield offset
+
+class BitmapStateFile :
+    """A network space bitmap persisted to a file and shared through mmap.
+
+    The file is a small header (the network and the number of used
+    addresses) followed by the bitmap. A file for a different network is
+    started afresh. Processes sharing the file serialize changes with locked(),
+    which may be nested. A read_only file is mapped copy-on-write, so that
+    changes are never written back, and one for a different network is
+    started afresh in memory only.
+    """
+
+    MAGIC = b'NETORGBM'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIIIQ')
+    USED_COUNT = struct.Struct('<Q')
+    USED_COUNT_POSITION = 20
+
+    def __init__(self, filename, first_host, size, read_only=False) -> None:
+        self.__filename = filename
+        self.__read_only = read_only
+        self.__lock_depth = 0
+        length = BitmapStateFile.HEADER.size + (size + 7) // 8
+        self.__fd = os.open(filename, os.O_RDONLY if read_only else os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with self.locked():
+                self.__new = not self.__matches(length, first_host, size)
+                if read_only:
+                    self.__mmap = mmap.mmap(-1, length) if self.__new else mmap.mmap(
+                        self.__fd, length, access=mmap.ACCESS_COPY)
+                else:
+                    if self.__new:
+                        os.ftruncate(self.__fd, 0)
+                        os.ftruncate(self.__fd, length)
+                    self.__mmap = mmap.mmap(self.__fd, length)
+                if self.__new:
+                    BitmapStateFile.HEADER.pack_into(
+                        self.__mmap, 0, BitmapStateFile.MAGIC, BitmapStateFile.VERSION, first_host, size, 0)
+        except (OSError, ValueError):
+            os.close(self.__fd)
+            raise
+
+    def get_filename(self) -> str:
+        """Return the name of the state file."""
+        return self.__filename
+
+    def is_new(self) -> bool:
+        """Return True if the file was created (or started afresh) when it was opened."""
+        return self.__new
+
+    def get_bitmap(self) -> memoryview:
+        """Return a writable view of the bitmap, which must be released before close()."""
+        return memoryview(self.__mmap)[BitmapStateFile.HEADER.size:]
+
+    def get_used_count(self) -> int:
+        """Return the number of used addresses recorded in the file."""
+        return BitmapStateFile.USED_COUNT.unpack_from(self.__mmap, BitmapStateFile.USED_COUNT_POSITION)[0]
+
+    def set_used_count(self, used_count) -> None:
+        """Record the number of used addresses in the file."""
+        BitmapStateFile.USED_COUNT.pack_into(self.__mmap, BitmapStateFile.USED_COUNT_POSITION, used_count)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold an exclusive lock on the file (shared if read_only) until the outermost locked() returns."""
+        if fcntl is None:
+            yield self
+            return
+        if self.__lock_depth == 0:
+            fcntl.flock(self.__fd, fcntl.LOCK_SH if self.__read_only else fcntl.LOCK_EX)
+        self.__lock_depth += 1
+        try:
+            yield self
+        finally:
+            self.__lock_depth -= 1
+            if self.__lock_depth == 0:
+                fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+    def flush(self) -> None:
+        """Write the bitmap back to the file, unless it is read_only."""
+        if not self.__read_only:
+            self.__mmap.flush()
+
+    def close(self) -> None:
+        """Flush and close the file."""
+        self.flush()
+        self.__mmap.close()
+        os.close(self.__fd)
+
+    def __matches(self, length, first_host, size) -> bool:
+        """Return True if the file already holds a bitmap for this network."""
+        if os.fstat(self.__fd).st_size != length:
+            return False
+        os.lseek(self.__fd, 0, os.SEEK_SET)
+        header = os.read(self.__fd, BitmapStateFile.HEADER.size)
+        magic, version, file_first_host, file_size, _ = BitmapStateFile.HEADER.unpack(header)
+        return (magic, version, file_first_host, file_size) == (
+            BitmapStateFile.MAGIC, BitmapStateFile.VERSION, first_host, size)
+
+def parse_address_ranges(specs, ip_network) -> list:
+    """Parse address range specifications into sorted (first, last) int pairs.
+    Each spec is a single address ('192.168.128.1'), an inclusive range
+    ('192.168.128.100-192.168.128.199') or a CIDR ('192.168.128.0/28').
+    Ranges are clipped to the network and must overlap it."""
+    ranges = []
+    for spec in specs:
+        spec = str(spec).strip()
+        if '-' in spec:
+            first, last = (ipaddress.ip_address(part.strip()) for part in spec.split('-', 1))
+        elif '/' in spec:
+            range_network = ipaddress.ip_network(spec)
+            first, last = range_network.network_address, range_network.broadcast_address
+        else:
+            first = last = ipaddress.ip_address(spec)
+        if first.version != ip_network.version or int(first) > int(last):
+            raise ValueError(f'invalid address range {spec}')
+        first = max(int(first), int(ip_network.network_address))
+        last = min(int(last), int(ip_network.broadcast_address))
+        if first > last:
+            raise ValueError(f'address range {spec} is not in {ip_network}')
+        ranges.append((first, last))
+    return sorted(ranges)
+
+class Ipv4IntervalNetworkSpace(NetworkSpace) :
+    """IPv4 private network space that stores free addresses as sorted intervals.
+
+    Memory tracks the number of free intervals rather than the number of
+    addresses. Exclusions (gateway, DHCP pool, infrastructure ranges) are
+    never handed out by allocate_address, although an existing device may
+    still claim one with allocate_specific_address.
+    """
+
+    def __init__(self, cidr, exclusions=None) :
+        ip_network = ipaddress.ip_network(cidr)
+        if ip_network.version != 4:
+            raise ValueError("CIDR must be IPv4")
+        if not ip_network.is_private:
+            raise ValueError("CIDR must be in the private space")
+        self.__cidr = cidr
+        self.__first_host, self.__size = get_host_range(ip_network)
+        last_host = self.__first_host + self.__size - 1
+        # Free intervals are inclusive and kept as parallel sorted lists
+        self.__starts = []
+        self.__ends = []
+        next_start = self.__first_host
+        for first, last in parse_address_ranges(exclusions or [], ip_network):
+            if first > next_start:
+                self.__starts.append(next_start)
+                self.__ends.append(min(first - 1, last_host))
+            next_start = max(next_start, last + 1)
+        if next_start <= last_host:
+            self.__starts.append(next_start)
+            self.__ends.append(last_host)
+        self.__free_count = sum(end - start + 1 for start, end in zip(self.__starts, self.__ends))
+        # Max-heap of (-length, start) with lazy deletion of stale entries
+        self.__largest_blocks = [(start - end - 1, start) for start, end in zip(self.__starts, self.__ends)]
+        heapq.heapify(self.__largest_blocks)
+        # Number of free intervals in each get_block_bucket(), kept up to date as addresses are allocated
+        self.__block_histogram = {}
+        for start, end in zip(self.__starts, self.__ends):
+            self.__count_block(start, end, 1)
+        self.__used = set()
+
+    def allocate_address(self) :
+        """Allocate the lowest free IP address."""
+        if not self.__starts:
+            raise NetworkIsOutOfSpace()
+        address = self.__starts[0]
+        self.__remove_free(address)
+        self.__used.add(address)
+        return format(ipaddress.IPv4Address(address))
+
+    def allocate_specific_address(self, ip_address) :
+        """Allocate a specific IP address."""
+        address = self.__to_int(ip_address)
+        if address is None:
+            raise ValueError(f'specified ip_address not in {self.__cidr}')
+        if address in self.__used:
+            raise ValueError("specified ip_address already in use")
+        self.__remove_free(address)
+        self.__used.add(address)
+        return ip_address
+
+    def get_address_set(self) -> AddressView:
+        """Return a view of all IPv4 addresses in the space."""
+        return AddressView(
+            contains=lambda ip_address: self.__to_int(ip_address) is not None,
+            iterate=lambda: (format(ipaddress.IPv4Address(address))
+                for address in range(self.__first_host, self.__first_host + self.__size)),
+            size=lambda: self.__size)
+
+    def get_used_set(self) -> AddressView:
+        """Return a view of the IPv4 addresses that have been allocated."""
+        return AddressView(
+            contains=lambda ip_address: self.__to_int(ip_address) in self.__used,
+            iterate=lambda: (format(ipaddress.IPv4Address(address)) for address in sorted(self.__used)),
+            size=lambda: len(self.__used))
+
+    def get_unused_set(self) -> AddressView:
+        """Return a view of the IPv4 addresses that are available to be allocated."""
+        return AddressView(
+            contains=lambda ip_address: self.__find_interval(self.__to_int(ip_address)) is not None,
+            iterate=lambda: (format(ipaddress.IPv4Address(address))
+                for start, end in zip(self.__starts, self.__ends) for address in range(start, end + 1)),
+            size=lambda: self.__free_count)
+
+    def get_size(self) -> int:
+        return self.__size
+
+    def get_lowest_free_address(self):
+        """Return the lowest free address, or None if the space is full."""
+        if not self.__starts:
+            return None
+        return format(ipaddress.IPv4Address(self.__starts[0]))
+
+    def get_free_count(self) -> int:
+        """Return the number of addresses available to be allocated."""
+        return self.__free_count
+
+    def get_largest_free_block(self):
+        """Return the (first, last) addresses of the largest contiguous free block,
+        or None if the space is full. Ties go to the lowest block."""
+        while self.__largest_blocks:
+            negative_length, start = self.__largest_blocks[0]
+            index = self.__find_interval(start)
+            if index is not None and self.__starts[index] == start \
+                    and self.__ends[index] - start + 1 == -negative_length:
+                return (format(ipaddress.IPv4Address(start)),
+                        format(ipaddress.IPv4Address(self.__ends[index])))
+            heapq.heappop(self.__largest_blocks)
+        return None
+
+    def get_next_free_address(self, offset):
+        if not self.__starts:
+            return None
+        address = self.__first_host + offset
+        index = bisect.bisect_right(self.__starts, address) - 1
+        if index >= 0 and address <= self.__ends[index]:
+            return format(ipaddress.IPv4Address(address))
+        # Use the start of the next interval, wrapping around to the first
+        next_index = index + 1 if index + 1 < len(self.__starts) else 0
+        return format(ipaddress.IPv4Address(self.__starts[next_index]))
+
+    def get_used_count(self) -> int:
+        return len(self.__used)
+
+    def iterate_free_blocks(self, start=None):
+        index = 0 if start is None else bisect.bisect_left(self.__ends, start)
+        return clip_blocks(zip(self.__starts[index:], self.__ends[index:]), start)
+
+    def get_free_block_histogram(self) -> dict:
+        return {bucket: count for bucket, count in sorted(self.__block_histogram.items()) if count}
+
+    def get_free_block_summary(self) -> tuple:
+        # The intervals keep both up to date, so there is nothing to scan
+        return self.get_largest_free_block(), self.get_free_block_histogram()
+
+    def get_free_intervals(self) -> list:
+        """Return the free intervals as (first, last) address pairs."""
+        return [(format(ipaddress.IPv4Address(start)), format(ipaddress.IPv4Address(end)))
+                for start, end in zip(self.__starts, self.__ends)]
+
+    def __to_int(self, ip_address):
+        """Return the address as an int, or None if it is not a host in the space."""
+        try:
+            address = int(ipaddress.IPv4Address(ip_address))
+        except ValueError:
+            return None
+        if self.__first_host <= address < self.__first_host + self.__size:
+            return address
+        return None
+
+    def __find_interval(self, address):
+        """Return the index of the free interval containing address, or None."""
+        if address is None:
+            return None
+        index = bisect.bisect_right(self.__starts, address) - 1
+        if index >= 0 and address <= self.__ends[index]:
+            return index
+        return None
+
+    def __remove_free(self, address) -> None:
+        """Remove an address from the free intervals (if it is free)."""
+        index = self.__find_interval(address)
+        if index is None:
+            return
+        start, end = self.__starts[index], self.__ends[index]
+        self.__count_block(start, end, -1)
+        if address > start:
+            self.__count_block(start, address - 1, 1)
+        if address < end:
+            self.__count_block(address + 1, end, 1)
+        if start == end:
+            del self.__starts[index]
+            del self.__ends[index]
+        elif address == start:
+            self.__starts[index] = address + 1
+            self.__push_block(address + 1, end)
+        elif address == end:
+            self.__ends[index] = address - 1
+            self.__push_block(start, address - 1)
+        else:
+            self.__ends[index] = address - 1
+            self.__starts.insert(index + 1, address + 1)
+            self.__ends.insert(index + 1, end)
+            self.__push_block(start, address - 1)
+            self.__push_block(address + 1, end)
+        self.__free_count -= 1
+
+    def __count_block(self, start, end, change) -> None:
+        bucket = get_block_bucket(end - start + 1)
+        self.__block_histogram[bucket] = self.__block_histogram.get(bucket, 0) + change
+
+    def __push_block(self, start, end) -> None:
+        heapq.heappush(self.__largest_blocks, (start - end - 1, start))
+        if len(self.__largest_blocks) > 2 * len(self.__starts) + 16:
+            # Drop the stale entries so the heap stays proportional to the intervals
+            self.__largest_blocks = [(s - e - 1, s) for s, e in zip(self.__starts, self.__ends)]
+            heapq.heapify(self.__largest_blocks)
+
+def get_interface_identifier(mac: str):
+    """Return the modified EUI-64 interface identifier (as an int) for a MAC,
+    or None if it is not a 48 bit MAC."""
+    digits = mac.strip().lower().replace(':', '').replace('-', '').replace('.', '')
+    if len(digits) != 12 or any(digit not in '0123456789abcdef' for digit in digits):
+        return None
+    mac_value = int(digits, 16)
+    oui, nic = mac_value >> 24, mac_value & 0xffffff
+    # Insert ff:fe in the middle and flip the universal/local bit
+    return ((oui << 40) | (0xfffe << 24) | nic) ^ (0x02 << 56)
+
+class Ipv6SparseNetworkSpace(NetworkSpace) :
+    """IPv6 network space that only stores the addresses in use.
+
+    The address range is never enumerated, so memory is proportional to the
+    number of devices rather than the size of the network. A device's
+    preferred address is its EUI-64 address in a /64, otherwise its hashed
+    MAC offset. The views of the space support membership and iteration but,
+    as for any very large space, use get_size() and get_free_count() rather
+    than len().
+    """
+
+    def __init__(self, cidr) :
+        ip_network = ipaddress.ip_network(cidr)
+        if ip_network.version != 6:
+            raise ValueError("CIDR must be IPv6")
+        self.__cidr = cidr
+        self.__ip_network = ip_network
+        self.__network_address = int(ip_network.network_address)
+        # The Subnet-Router anycast address (all zero interface identifier) is not a usable host
+        self.__first_host = self.__network_address + 1 if ip_network.num_addresses > 1 else self.__network_address
+        self.__size = self.__network_address + ip_network.num_addresses - self.__first_host
+        self.__used = set()
+        # Every address before this cursor is in use
+        self.__next_free = 0
+
+    def allocate_address(self) :
+        """Allocate the lowest free IP address."""
+        while self.__next_free < self.__size:
+            address = self.__first_host + self.__next_free
+            self.__next_free += 1
+            if address not in self.__used:
+                self.__used.add(address)
+                return self.__to_address(address)
+        raise NetworkIsOutOfSpace()
+
+    def allocate_specific_address(self, ip_address) :
+        """Allocate a specific IP address."""
+        address = self.__to_int(ip_address)
+        if address is None:
+            raise ValueError(f'specified ip_address not in {self.__cidr}')
+        if address in self.__used:
+            raise ValueError("specified ip_address already in use")
+        self.__used.add(address)
+        return self.__to_address(address)
+
+    def allocate_address_for(self, mac: str) -> str:
+        """Allocate the device's EUI-64 address in a /64 if it is free,
+        otherwise the next free address from its hashed MAC offset."""
+        offset = None
+        interface_identifier = get_interface_identifier(mac)
+        if self.__ip_network.prefixlen == 64 and interface_identifier is not None:
+            offset = self.__network_address + interface_identifier - self.__first_host
+        if offset is None or offset < 0:
+            offset = get_preferred_offset(mac, self.__size)
+        ip_address = self.get_next_free_address(offset)
+        if ip_address is None:
+            raise NetworkIsOutOfSpace()
+        return self.allocate_specific_address(ip_address)
+
+    def get_address_set(self) -> AddressView:
+        """Return a view of all IPv6 addresses in the space."""
+        return AddressView(
+            contains=lambda ip_address: self.__to_int(ip_address) is not None,
+            iterate=lambda: (self.__to_address(address)
+                for address in range(self.__first_host, self.__first_host + self.__size)),
+            size=lambda: self.__size)
+
+    def get_used_set(self) -> AddressView:
+        """Return a view of the IPv6 addresses that have been allocated."""
+        return AddressView(
+            contains=lambda ip_address: self.__to_int(ip_address) in self.__used,
+            iterate=lambda: (self.__to_address(address) for address in sorted(self.__used)),
+            size=lambda: len(self.__used))
+
+    def get_unused_set(self) -> AddressView:
+        """Return a view of the IPv6 addresses that are available to be allocated."""
+        return AddressView(
+            contains=self.__contains_unused,
+            iterate=lambda: (self.__to_address(address)
+                for address in range(self.__first_host + self.__next_free, self.__first_host + self.__size)
+                if address not in self.__used),
+            size=self.get_free_count)
+
+    def get_size(self) -> int:
+        return self.__size
+
+    def get_free_count(self) -> int:
+        return self.__size - len(self.__used)
+
+    def get_used_count(self) -> int:
+        return len(self.__used)
+
+    def iterate_free_blocks(self, start=None):
+        previous = self.__first_host - 1
+        if start is not None:
+            previous = max(previous, start - 1)
+        for address in sorted(self.__used):
+            if address <= previous:
+                continue
+            if address > previous + 1:
+                yield previous + 1, address - 1
+            previous = address
+        if previous < self.__first_host + self.__size - 1:
+            yield previous + 1, self.__first_host + self.__size - 1
+
+    def get_next_free_address(self, offset):
+        if self.get_free_count() == 0:
+            return None
+        # The space is sparse, so linear probing ends after a few steps
+        offset %= self.__size
+        while self.__first_host + offset in self.__used:
+            offset = (offset + 1) % self.__size
+        return self.__to_address(self.__first_host + offset)
+
+    def __contains_unused(self, ip_address) -> bool:
+        address = self.__to_int(ip_address)
+        return address is not None and address not in self.__used
+
+    def __to_int(self, ip_address):
+        """Return the address as an int, or None if it is not a host in the space."""
+        try:
+            address = ipaddress.IPv6Address(ip_address)
+        except ValueError:
+            return None
+        address = int(address)
+        if self.__first_host <= address < self.__first_host + self.__size:
+            return address
+        return None
+
+    @staticmethod
+    def __to_address(address) -> str:
+        return format(ipaddress.IPv6Address(address))
+
+NETWORK_SPACE_TYPES = {
+    'set': Ipv4PrivateNetworkSpace,
+    'bitmap': Ipv4BitmapNetworkSpace,
+    'interval': Ipv4IntervalNetworkSpace
+}
+
+IPV6_NETWORK_SPACE_TYPES = {
+    'sparse': Ipv6SparseNetworkSpace
+}
+
+def create_network_space(cidr, space_type='set', exclusions=None, state_file=None, read_only=False) -> NetworkSpace:
+    """Create a network space of the given type (see NETWORK_SPACE_TYPES).
+    Only the interval network space supports exclusions and only the bitmap
+    network space can be persisted to a state file (read_only, it is never written). An IPv6 CIDR gets the
+    sparse network space, which is also what the default 'set' means for IPv6."""
+    if ipaddress.ip_network(cidr).version == 6:
+        if space_type not in ('set', *IPV6_NETWORK_SPACE_TYPES) or exclusions or state_file:
+            raise ValueError(f'network space type {space_type} does not support IPv6')
+        return Ipv6SparseNetworkSpace(cidr)
+    if space_type not in NETWORK_SPACE_TYPES:
+        raise ValueError(f'unknown network space type {space_type}')
+    if state_file:
+        if space_type != 'bitmap' or exclusions:
+            raise ValueError(f'network space type {space_type} cannot be persisted')
+        return Ipv4BitmapNetworkSpace(cidr, state_file, read_only)
+    if exclusions:
+        if space_type != 'interval':
+            raise ValueError(f'network space type {space_type} does not support exclusions')
+        return Ipv4IntervalNetworkSpace(cidr, exclusions)
+    return NETWORK_SPACE_TYPES[space_type](cidr)
+
+def summarize_addresses(ip_addresses) -> list:
+    """Collapse a list of addresses into the fewest CIDRs that cover exactly those addresses.
+    Single addresses are returned without a prefix length, e.g.
+    ['192.168.128.8', '192.168.128.9', '192.168.128.10', '192.168.128.11', '192.168.128.20']
+    becomes
+    ['192.168.128.8/30', '192.168.128.20']
+    A mix of IPv4 and IPv6 addresses is collapsed one version at a time, IPv4 first."""
+    addresses = [ipaddress.ip_address(ip_address) for ip_address in ip_addresses if ip_address]
+    networks = itertools.chain.from_iterable(
+        ipaddress.collapse_addresses(address for address in addresses if address.version == version)
+        for version in (4, 6))
+    return [str(network.network_address) if network.num_addresses == 1 else str(network)
+            for network in networks]
+
+class GroupBlockAllocator:
+    """Place the new members of each group inside an aligned block of the network
+    reserved for that group, so the group collapses to a handful of CIDRs."""
+
+    def __init__(self, network_space: NetworkSpace, ip_network, occupied: dict) -> None:
+        """occupied maps each address (as an int) that is already in use to its group."""
+        self.__network_space = network_space
+        self.__network_first = int(ip_network.network_address)
+        self.__network_size = ip_network.num_addresses
+        self.__address_class = ipaddress.IPv4Address if ip_network.version == 4 else ipaddress.IPv6Address
+        self.__occupied = dict(occupied)
+        self.__occupied_sorted = sorted(occupied)
+        self.__members = {}
+        for address, group in occupied.items():
+            self.__members.setdefault(group, []).append(address)
+        # For each block size, every aligned block below this has been taken or turned down
+        self.__cursors = {}
+
+    def get_block_size(self, number_of_members: int, headroom: int) -> int:
+        """Return the smallest power of two that holds the members plus headroom."""
+        wanted = max(1, number_of_members + headroom)
+        return min(1 << (wanted - 1).bit_length(), self.__network_size)
+
+    def allocate(self, group: str, macs: list, block_size: int) -> list:
+        """Allocate an address for each MAC inside the group's block. If no block
+        has room, fall back to MAC-hashed allocation anywhere in the network."""
+        block_start = self.__find_block(group, len(macs), block_size)
+        if block_start is None:
+            ip_addresses = self.__network_space.allocate_addresses_for(macs)
+        else:
+            ip_addresses = [self.__network_space.allocate_specific_address(self.__to_string(address))
+                            for address in self.__free_in(block_start, block_size)[:len(macs)]]
+        for ip_address in ip_addresses:
+            self.__occupy(int(ipaddress.ip_address(ip_address)), group)
+        return ip_addresses
+
+    def __find_block(self, group, needed, block_size):
+        """Prefer the aligned block holding the most existing members of the group,
+        otherwise the lowest aligned block not used by any other group."""
+        best_start = None
+        best_members = 0
+        candidates = sorted({self.__align(address, block_size) for address in self.__members.get(group, ())})
+        for start in candidates:
+            owners = self.__owners(start, block_size)
+            if owners - {group} or len(self.__free_in(start, block_size)) < needed:
+                continue
+            members = sum(1 for address in self.__occupied_in(start, block_size))
+            if members > best_members:
+                best_start, best_members = start, members
+        if best_start is not None:
+            return best_start
+        # Blocks only ever fill up, so the search for a size carries on from where the last one stopped
+        cursor = self.__cursors.get(block_size, self.__network_first)
+        for start, free in self.__iterate_free_counts(block_size, cursor):
+            if free >= needed and not self.__occupied_in(start, block_size):
+                self.__cursors[block_size] = start + block_size
+                return start
+        self.__cursors[block_size] = self.__network_first + self.__network_size
+        return None
+
+    def __iterate_free_counts(self, block_size, cursor):
+        """Generate the start of each aligned block from the cursor on that has a free address, and how many
+        free addresses it has, from the network space's free blocks rather than address by address."""
+        block_start, count = None, 0
+        for first, last in self.__network_space.iterate_free_blocks(cursor):
+            while first <= last:
+                start = self.__align(first, block_size)
+                end = min(last, start + block_size - 1)
+                if start != block_start:
+                    if block_start is not None:
+                        yield block_start, count
+                    block_start, count = start, 0
+                count += end - first + 1
+                first = end + 1
+        if block_start is not None:
+            yield block_start, count
+
+    def __align(self, address, block_size) -> int:
+        return self.__network_first + (address - self.__network_first) // block_size * block_size
+
+    def __occupied_in(self, start, block_size) -> list:
+        low = bisect.bisect_left(self.__occupied_sorted, start)
+        high = bisect.bisect_left(self.__occupied_sorted, start + block_size)
+        return self.__occupied_sorted[low:high]
+
+    def __owners(self, start, block_size) -> set:
+        return {self.__occupied[address] for address in self.__occupied_in(start, block_size)}
+
+    def __free_in(self, start, block_size) -> list:
+        free = []
+        for first, last in self.__network_space.iterate_free_blocks(start):
+            if first >= start + block_size:
+                break
+            free.extend(address for address in range(first, min(last, start + block_size - 1) + 1)
+                        if address not in self.__occupied)
+        return free
+
+    def __occupy(self, address, group) -> None:
+        self.__occupied[address] = group
+        self.__members.setdefault(group, []).append(address)
+        bisect.insort(self.__occupied_sorted, address)
+
+    def __to_string(self, address) -> str:
+        return format(self.__address_class(address))
+
+SEQUENTIAL = 'sequential'
+HASHED = 'hashed'
+GROUPED = 'grouped'
+ALLOCATION_POLICIES = (SEQUENTIAL, HASHED, GROUPED)
 
 class NetworkMapper :
     """Map the device table to the network space."""
-    def __init__(self, vlan_subnet, device_table) -> None:
-        self.__network_space = Ipv4PrivateNetworkSpace(vlan_subnet)
+    # pylint: disable=too-many-arguments
+    def __init__(self, vlan_subnet, device_table, space_type='set', exclusions=None,
+                 allocation_policy=HASHED, group_headroom=4, network_space=None, ip_column='ip',
+                 release_unused=False) -> None:
+        """network_space, if given, is used instead of creating one for vlan_subnet.
+        ip_column is the device table column holding the addresses, e.g. a separate
+        column for the IPv6 addresses of a dual-stack VLAN. With release_unused, mapping
+        releases the addresses of a persisted network space that are not in the device table
+        (see NetworkSpace.reconcile()), so only pass it when the device table holds every address in use."""
+        if allocation_policy not in ALLOCATION_POLICIES:
+            raise ValueError(f'unknown allocation policy {allocation_policy}')
+        self.__ip_network = ipaddress.ip_network(vlan_subnet)
+        if network_space is None:
+            network_space = create_network_space(vlan_subnet, space_type, exclusions)
+        self.__network_space = network_space
         self.__device_table = device_table
+        self.__allocation_policy = allocation_policy
+        self.__group_headroom = group_headroom
+        self.__ip_column = ip_column
+        self.__release_unused = release_unused
+        self.__group_occupancy = {}
 
-    def map_to_network_space(self) -> None:
+    def map_to_network_space(self, rows=None) -> None:
         """
         Map the devices in the device table to the network space.
         devices that do not have an IP address will be allocated one.
+        rows, if given, is a boolean mask selecting the devices that belong to this network space.
         """
-        # pylint: disable=invalid-name
-        for ip in self.__find_ips() :
-            self.__network_space.allocate_specific_address(ip)
-        for mac in self.__find_macs_needing_ip() :
-            self.__assign_ip(mac)
+        needs_ip, has_ip = self.__select(rows)
+        with self.__network_space.locked():
+            self.__reconcile(has_ip, self.__release_unused)
+            number_needing_ip = int(needs_ip.sum())
+            if number_needing_ip == 0:
+                return
+            if self.__allocation_policy == GROUPED:
+                ip_addresses = self.__allocate_grouped(needs_ip, has_ip)
+            elif self.__allocation_policy == HASHED:
+                ip_addresses = self.__network_space.allocate_addresses_for(self.__device_table.get_macs(needs_ip))
+            else:
+                ip_addresses = self.__network_space.allocate_addresses(number_needing_ip)
+            self.__device_table.set_ips(needs_ip, ip_addresses, self.__ip_column)
+            self.__count_groups(self.__device_table.get_groups(needs_ip))
+
+    def reconcile(self, rows=None) -> None:
+        """Bring the network space in line with the addresses already in the device table,
+        without allocating or releasing any, e.g. to report on capacity."""
+        _, has_ip = self.__select(rows)
+        with self.__network_space.locked():
+            self.__reconcile(has_ip, False)
 
     def get_percent_used(self) -> float:
         """Returns the percentage of the network space that has been used"""
-        amount_used = len(self.__network_space.get_used_set())
-        total_address_space = len(self.__network_space.get_address_set())
+        amount_used = self.__network_space.get_used_count()
+        total_address_space = self.__network_space.get_size()
         return amount_used / total_address_space * 100.0
 
-    def get_network_space(self) -> Ipv4PrivateNetworkSpace:
+    def get_capacity_report(self, vlan_id='') -> 'CapacityReport':
+        """Return the capacity of the network space as of the last mapping or reconcile."""
+        largest_free_block, free_block_histogram = self.__network_space.get_free_block_summary()
+        return CapacityReport(
+            vlan_id=str(vlan_id),
+            subnet=str(self.__ip_network),
+            size=self.__network_space.get_size(),
+            used=self.__network_space.get_used_count(),
+            free=self.__network_space.get_free_count(),
+            largest_free_block=largest_free_block,
+            free_block_histogram=free_block_histogram,
+            group_occupancy=dict(sorted(self.__group_occupancy.items())))
+
+    def get_network_space(self) -> NetworkSpace:
         """Return the network space object."""
         return self.__network_space
 
-    def __find_ips(self) -> list:
-        """Generate a list of IPs from the device table."""
-        # pylint: disable=invalid-name
-        df = self.__device_table.get_df()
-        return df.query("ip != ''")['ip'].tolist()
-
-    def __find_macs_needing_ip(self) -> list:
-        """Generate a list of MACs that do not have an IP."""
-        # pylint: disable=invalid-name
-        df = self.__device_table.get_df()
-        return df.query("ip == ''")['mac'].tolist()
-
-    def __assign_ip(self,mac) -> None:
-        """Assign an IP address to a device identified by it's MAC."""
-        # pylint: disable=invalid-name
-        df = self.__device_table.get_df()
-        df.loc[df["mac"] == mac, "ip"] = self.__network_space.allocate_address()
+    def __select(self, rows) -> tuple:
+        """Return the masks of the selected devices that need, and have, an IP address."""
+        has_ip = self.__device_table.has_ip(self.__ip_column)
+        needs_ip = ~has_ip
+        if rows is not None:
+            rows = self.__device_table.to_mask(rows)
+            needs_ip &= rows
+            has_ip &= rows
+        return needs_ip, has_ip
+
+    def __reconcile(self, has_ip, release_unused) -> None:
+        self.__network_space.reconcile(self.__device_table.get_ips(has_ip, self.__ip_column), release_unused)
+        self.__group_occupancy = {}
+        self.__count_groups(self.__device_table.get_groups(has_ip))
+
+    def __count_groups(self, groups) -> None:
+        for group in groups:
+            self.__group_occupancy[group] = self.__group_occupancy.get(group, 0) + 1
+
+    def __allocate_grouped(self, needs_ip, has_ip) -> list:
+        """Allocate addresses for the devices needing one, group by group, inside each group's block.
+        Returns the addresses in device table order."""
+        if self.__network_space.get_free_count() < int(needs_ip.sum()):
+            raise NetworkIsOutOfSpace()
+        addressed_groups = self.__device_table.get_groups(has_ip)
+        occupied = {int(ipaddress.ip_address(ip)): group for ip, group in zip(
+            self.__device_table.get_ips(has_ip, self.__ip_column), addressed_groups)}
+        block_allocator = GroupBlockAllocator(self.__network_space, self.__ip_network, occupied)
+        group_counts = {}
+        for group in addressed_groups:
+            group_counts[group] = group_counts.get(group, 0) + 1
+        members_by_group = {}
+        new_macs = self.__device_table.get_macs(needs_ip)
+        for position, (mac, group) in enumerate(zip(new_macs, self.__device_table.get_groups(needs_ip))):
+            members_by_group.setdefault(group, []).append((mac, position))
+            group_counts[group] = group_counts.get(group, 0) + 1
+        ip_addresses = [''] * len(new_macs)
+        for group in sorted(members_by_group):
+            members = sorted(members_by_group[group])
+            block_size = block_allocator.get_block_size(group_counts[group], self.__group_headroom)
+            allocated = block_allocator.allocate(group, [mac for mac, _ in members], block_size)
+            for (_, position), ip_address in zip(members, allocated):
+                ip_addresses[position] = ip_address
+        return ip_addresses
+
+class VlanUtilization(NamedTuple):
+    """How much of a VLAN's network space is used."""
+    vlan_id: str
+    subnet: str
+    used: int
+    size: int
+
+    def get_percent_used(self) -> float:
+        """Returns the percentage of the network space that has been used"""
+        return self.used / self.size * 100.0 if self.size else 0.0
+
+    def __str__(self) -> str:
+        return f'VLAN {self.vlan_id} ({self.subnet}) is {self.get_percent_used():.2f}% full ({self.used} of {self.size})'
+
+class CapacityReport(NamedTuple):
+    """The capacity of a VLAN's network space. Excluded addresses are in the size but are neither used nor free."""
+    vlan_id: str
+    subnet: str
+    size: int
+    used: int
+    free: int
+    largest_free_block: tuple
+    free_block_histogram: dict
+    group_occupancy: dict
+
+    def get_free(self) -> int:
+        """Return the number of free addresses."""
+        return self.free
+
+    def get_percent_used(self) -> float:
+        """Returns the percentage of the addresses that can be used (used or free) that have been used"""
+        usable = self.used + self.free
+        return self.used / usable * 100.0 if usable else 0.0
+
+    def get_largest_free_block_size(self) -> int:
+        """Return the number of addresses in the largest free block."""
+        if self.largest_free_block is None:
+            return 0
+        first, last = self.largest_free_block
+        return int(ipaddress.ip_address(last)) - int(ipaddress.ip_address(first)) + 1
+
+    def get_fragmentation(self) -> float:
+        """Returns the percentage of free addresses outside the largest free block."""
+        free = self.get_free()
+        if free == 0:
+            return 0.0
+        return (free - self.get_largest_free_block_size()) / free * 100.0
+
+    def to_dict(self) -> dict:
+        """Return the report as a dict that can be serialized to JSON."""
+        return {
+            'vlan_id': self.vlan_id,
+            'subnet': self.subnet,
+            'size': self.size,
+            'used': self.used,
+            'free': self.get_free(),
+            'percent_used': round(self.get_percent_used(), 2),
+            'largest_free_block': list(self.largest_free_block) if self.largest_free_block else None,
+            'largest_free_block_size': self.get_largest_free_block_size(),
+            'fragmentation': round(self.get_fragmentation(), 2),
+            'free_block_histogram': {str(bucket): count for bucket, count in self.free_block_histogram.items()},
+            'group_occupancy': self.group_occupancy}
+
+class NetworkSpacePool :
+    """One network space per VLAN. Devices with an IP address belong to the VLAN whose
+    subnet holds it, devices without one belong to the VLAN that lists their group, or
+    to the default VLAN (the first one added).
+
+    The pool routes and maps the device table's ip column, which holds the addresses
+    of the fixed IP reservations, so its VLANs are IPv4 only. An IPv6 subnet is mapped
+    on its own, with a NetworkMapper and another ip_column."""
+
+    def __init__(self) -> None:
+        self.__network_spaces = {}
+        self.__ip_networks = {}
+        self.__group_vlans = {}
+        self.__network_keys = []
+        self.__vlan_by_key = {}
+
+    def add_vlan(self, vlan_id, vlan_subnet, space_type='set', exclusions=None, groups=None, state_file=None,
+                 read_only=False) -> None:
+        """Add a VLAN and create its network space. Subnets must not overlap."""
+        # pylint: disable=too-many-arguments
+        vlan_id = str(vlan_id)
+        if vlan_id in self.__network_spaces:
+            raise ValueError(f'VLAN {vlan_id} has already been added')
+        ip_network = ipaddress.ip_network(vlan_subnet)
+        if ip_network.version != 4:
+            raise ValueError(f'VLAN {vlan_id} subnet {ip_network} is not IPv4')
+        for other_vlan_id, other_network in self.__ip_networks.items():
+            if other_network.overlaps(ip_network):
+                raise ValueError(f'VLAN {vlan_id} subnet {ip_network} overlaps VLAN {other_vlan_id} subnet {other_network}')
+        self.__network_spaces[vlan_id] = create_network_space(vlan_subnet, space_type, exclusions, state_file, read_only)
+        self.__ip_networks[vlan_id] = ip_network
+        key = (ip_network.version, int(ip_network.network_address))
+        bisect.insort(self.__network_keys, key)
+        self.__vlan_by_key[key] = vlan_id
+        for group in groups or []:
+            self.__group_vlans.setdefault(group, vlan_id)
+
+    def get_vlan_ids(self) -> list:
+        """Return the VLAN ids in the order they were added."""
+        return list(self.__network_spaces)
+
+    def get_default_vlan_id(self):
+        """Return the VLAN that devices without an IP address or a group VLAN go to."""
+        return next(iter(self.__network_spaces), None)
+
+    def get_network_space(self, vlan_id) -> NetworkSpace:
+        """Return the network space for the VLAN."""
+        return self.__network_spaces[str(vlan_id)]
+
+    def get_vlan_subnet(self, vlan_id) -> str:
+        """Return the subnet of the VLAN."""
+        return str(self.__ip_networks[str(vlan_id)])
+
+    def get_vlan_for_address(self, ip_address):
+        """Return the VLAN whose subnet holds the address, or None."""
+        address = ipaddress.ip_address(ip_address)
+        position = bisect.bisect_right(self.__network_keys, (address.version, int(address))) - 1
+        if position < 0:
+            return None
+        vlan_id = self.__vlan_by_key[self.__network_keys[position]]
+        return vlan_id if address in self.__ip_networks[vlan_id] else None
+
+    def route(self, ip_addresses, groups) -> list:
+        """Return the VLAN for each device given its IP address (may be '') and group.
+        Raises InvalidAddresses for addresses that are not in any VLAN."""
+        default_vlan_id = self.get_default_vlan_id()
+        vlan_ids = []
+        out_of_range = []
+        for ip_address, group in zip(ip_addresses, groups):
+            if ip_address:
+                vlan_id = self.get_vlan_for_address(ip_address)
+                if vlan_id is None:
+                    out_of_range.append(ip_address)
+            else:
+                vlan_id = self.__group_vlans.get(group, default_vlan_id)
+            vlan_ids.append(vlan_id)
+        if out_of_range:
+            raise InvalidAddresses(out_of_range, [])
+        return vlan_ids
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold exclusive use of every VLAN's network space."""
+        with contextlib.ExitStack() as stack:
+            for network_space in self.__network_spaces.values():
+                stack.enter_context(network_space.locked())
+            yield self
+
+    def close(self) -> None:
+        """Release the resources held by every VLAN's network space."""
+        for network_space in self.__network_spaces.values():
+            network_space.close()
+
+    def get_utilization(self) -> list:
+        """Return the utilization of each VLAN."""
+        return [VlanUtilization(vlan_id, str(self.__ip_networks[vlan_id]),
+                                len(network_space.get_used_set()), network_space.get_size())
+                for vlan_id, network_space in self.__network_spaces.items()]
+
+    def get_percent_used(self) -> float:
+        """Returns the percentage of all the VLANs' network space that has been used"""
+        utilization = self.get_utilization()
+        total_address_space = sum(vlan.size for vlan in utilization)
+        if total_address_space == 0:
+            return 0.0
+        return sum(vlan.used for vlan in utilization) / total_address_space * 100.0
+
+class NetworkPoolMapper :
+    """Map the device table to a pool of VLAN network spaces in one pass."""
+    # pylint: disable=too-many-arguments
+    def __init__(self, network_space_pool, device_table, allocation_policy=HASHED, group_headroom=4,
+                 release_unused=False) -> None:
+        """release_unused is passed to each VLAN's NetworkMapper."""
+        if allocation_policy not in ALLOCATION_POLICIES:
+            raise ValueError(f'unknown allocation policy {allocation_policy}')
+        self.__pool = network_space_pool
+        self.__device_table = device_table
+        self.__allocation_policy = allocation_policy
+        self.__group_headroom = group_headroom
+        self.__release_unused = release_unused
+        self.__vlan_assignments = []
+        self.__network_mappers = {}
+
+    def map_to_network_space(self) -> None:
+        """
+        Route every device in the device table to its VLAN, then map each VLAN's
+        devices to its network space. Devices that do not have an IP address will be allocated one.
+        """
+        for network_mapper, rows in self.__route():
+            network_mapper.map_to_network_space(rows)
+
+    def reconcile(self) -> None:
+        """Route every device in the device table to its VLAN and bring each VLAN's
+        network space in line with the addresses in use, without allocating any new ones."""
+        for network_mapper, rows in self.__route():
+            network_mapper.reconcile(rows)
+
+    def get_capacity_reports(self) -> list:
+        """Return the capacity of each VLAN as of the last mapping or reconcile."""
+        return [self.__get_network_mapper(vlan_id).get_capacity_report(vlan_id)
+                for vlan_id in self.__pool.get_vlan_ids()]
+
+    def get_vlan_assignments(self) -> list:
+        """Return the VLAN of each device, in device table order, from the last mapping."""
+        return self.__vlan_assignments
+
+    def get_utilization(self) -> list:
+        """Return the utilization of each VLAN."""
+        return self.__pool.get_utilization()
+
+    def get_percent_used(self) -> float:
+        """Returns the percentage of all the VLANs' network space that has been used"""
+        return self.__pool.get_percent_used()
+
+    def __route(self) -> list:
+        """Return each VLAN's network mapper with the mask of the devices routed to it."""
+        self.__vlan_assignments = self.__pool.route(self.__device_table.get_ips(), self.__device_table.get_groups())
+        return [(self.__get_network_mapper(vlan_id), [assigned == vlan_id for assigned in self.__vlan_assignments])
+                for vlan_id in self.__pool.get_vlan_ids()]
+
+    def __get_network_mapper(self, vlan_id) -> NetworkMapper:
+        if vlan_id not in self.__network_mappers:
+            self.__network_mappers[vlan_id] = NetworkMapper(
+                self.__pool.get_vlan_subnet(vlan_id), self.__device_table,
+                allocation_policy=self.__allocation_policy,
+                group_headroom=self.__group_headroom,
+                network_space=self.__pool.get_network_space(vlan_id),
+                release_unused=self.__release_unused)
+        return self.__network_mappers[vlan_id]
@@ -3,8 +3,11 @@ Contains all of the ports. See the Ports and Adapters (aka Hexagonal Architectur
 https://en.wikipedia.org/wiki/Hexagonal_architecture_(software)
 """
 from typing import NamedTuple
+from typing import Dict
+from typing import Iterable
 from typing import List
 from abc import ABC, abstractmethod
+import contextlib
 import requests
 from netorg_core import devicetable
 
@@ -39,6 +42,43 @@ class FixedIpReservation(NamedTuple):
     def __str__(self) -> str:
         return f'Fixed IP reservation: {self.mac} {self.name} {self.ip_address}'
 
+class ScanFinding(NamedTuple):
+    """A device found by a scan, with the finding (e.g. KNOWN_RESERVED_ACTIVE or a scan rule's name)."""
+    finding: str
+    mac: str
+    name: str
+    ip: str
+    group: str
+
+class ScanRules(NamedTuple):
+    """The user's scan rules (see scanrules.py), with a digest of the rules file that changes when they do."""
+    digest: str
+    rules: List[dict]
+
+class StateRun(NamedTuple):
+    """A device's state (see DeviceTable.get_states()) over consecutive scans,
+    from the first to the last of them (seconds since the epoch)."""
+    mac: str
+    state: int
+    first: float
+    last: float
+    scans: int
+
+class StateCounts(NamedTuple):
+    """How many devices were in each state (see DeviceTable.get_states()) at a scan."""
+    taken_at: float
+    counts: Dict[int, int]
+
+def to_columns(records, record_type) -> Dict[str, list]:
+    """Transpose a list of records into a column (list) per field of the record type."""
+    if not records:
+        return {field: [] for field in record_type._fields}
+    return dict(zip(record_type._fields, map(list, zip(*records))))
+
+def from_columns(columns: Dict[str, list], record_type) -> list:
+    """Transpose a column per field of the record type into a list of records."""
+    return [record_type(*values) for values in zip(*[columns[field] for field in record_type._fields])]
+
 class KnownDevicesPort(ABC):
     """Port for loading/saving known devices."""
 
@@ -46,6 +86,11 @@ class KnownDevicesPort(ABC):
     def load(self) -> List[KnownDevice]:
         pass
 
+    def load_columns(self) -> Dict[str, list]:
+        """Load the known devices as a column per KnownDevice field, e.g. {'name': [...], 'mac': [...], 'group': [...]}.
+        Adapters with many devices should override this to skip creating a KnownDevice per device."""
+        return to_columns(self.load(), KnownDevice)
+
     @abstractmethod
     def save(self,device_table: devicetable.DeviceTable) -> None:
         pass
@@ -57,6 +102,11 @@ class ActiveClientsPort(ABC):
     def load(self) -> List[ActiveClient]:
         pass
 
+    def load_columns(self) -> Dict[str, list]:
+        """Load the active clients as a column per ActiveClient field.
+        Adapters with many devices should override this to skip creating an ActiveClient per device."""
+        return to_columns(self.load(), ActiveClient)
+
 class FixedIpReservationsPort(ABC):
     """Port for loading/saving fixed IP reservations."""
 
@@ -64,10 +114,51 @@ class FixedIpReservationsPort(ABC):
     def load(self) -> List[FixedIpReservation]:
         pass
 
+    def load_columns(self) -> Dict[str, list]:
+        """Load the fixed IP reservations as a column per FixedIpReservation field.
+        Adapters with many devices should override this to skip creating a FixedIpReservation per device."""
+        return to_columns(self.load(), FixedIpReservation)
+
     @abstractmethod
     def save(self,device_table: devicetable.DeviceTable) -> None:
         pass
 
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold exclusive use of the reservations from loading them to saving them,
+        for adapters with state shared between runs."""
+        yield self
+
+    def get_capacity(self,device_table: devicetable.DeviceTable) -> list:
+        """Return a networkspace.CapacityReport for each VLAN, without allocating or saving anything."""
+        return []
+
+    def get_subnets(self) -> List[str]:
+        """Return the subnets (CIDRs) that reserved addresses must be in, or [] not to check."""
+        return []
+
+class DeviceTableSnapshotPort(ABC):
+    """Port for saving/loading a snapshot of the last device table loaded from the other ports."""
+
+    @abstractmethod
+    def save(self,device_table: devicetable.DeviceTable) -> None:
+        pass
+
+    @abstractmethod
+    def load(self,max_age: float,backend: str = None) -> devicetable.DeviceTable:
+        """Return the snapshot as a DeviceTable, or None if there is none or it is older than max_age seconds."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+class ScanRulesPort(ABC):
+    """Port for loading the user's scan rules."""
+
+    @abstractmethod
+    def load(self) -> ScanRules:
+        pass
+
 class NetorgConfigurationPort(ABC):
     """Port for loading/saving Netorg configuration."""
 
@@ -93,6 +184,36 @@ class DeviceTableCsvOutPort(ABC):
     def write(self,device_table_csv: str):
         pass
 
+class CapacityReportOutPort(ABC):
+    """Output port for writing network space capacity reports."""
+
+    @abstractmethod
+    def write(self,capacity_reports: list):
+        pass
+
+class ScanFindingsOutPort(ABC):
+    """Output port for writing the devices found by a scan, as they are found."""
+
+    @abstractmethod
+    def write(self,scan_findings: Iterable[ScanFinding]):
+        pass
+
+class ScanHistoryPort(ABC):
+    """Port for keeping the state of every device at each scan, and asking about it over a time range.
+    Times are seconds since the epoch."""
+
+    @abstractmethod
+    def append(self,taken_at: float,macs: List[str],states: List[int]) -> None:
+        """Record the state of each device at a scan."""
+
+    @abstractmethod
+    def get_timeline(self,mac: str,start: float,end: float) -> Iterable[StateRun]:
+        """Return, in time order, the runs of the device's state that overlap start to end."""
+
+    @abstractmethod
+    def get_state_counts(self,start: float,end: float) -> Iterable[StateCounts]:
+        """Return, in time order, how many devices were in each state at each scan from start to end."""
+
 class SecureNetworkAnalyticsHostGroupManagementPort(ABC):
     """Output port for updating host groups in Secure Network Analytics."""
 
@@ -1,15 +1,45 @@
 """This is the main module for Netorg scanning."""
 import logging
+from netorg_core import devicetable
 from netorg_core import format_utils
+from netorg_core import ports
 
 # pylint: disable=line-too-long
 # pylint: disable=logging-fstring-interpolation
 
+KNOWN = devicetable.FLAGS['known']
+RESERVED = devicetable.FLAGS['reserved']
+ACTIVE = devicetable.FLAGS['active']
+UNCLASSIFIED = devicetable.UNCLASSIFIED
+# How many devices' details are fetched from the device table at a time when streaming findings
+STREAM_CHUNK_SIZE = 10000
+# Each built-in finding is the devices whose state (see DeviceTable.get_states()) & mask == value, for its (mask, value)
+FINDING_STATES = {
+    'not_known_not_reserved_ACTIVE': (KNOWN | RESERVED | ACTIVE, ACTIVE),
+    'not_known_RESERVED_not_active': (KNOWN | RESERVED | ACTIVE, RESERVED),
+    'not_known_RESERVED_ACTIVE': (KNOWN | RESERVED | ACTIVE, RESERVED | ACTIVE),
+    'KNOWN_not_reserved_not_active': (KNOWN | RESERVED | ACTIVE, KNOWN),
+    'KNOWN_not_reserved_ACTIVE': (KNOWN | RESERVED | ACTIVE, KNOWN | ACTIVE),
+    'KNOWN_RESERVED_not_active': (KNOWN | RESERVED | ACTIVE, KNOWN | RESERVED),
+    'KNOWN_RESERVED_ACTIVE': (KNOWN | RESERVED | ACTIVE, KNOWN | RESERVED | ACTIVE),
+    'ACTIVE_UNCLASSIFIED': (ACTIVE | UNCLASSIFIED, ACTIVE | UNCLASSIFIED),
+}
+
+def classify(select) -> dict:
+    """Return select(mask, value) for each built-in finding's (mask, value) in FINDING_STATES, e.g.
+    the devices in each finding, or how many devices there are in each."""
+    return {finding: select(mask, value) for finding, (mask, value) in FINDING_STATES.items()}
 
 class NetorgScanner:
-    """All things associated with Netorg scanning"""
+    """All things associated with Netorg scanning
+
+    Each built-in finding's devices are selected by classify(). A user's
+    finding has the 'rule' selecting its devices instead. Either way, 'query'
+    says the same in words, for the report.
+    """
 
-    def __init__(self, device_table):
+    def __init__(self, device_table, rules=None):
+        """rules are the user's compiled scan rules (see scanrules.py), found after the built-in findings."""
         # pylint: disable=line-too-long
         self.__logger = logging.getLogger("netorg")
         self.device_table = device_table
@@ -55,15 +85,47 @@ class NetorgScanner:
                 'action': 'You should consider classifying them before the next organize'
             }
         }
+        for rule in rules or []:
+            if rule.name in self.analysis:
+                raise ValueError(f'scan rule {rule.name} is already a finding')
+            self.analysis[rule.name] = {
+                'query': rule.description,
+                'rule': rule,
+                'device_names': [],
+                'action': rule.action
+            }
 
     def run(self):
         """Run the analysis updating the analysis dictionary with the findings."""
         # pylint: disable=invalid-name
         # pylint: disable=unused-variable
-        df = self.device_table.get_df()
+        selections = self.__classify()
         for k, v in self.analysis.items():
-            query_result_df = df.query(v['query'])
-            v['device_names'] = query_result_df['name'].values.tolist()
+            v['device_names'] = self.device_table.get_names(self.__get_mask(k, v, selections))
+
+    def stream(self, chunk_size: int = STREAM_CHUNK_SIZE):
+        """Run the analysis, yielding a ports.ScanFinding for each device of each finding as it goes,
+        instead of updating the analysis dictionary. Only chunk_size devices' details are held at a time."""
+        selections = self.__classify()
+        for k, v in self.analysis.items():
+            rows = self.device_table.get_rows(self.__get_mask(k, v, selections))
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                for mac, name, ip_address, group in zip(
+                        self.device_table.get_macs(chunk), self.device_table.get_names(chunk),
+                        self.device_table.get_ips(chunk), self.device_table.get_groups(chunk)):
+                    yield ports.ScanFinding(k, mac, name, ip_address, group)
+
+    def __classify(self) -> dict:
+        """Return the mask of the devices in each built-in finding."""
+        states = self.device_table.get_states()
+        return classify(lambda mask, value: self.device_table.get_in_state(mask, value, states))
+
+    def __get_mask(self, name, finding, selections):
+        """Return the mask of the devices of a finding, given the masks of the built-in findings."""
+        if 'rule' in finding:
+            return finding['rule'].evaluate(self.device_table)
+        return selections[name]
 
     def report(self):
         """Report on the findings discovered by run()."""
@@ -76,6 +138,7 @@ class NetorgScanner:
             else:
                 self.__logger.info(
                     f'Found {len(v["device_names"])} device(s) that are: {v["query"]}')
-                self.__logger.info(f'{v["action"]}')
+                if v["action"]:
+                    self.__logger.info(f'{v["action"]}')
                 for row in format_utils.adaptive_columnize(v['device_names'], left_margin_width=3):
                     self.__logger.info(f"{' '.join(row)}")
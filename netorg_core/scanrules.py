@@ -0,0 +1,92 @@
+"""User-defined scan rules, compiled into masks over the device table.
+
+A rule names its devices with conditions that must all hold, e.g.
+
+    - name: cameras_outside_block
+      description: active cameras outside 192.168.128.64/26
+      action: Give them a reservation inside the block
+      where:
+        active: true
+        group: cameras
+        ip_outside: 192.168.128.64/26
+
+The conditions are known, reserved, active and has_ip (true or false),
+group and not_group (a group or a list of groups), name_matches (a regular
+expression found anywhere in the name), and ip_in and ip_outside (a CIDR or
+a list of CIDRs).
+"""
+import ipaddress
+import re
+from typing import Callable
+from typing import List
+from typing import NamedTuple
+from netorg_core import devicetable
+from netorg_core import ports
+
+FLAG_CONDITIONS = ('known', 'reserved', 'active')
+
+class ScanRule(NamedTuple):
+    """A compiled scan rule. Each condition returns a mask of the devices it holds for."""
+    name: str
+    description: str
+    action: str
+    conditions: List[Callable]
+
+    def evaluate(self, device_table: devicetable.DeviceTable):
+        """Return a mask of the devices for which every condition holds."""
+        mask = self.conditions[0](device_table)
+        for condition in self.conditions[1:]:
+            mask = mask & condition(device_table)
+        return mask
+
+def compile_rules(scan_rules: ports.ScanRules) -> List[ScanRule]:
+    """Return the compiled rules. Raises ValueError for a rule that cannot be compiled."""
+    return [compile_rule(rule) for rule in scan_rules.rules]
+
+def compile_rule(rule: dict) -> ScanRule:
+    """Compile one rule (see the module docstring)."""
+    name = rule.get('name')
+    if not name:
+        raise ValueError(f'scan rule {rule} has no name')
+    where = rule.get('where') or {}
+    if not where:
+        raise ValueError(f'scan rule {name} has no conditions')
+    conditions = [compile_condition(name, condition, value) for condition, value in where.items()]
+    description = rule.get('description') or ' and '.join(f'{condition} {value}' for condition, value in where.items())
+    return ScanRule(name, description, rule.get('action', ''), conditions)
+
+def compile_condition(name: str, condition: str, value) -> Callable:
+    """Compile one condition of a rule into a function returning a mask."""
+    # pylint: disable=too-many-return-statements
+    if condition in FLAG_CONDITIONS:
+        if value:
+            return lambda device_table: device_table.get_flag(condition)
+        return lambda device_table: ~device_table.get_flag(condition)
+    if condition == 'has_ip':
+        if value:
+            return lambda device_table: device_table.has_ip()
+        return lambda device_table: ~device_table.has_ip()
+    if condition in ('group', 'not_group'):
+        groups = [str(group) for group in as_list(value)]
+        if condition == 'group':
+            return lambda device_table: device_table.get_in_groups(groups)
+        return lambda device_table: ~device_table.get_in_groups(groups)
+    if condition == 'name_matches':
+        try:
+            pattern = re.compile(str(value))
+        except re.error as error:
+            raise ValueError(f'scan rule {name} name_matches {value}: {error}') from error
+        return lambda device_table: device_table.get_name_match(pattern)
+    if condition in ('ip_in', 'ip_outside'):
+        try:
+            subnets = [ipaddress.ip_network(str(subnet)) for subnet in as_list(value)]
+        except ValueError as error:
+            raise ValueError(f'scan rule {name} {condition} {value}: {error}') from error
+        if condition == 'ip_outside':
+            return lambda device_table: device_table.get_outside(subnets)
+        return lambda device_table: device_table.has_ip() & ~device_table.get_outside(subnets)
+    raise ValueError(f'scan rule {name} has unknown condition {condition}')
+
+def as_list(value) -> list:
+    """Return a value that may be a single item or a list as a list."""
+    return value if isinstance(value, list) else [value]
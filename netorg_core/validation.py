@@ -0,0 +1,103 @@
+"""Checks the loaded device table for addresses that would stop the network being organized."""
+import ipaddress
+from typing import NamedTuple
+from netorg_core import devicetable
+
+DUPLICATE_IP = 'duplicate_ip'
+OUT_OF_SUBNET = 'out_of_subnet'
+LEASE_DRIFT = 'lease_drift'
+
+ABORT = 'abort'
+REASSIGN = 'reassign'
+VALIDATION_POLICIES = (ABORT, REASSIGN)
+
+class ValidationIssue(NamedTuple):
+    """A problem with one device. detail is the other MACs with the same address
+    for a duplicate IP, or the address of the current lease for lease drift."""
+    kind: str
+    row: int
+    mac: str
+    name: str
+    ip_address: str
+    detail: str = ''
+
+class ValidationReport :
+    """Every issue found in a device table, in one go.
+
+    Duplicate IPs and out-of-subnet IPs are conflicts: organizing cannot
+    reconcile them. Lease drift, where a reservation overrides the address
+    of the current lease, is for information.
+    """
+
+    def __init__(self, issues: list, rows_to_reassign: list) -> None:
+        self.issues = issues
+        self.rows_to_reassign = rows_to_reassign
+
+    def __len__(self) -> int:
+        return len(self.issues)
+
+    def is_empty(self) -> bool:
+        """Return True if there are no issues."""
+        return not self.issues
+
+    def get_issues(self, kind: str = None) -> list:
+        """Return the issues of a kind (or all of them), in device table order."""
+        return [issue for issue in self.issues if kind is None or issue.kind == kind]
+
+    def get_conflicts(self) -> list:
+        """Return the duplicate IP and out-of-subnet issues."""
+        return [issue for issue in self.issues if issue.kind != LEASE_DRIFT]
+
+    def get_rows_to_reassign(self) -> list:
+        """Return the rows whose address has to change to resolve the conflicts: the out-of-subnet
+        devices, and all but one of the devices sharing an address (a reserved one keeps it)."""
+        return list(self.rows_to_reassign)
+
+    def to_dict(self) -> dict:
+        """Return the issues by kind, e.g. to write as JSON."""
+        return {kind: [issue._asdict() for issue in self.get_issues(kind)]
+                for kind in (DUPLICATE_IP, OUT_OF_SUBNET, LEASE_DRIFT)}
+
+    def __str__(self) -> str:
+        return (f'{len(self.get_issues(DUPLICATE_IP))} devices with a duplicate IP, '
+                f'{len(self.get_issues(OUT_OF_SUBNET))} outside the subnets, '
+                f'{len(self.get_issues(LEASE_DRIFT))} reservations differing to the current lease')
+
+def validate(device_table: devicetable.DeviceTable, subnets: list = None, leases: dict = None) -> ValidationReport:
+    """Find every duplicate IP, every IP outside the subnets (CIDRs, not checked if None or empty)
+    and every reservation that differs to the device's current lease (leases maps MAC to lease IP)."""
+    issues = []
+    rows_to_reassign = set()
+    duplicate_rows = get_rows(device_table.get_duplicate_ip())
+    if duplicate_rows:
+        macs = dict(zip(duplicate_rows, device_table.get_macs(duplicate_rows)))
+        ips = device_table.get_ips(duplicate_rows)
+        reserved = device_table.get_flag('reserved')
+        rows_by_ip = {}
+        for row, ip_address in zip(duplicate_rows, ips):
+            rows_by_ip.setdefault(ip_address, []).append(row)
+        for row, ip_address, name in zip(duplicate_rows, ips, device_table.get_names(duplicate_rows)):
+            other_macs = [macs[other_row] for other_row in rows_by_ip[ip_address] if other_row != row]
+            issues.append(ValidationIssue(DUPLICATE_IP, row, macs[row], name, ip_address, ' '.join(other_macs)))
+        for rows in rows_by_ip.values():
+            keeper = next((row for row in rows if reserved[row]), rows[0])
+            rows_to_reassign.update(row for row in rows if row != keeper)
+    if subnets:
+        outside_rows = get_rows(device_table.get_outside([ipaddress.ip_network(subnet) for subnet in subnets]))
+        for row, mac, name, ip_address in zip(outside_rows, device_table.get_macs(outside_rows),
+                                              device_table.get_names(outside_rows), device_table.get_ips(outside_rows)):
+            issues.append(ValidationIssue(OUT_OF_SUBNET, row, mac, name, ip_address))
+        rows_to_reassign.update(outside_rows)
+    if leases:
+        leased_rows = get_rows(device_table.get_flag('reserved') & device_table.get_flag('active') & device_table.has_ip())
+        for row, mac, name, ip_address in zip(leased_rows, device_table.get_macs(leased_rows),
+                                              device_table.get_names(leased_rows), device_table.get_ips(leased_rows)):
+            lease_ip_address = leases.get(mac)
+            if lease_ip_address and lease_ip_address != ip_address:
+                issues.append(ValidationIssue(LEASE_DRIFT, row, mac, name, ip_address, lease_ip_address))
+    issues.sort(key=lambda issue: issue.row)
+    return ValidationReport(issues, sorted(rows_to_reassign))
+
+def get_rows(mask) -> list:
+    """Return the rows selected by a boolean mask."""
+    return [row for row, selected in enumerate(mask.tolist()) if selected]
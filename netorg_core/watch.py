@@ -0,0 +1,45 @@
+"""Watch mode: the device table is loaded on a schedule and only what changed between ticks is reported."""
+import random
+from typing import List
+from netorg_core import devicetable
+from netorg_core import devicetablechanges
+
+DEFAULT_INTERVAL = 300
+# Each wait is spread by up to this fraction either way, so that watchers started together drift apart
+DEFAULT_JITTER = 0.1
+# However many loads in a row fail, never wait longer than this many seconds (or the interval, if longer)
+MAX_BACKOFF = 3600
+
+def get_delay(interval: float, failures: int = 0, jitter: float = DEFAULT_JITTER) -> float:
+    """Return how many seconds to wait before the next tick: the interval, doubled for each
+    load in a row that failed (up to MAX_BACKOFF), then jittered."""
+    delay = min(interval * 2 ** min(failures, 32), max(interval, MAX_BACKOFF))
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+def describe_changes(changes: devicetablechanges.DeviceTableChanges) -> List[str]:
+    """Describe each device that was added, removed or changed, e.g.
+    "Doorbell (aa:bb:cc:dd:ee:ff): not active -> active, ip 192.168.128.40 -> 192.168.128.41"."""
+    descriptions = []
+    added = set(changes.get_added())
+    removed = set(changes.get_removed())
+    for mac in changes.get_macs():
+        row = changes.get_row(mac)
+        device = f"{row.get('name') or 'unnamed'} ({mac})"
+        if mac in added:
+            descriptions.append(f'{device}: new, {describe_state(row)}')
+        elif mac in removed:
+            descriptions.append(f'{device}: gone, was {describe_state(row)}')
+        else:
+            descriptions.append(f'{device}: ' + ', '.join(
+                describe_transition(column, before, after) for column, before, after in changes.get_transitions(mac)))
+    return descriptions
+
+def describe_state(row: dict) -> str:
+    """Describe the known, reserved and active flags of a device, e.g. "not known, reserved, active"."""
+    return ', '.join(flag if row.get(flag) else f'not {flag}' for flag in devicetable.FLAGS)
+
+def describe_transition(column: str, before, after) -> str:
+    """Describe how a column of a device changed."""
+    if column in devicetable.FLAGS:
+        return f"{'' if before else 'not '}{column} -> {'' if after else 'not '}{column}"
+    return f"{column} {before or 'none'} -> {after or 'none'}"
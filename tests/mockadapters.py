@@ -57,6 +57,16 @@ class FixedIpReservationsAdapter(ports.FixedIpReservationsPort):
         new_fixed_ip_reservations = self.__generate_list_of_fixed_ip_reservation(device_table)
         self.__list_of_fixed_ip_reservations = new_fixed_ip_reservations
 
+    # overriding method
+    def get_subnets(self) -> List[str]:
+        return [self.__vlan_subnet]
+
+    # overriding method
+    def get_capacity(self,device_table: devicetable.DeviceTable) -> list:
+        network_mapper = networkspace.NetworkMapper(self.__vlan_subnet,device_table)
+        network_mapper.reconcile()
+        return [network_mapper.get_capacity_report('1')]
+
     def __generate_list_of_fixed_ip_reservation(self, device_table: devicetable.DeviceTable) -> List[ports.FixedIpReservation]:
         list_of_fixed_ip_reservations: List[ports.FixedIpReservation] = []
         df = device_table.get_df()
@@ -70,4 +80,42 @@ class FixedIpReservationsAdapter(ports.FixedIpReservationsPort):
                     name = device_df.iloc[0]['name']
                     fixed_ip_resevation = ports.FixedIpReservation(mac=mac, name=name, ip_address=ip)
                     list_of_fixed_ip_reservations.append(fixed_ip_resevation)
-        return list_of_fixed_ip_reservations
\ No newline at end of file
+        return list_of_fixed_ip_reservations
+
+class CapacityReportOutAdapter(ports.CapacityReportOutPort):
+
+    def __init__(self) -> None:
+        self.capacity_reports = []
+
+    # overriding abstract method
+    def write(self,capacity_reports: list):
+        self.capacity_reports = capacity_reports
+
+class DeviceTableSnapshotAdapter(ports.DeviceTableSnapshotPort):
+    """Keeps the snapshot in memory, for testing."""
+
+    def __init__(self) -> None:
+        self.columns = None
+
+    # overriding abstract method
+    def save(self,device_table: devicetable.DeviceTable) -> None:
+        self.columns = device_table.to_columns()
+
+    # overriding abstract method
+    def load(self,max_age: float,backend: str = None) -> devicetable.DeviceTable:
+        if self.columns is None:
+            return None
+        return devicetable.DeviceTable(self.columns, backend=backend)
+
+    # overriding abstract method
+    def clear(self) -> None:
+        self.columns = None
+
+class DeviceTableCsvOutAdapter(ports.DeviceTableCsvOutPort):
+
+    def __init__(self) -> None:
+        self.device_table_csv = None
+
+    # overriding abstract method
+    def write(self,device_table_csv: str):
+        self.device_table_csv = device_table_csv
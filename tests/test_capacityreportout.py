@@ -0,0 +1,56 @@
+"""Tests for the console capacity report adapter."""
+import io
+import json
+import unittest
+from unittest import mock
+from adapters import capacityreportout_console
+from netorg_core import networkspace
+
+class TestCapacityReportOutAdapter(unittest.TestCase):
+    """Tests for the console capacity report adapter."""
+
+    capacity_reports = [
+        networkspace.CapacityReport(
+            vlan_id='100', subnet='192.168.128.0/29', size=6, used=3, free=3,
+            largest_free_block=('192.168.128.4', '192.168.128.5'),
+            free_block_histogram={1: 1, 2: 1}, group_occupancy={'lights': 3}),
+        networkspace.CapacityReport(
+            vlan_id='200', subnet='192.168.129.0/30', size=2, used=2, free=0,
+            largest_free_block=None, free_block_histogram={}, group_occupancy={'cameras': 2})
+    ]
+
+    def test_format_text(self):
+        """Test the human readable report."""
+        self.assertEqual(
+            'VLAN 100 (192.168.128.0/29) is 50.00% full: 3 used, 3 free of 6\n'
+            '   Largest free block: 192.168.128.4 - 192.168.128.5 (2 addresses), fragmentation 33.33%\n'
+            '   Free blocks by size: 1+: 1, 2+: 1\n'
+            '   Addresses by group: lights: 3\n'
+            'VLAN 200 (192.168.129.0/30) is 100.00% full: 2 used, 0 free of 2\n'
+            '   No free addresses\n'
+            '   Addresses by group: cameras: 2\n'
+            'All 2 VLANs are 62.50% full: 5 used, 3 free of 8',
+            capacityreportout_console.CapacityReportOutAdapter.format_text(self.capacity_reports))
+
+    def test_format_text_excluded(self):
+        """Test that excluded addresses are neither used nor free."""
+        capacity_report = networkspace.CapacityReport(
+            vlan_id='100', subnet='192.168.128.0/24', size=254, used=1, free=152,
+            largest_free_block=('192.168.128.3', '192.168.128.99'),
+            free_block_histogram={32: 1, 64: 1}, group_occupancy={})
+        self.assertEqual(
+            'VLAN 100 (192.168.128.0/24) is 0.65% full: 1 used, 152 free of 254 (101 excluded)',
+            capacityreportout_console.CapacityReportOutAdapter.format_text([capacity_report]).splitlines()[0])
+
+    def test_to_dict(self):
+        """Test the machine readable report."""
+        self.assertDictEqual({
+            'vlan_id': '200', 'subnet': '192.168.129.0/30', 'size': 2, 'used': 2, 'free': 0, 'percent_used': 100.0,
+            'largest_free_block': None, 'largest_free_block_size': 0, 'fragmentation': 0.0,
+            'free_block_histogram': {}, 'group_occupancy': {'cameras': 2}}, self.capacity_reports[1].to_dict())
+
+    def test_write_jsonl(self):
+        """Test that the jsonl format writes one capacity report per line."""
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            capacityreportout_console.CapacityReportOutAdapter({}, 'jsonl').write(self.capacity_reports)
+        self.assertEqual([json.loads(line)['vlan_id'] for line in stdout.getvalue().splitlines()], ['100', '200'])
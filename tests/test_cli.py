@@ -0,0 +1,45 @@
+"""Tests for the netorg command line."""
+import contextlib
+import io
+import unittest
+import netorg
+
+class TestCommandLine(unittest.TestCase) :
+    """Test the checks on the command line arguments."""
+
+    def __check(self, argv) -> None:
+        parser = netorg.get_parser()
+        netorg.check_output_args(parser, parser.parse_args(argv))
+
+    def __assert_rejected(self, argv) -> None:
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                self.__check(argv)
+
+    def test_format(self) :
+        """--format is accepted only where the command writes that format."""
+        self.__check(['--capacity', '--format', 'json'])
+        self.__check(['--capacity', '--format', 'jsonl'])
+        self.__check(['--scan', '--format', 'jsonl'])
+        self.__check(['--organize'])
+        self.__assert_rejected(['--scan', '--format', 'json'])
+        self.__assert_rejected(['--export', '--format', 'json'])
+        self.__assert_rejected(['--watch', '--format', 'jsonl'])
+
+    def test_output(self) :
+        """--output is accepted only with --scan --format jsonl."""
+        self.__check(['--scan', '--format', 'jsonl', '--output', 'findings.jsonl'])
+        self.__assert_rejected(['--scan', '--output', 'findings.jsonl'])
+        self.__assert_rejected(['--capacity', '--format', 'json', '--output', 'capacity.json'])
+
+    def test_interval(self) :
+        """--interval must be a number of seconds more than zero."""
+        self.assertEqual(0.5, netorg.get_parser().parse_args(['--watch', '--interval', '0.5']).interval)
+        self.__assert_rejected(['--watch', '--interval', '0'])
+        self.__assert_rejected(['--watch', '--interval', '-60'])
+        self.__assert_rejected(['--watch', '--interval', 'nan'])
+        self.__assert_rejected(['--watch', '--interval', 'inf'])
+        self.__assert_rejected(['--watch', '--interval', 'soon'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,17 @@
 from typing import List
+import os.path
+import subprocess
+import sys
+import time
 import unittest
+import pandas as pd
 from netorg_core import devicetable
+from netorg_core import devicetable_pandas
+from netorg_core import devicetable_python
 from netorg_core import devicetableloader
 #from devicetableloader import DeviceTableLoader
 from netorg_core import ports
+from netorg_core import validation
 #from ports import ActiveClient, ActiveClientsPort, FixedIpReservation, FixedIpReservationsPort, KnownDevice, KnownDevicesPort
 
 # Test table
@@ -180,3 +188,241 @@ class TestDeviceTableLoader(unittest.TestCase) :
         for mac in expected :
             self.assertIn(mac,actual)
         self.assertEqual(len(expected),len(actual))
+
+    def test_load_all_concurrently(self) :
+        """Test that the ports are loaded from at the same time and merged in precedence order."""
+        class SlowPort:
+            """Wrap a port so that load() takes a while."""
+            def __init__(self, port) -> None:
+                self.port = port
+
+            def load_columns(self):
+                time.sleep(0.2)
+                return self.port.load_columns()
+
+            def get_subnets(self):
+                return self.port.get_subnets()
+
+        def load_all(load_concurrency):
+            device_table_loader = devicetableloader.DeviceTableLoader(
+                known_devices_port=SlowPort(KnownDevicesTestAdapter()),
+                active_clients_port=SlowPort(ActiveClientsTestAdapter()),
+                fixed_ip_reservations_port=SlowPort(FixedIpReservationsTestAdapter()),
+                load_concurrency=load_concurrency
+            )
+            start = time.perf_counter()
+            with self.assertLogs('netorg', level='DEBUG') as logs:
+                df = device_table_loader.load_all().get_df()
+            self.assertEqual(3,len([line for line in logs.output if 'DeviceTableLoader: loaded' in line]))
+            return df, time.perf_counter() - start
+
+        concurrent_df, concurrent_elapsed = load_all(3)
+        sequential_df, sequential_elapsed = load_all(1)
+        self.assertLess(concurrent_elapsed,0.5)
+        self.assertGreaterEqual(sequential_elapsed,0.6)
+        self.assertEqual(sequential_df.to_dict('list'),concurrent_df.to_dict('list'))
+        self.assertEqual(['baa','bab','bba','bbb','aab','abb','aba'],concurrent_df['mac'].tolist())
+
+    def test_load_columns_shim(self) :
+        """Test that a port with only load() can be loaded from as columns."""
+        columns = ActiveClientsTestAdapter().load_columns()
+        self.assertEqual(['mac','name','ip_address'],list(columns))
+        self.assertEqual(ActiveClientsTestAdapter.get_list_of_macs(),columns['mac'])
+        self.assertEqual(ActiveClientsTestAdapter.list_of_active_clients,ports.from_columns(columns,ports.ActiveClient))
+        self.assertEqual({'mac': [], 'name': [], 'ip_address': []},ports.to_columns(None,ports.FixedIpReservation))
+
+    def test_build_merges_sources(self) :
+        """Test the outer join of the sources, including MACs that appear more than once in a source."""
+        device_table_builder = devicetableloader.DeviceTableBuilder()
+        device_table_builder.add_batch('known', {
+            'mac': ['k1', 'k2', 'k1', 'k3'],
+            'name': ['Meerkat', 'Printer', 'Meerkat2', 'Cam'],
+            'group': ['servers', 'printers', 'lab', 'security']})
+        device_table_builder.add_batch('active', {
+            'mac': ['a1', 'k2', 'a1', 'k3'],
+            'name': ['HS105', 'printer-lease', 'HS105b', None],
+            'ip_address': ['10.0.0.5', '10.0.0.6', '10.0.0.7', '10.0.0.9']})
+        device_table_builder.add_batch('reserved', {
+            'mac': ['k2', 'r1', 'a1', 'r1', 'k1'],
+            'name': ['printer-res', 'old', 'hs', 'old2', 'm'],
+            'ip_address': ['10.0.0.16', '10.0.0.20', '10.0.0.7', '10.0.0.21', '10.0.0.22']})
+        device_table = device_table_builder.build()
+        df = device_table.get_df()
+        self.assertEqual({
+            'mac': ['k1', 'k2', 'k3', 'a1', 'r1'],
+            'known': [True, True, True, False, False],
+            'reserved': [True, True, False, True, True],
+            'active': [False, True, True, True, False],
+            'ip': ['10.0.0.22', '10.0.0.16', '10.0.0.9', '10.0.0.7', '10.0.0.21'],
+            'group': ['lab', 'printers', 'security', 'unclassified', 'unclassified'],
+            'name': ['Meerkat2', 'Printer', 'Cam', 'HS105', 'old']}, df.to_dict('list'))
+        lease_drift = validation.validate(device_table, leases=device_table_builder.get_leases()).get_issues(validation.LEASE_DRIFT)
+        self.assertEqual([('k2', 'Printer', '10.0.0.16', '10.0.0.6')],
+                         [(issue.mac, issue.name, issue.ip_address, issue.detail) for issue in lease_drift])
+
+    def test_build_empty(self) :
+        """Test building a device table with no devices."""
+        df = devicetableloader.DeviceTableBuilder().build().get_df()
+        self.assertEqual((0,len(devicetable.COLUMNS)),df.shape)
+
+    def test_build_normalizes_macs(self) :
+        """Test that the same MAC written differently by different sources is one device."""
+        for backend in devicetable.BACKENDS:
+            device_table_builder = devicetableloader.DeviceTableBuilder(backend)
+            device_table_builder.add_batch('known', {
+                'mac': ['AA:BB:CC:DD:EE:01', 'meerkat'], 'name': ['Printer', 'Meerkat'], 'group': ['printers', 'servers']})
+            device_table_builder.add_batch('active', {
+                'mac': ['aa-bb-cc-dd-ee-01', 'aabb.ccdd.ee02'], 'name': ['printer', 'iPad'], 'ip_address': ['10.0.0.1', '10.0.0.2']})
+            device_table_builder.add_batch('reserved', {
+                'mac': ['aabbccddee01'], 'name': ['printer'], 'ip_address': ['10.0.0.1']})
+            df = device_table_builder.build().get_df()
+            self.assertEqual(['aa:bb:cc:dd:ee:01', 'meerkat', 'aa:bb:cc:dd:ee:02'], df['mac'].tolist())
+            self.assertEqual([True, False, False], df['reserved'].tolist())
+            self.assertEqual([True, False, True], df['active'].tolist())
+
+    def test_normalize_macs(self) :
+        """Test normalizing MACs, and that canonical MACs are left alone."""
+        macs = ['aa:bb:cc:dd:ee:ff', '00:11:22:33:44:55']
+        self.assertIs(macs, devicetable.normalize_macs(macs))
+        self.assertEqual(['aa:bb:cc:dd:ee:ff', 'aa:bb:cc:dd:ee:ff', 'aa:bb:cc:dd:ee:ff', 'kra', 'gg:bb:cc:dd:ee:ff', None],
+                         devicetable.normalize_macs(['AA:BB:CC:DD:EE:FF', 'aa-bb-cc-dd-ee-ff', 'AABB.CCDD.EEFF',
+                                                     'kra', 'gg:bb:cc:dd:ee:ff', None]))
+
+class TestDeviceTable(unittest.TestCase) :
+    """Test cases for the compact columns of DeviceTable."""
+
+    def __create_device_table(self) -> devicetable.DeviceTable:
+        return devicetable.DeviceTable([
+            {'mac': '00:11:22:33:44:55', 'known': True,  'reserved': True,  'active': False, 'ip': '192.168.128.10', 'group': 'servers',  'name': 'Meerkat'},
+            {'mac': '66:77:88:99:aa:bb', 'known': False, 'reserved': True,  'active': False, 'ip': '192.168.128.11', 'group': '',         'name': 'Old'},
+            {'mac': 'aab',               'known': False, 'reserved': False, 'active': True,  'ip': '',               'group': 'servers',  'name': 'HS105'}
+        ])
+
+    def test_compact_columns(self) :
+        """Test the compact column types."""
+        df = self.__create_device_table().get_compact_df()
+        self.assertEqual('uint64',str(df['mac'].dtype))
+        self.assertEqual('uint8',str(df['flags'].dtype))
+        self.assertEqual('UInt32',str(df['ip'].dtype))
+        self.assertEqual('category',str(df['group'].dtype))
+        self.assertEqual([0x001122334455,0x66778899aabb],df['mac'].tolist()[:2])
+        self.assertEqual([3,2,4],df['flags'].tolist())
+
+    def test_get_df_round_trip(self) :
+        """Test that get_df() renders the original columns and values."""
+        device_table = self.__create_device_table()
+        df = device_table.get_df()
+        self.assertEqual(devicetable.COLUMNS,df.columns.tolist())
+        self.assertEqual(['00:11:22:33:44:55','66:77:88:99:aa:bb','aab'],df['mac'].tolist())
+        self.assertEqual(['192.168.128.10','192.168.128.11',''],df['ip'].tolist())
+        self.assertEqual(['HS105'],df.query("active")['name'].tolist())
+        self.assertEqual(3,devicetable.DeviceTable(df).get_size())
+        self.assertEqual('aab',device_table.get_macs()[2])
+        self.assertIsNotNone(device_table.encode_mac('aab'))
+
+    def test_get_retired(self) :
+        """Test the devices that are reserved but neither known nor active."""
+        device_table = self.__create_device_table()
+        self.assertEqual(['Old'],device_table.get_names(device_table.get_retired()))
+        self.assertEqual(3,device_table.get_unique_mac().sum())
+
+    def test_set_ips(self) :
+        """Test setting IPv4 addresses and falling back to strings for other addresses."""
+        device_table = self.__create_device_table()
+        needs_ip = ~device_table.has_ip()
+        device_table.set_ips(needs_ip,['192.168.128.12'])
+        self.assertEqual('UInt32',str(device_table.get_compact_df()['ip'].dtype))
+        self.assertEqual('192.168.128.12',device_table.get_ips()[2])
+        device_table.set_ips(needs_ip,['fd00::12'])
+        self.assertEqual(['192.168.128.10','192.168.128.11','fd00::12'],device_table.get_ips())
+        device_table.set_ips(device_table.to_mask([True,False,False]),['fd00::10'],column='ipv6')
+        self.assertEqual(['fd00::10','',''],device_table.get_ips(column='ipv6'))
+        self.assertIn('ipv6',device_table.get_df().columns)
+
+    def test_group_index(self) :
+        """Test the group index."""
+        device_table = self.__create_device_table()
+        self.assertEqual(['servers',''],device_table.get_group_names())
+        self.assertEqual([0,2],device_table.get_rows_for_group('servers').tolist())
+        self.assertEqual(['Meerkat','HS105'],device_table.get_names(device_table.get_rows_for_group('servers')))
+        self.assertEqual(0,len(device_table.get_rows_for_group('printers')))
+
+    def test_set_ips_by_rows(self) :
+        """Test setting addresses by rows."""
+        device_table = self.__create_device_table()
+        device_table.set_ips([1,2],['192.168.128.20','192.168.128.11'])
+        self.assertEqual(['192.168.128.10','192.168.128.20','192.168.128.11'],device_table.get_ips())
+
+    def test_encode_columns(self) :
+        """Test the vectorized MAC and IPv4 encoders agree with the scalar ones."""
+        macs = ['00:11:22:33:44:55', 'ff:ff:ff:ff:ff:ff', 'FF:FF:FF:FF:FF:FF', 'aab', '']
+        codes, valid = devicetable_pandas.encode_mac_column(pd.Series(macs, dtype=object))
+        self.assertEqual([devicetable.encode_mac(mac) for mac in macs],
+                         [int(code) if is_valid else None for code, is_valid in zip(codes, valid)])
+        ip_addresses = ['0.0.0.0', '192.168.128.10', '255.255.255.255', '256.0.0.1', '01.2.3.4', '1.2.3', 'fd00::1', '']
+        addresses, valid = devicetable_pandas.encode_ipv4_column(pd.Series(ip_addresses, dtype=object))
+        self.assertEqual([devicetable.encode_ipv4(ip_address) for ip_address in ip_addresses],
+                         [int(address) if is_valid else None for address, is_valid in zip(addresses, valid)])
+
+class TestPythonDeviceTable(unittest.TestCase) :
+    """Test cases for the python backend, which must behave like the pandas one."""
+
+    @staticmethod
+    def __load_all(backend) -> devicetable.DeviceTable:
+        device_table_loader = devicetableloader.DeviceTableLoader(
+            known_devices_port=KnownDevicesTestAdapter(),
+            active_clients_port=ActiveClientsTestAdapter(),
+            fixed_ip_reservations_port=FixedIpReservationsTestAdapter(),
+            backend=backend
+        )
+        return device_table_loader.load_all()
+
+    def test_backend(self) :
+        """Test that the backend is picked when the device table is created."""
+        self.assertIsInstance(devicetable.DeviceTable([], backend='python'),devicetable_python.PythonDeviceTable)
+        self.assertIsInstance(devicetable.DeviceTable([]),devicetable_pandas.PandasDeviceTable)
+        self.assertIsInstance(self.__load_all('python'),devicetable.DeviceTable)
+        self.assertRaises(ValueError,devicetable.DeviceTable,[],backend='arrow')
+
+    def test_same_as_pandas(self) :
+        """Test that both backends load, render and select the same devices."""
+        python_table = self.__load_all('python')
+        pandas_table = self.__load_all('pandas')
+        self.assertEqual(pandas_table.get_df().to_dict('list'),python_table.get_df().to_dict('list'))
+        self.assertEqual(pandas_table.to_csv(),python_table.to_csv())
+        self.assertEqual(pandas_table.get_states().tolist(),python_table.get_states().tolist())
+        for mask, value in [(7, 2), (devicetable.FLAGS['active'] | devicetable.UNCLASSIFIED, 12)]:
+            self.assertEqual(pandas_table.get_names(pandas_table.get_in_state(mask, value)),
+                             python_table.get_names(python_table.get_in_state(mask, value)))
+            self.assertEqual(pandas_table.get_rows(pandas_table.get_in_state(mask, value)),
+                             python_table.get_rows(python_table.get_in_state(mask, value)))
+        self.assertEqual(pandas_table.get_macs(pandas_table.get_retired() | ~pandas_table.has_ip()),
+                         python_table.get_macs(python_table.get_retired() | ~python_table.has_ip()))
+        self.assertEqual(pandas_table.get_group_names(),python_table.get_group_names())
+        self.assertEqual(pandas_table.get_rows_for_group('security').tolist(),python_table.get_rows_for_group('security'))
+
+    def test_set_ips(self) :
+        """Test setting addresses, including in a new column."""
+        device_table = self.__load_all('python')
+        needs_ip = ~device_table.has_ip()
+        self.assertEqual(1,needs_ip.sum())
+        device_table.set_ips(needs_ip,['192.168.128.100'])
+        self.assertEqual(0,(~device_table.has_ip()).sum())
+        self.assertEqual(['192.168.128.100'],device_table.get_ips([device_table.get_macs().index('baa')]))
+        device_table.set_ips(device_table.to_mask([True] + [False] * 6),['fd00::1'],column='ipv6')
+        self.assertEqual('fd00::1',device_table.get_df()['ipv6'].tolist()[0])
+
+    def test_does_not_import_pandas(self) :
+        """Test that the CLI, loading and scanning with the python backend leave pandas unimported."""
+        script = (
+            "import sys\n"
+            "import netorg\n"
+            "from netorg_core import devicetable, devicetableloader, networkspace, scan\n"
+            "device_table = devicetable.DeviceTable([{'mac': 'aab', 'known': True, 'ip': '', 'group': 'g', 'name': 'n'}], backend='python')\n"
+            "networkspace.NetworkMapper('192.168.128.0/24', device_table).map_to_network_space()\n"
+            "scan.NetorgScanner(device_table).run()\n"
+            "device_table.to_csv()\n"
+            "print('pandas' in sys.modules)\n")
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual('False',result.stdout.strip())
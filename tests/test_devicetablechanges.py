@@ -0,0 +1,132 @@
+"""Tests for devicetablechanges.py."""
+import csv
+import io
+import unittest
+from netorg_core import app
+from netorg_core import devicetable
+from netorg_core import devicetablechanges
+from netorg_core import devicetableloader
+from netorg_core import ports
+from tests import mockadapters
+
+PREVIOUS = [
+    {'mac': 'aa', 'known': True, 'reserved': True, 'active': True,
+     'ip': '192.168.128.10', 'group': 'servers', 'name': 'Meerkat'},
+    {'mac': 'bb', 'known': False, 'reserved': False, 'active': True,
+     'ip': '192.168.128.20', 'group': 'unclassified', 'name': 'Jasons iPad'},
+    {'mac': 'cc', 'known': True, 'reserved': True, 'active': False,
+     'ip': '192.168.128.30', 'group': 'printers', 'name': 'Office Printer'}
+]
+
+CURRENT = [
+    # aa is unchanged
+    {'mac': 'aa', 'known': True, 'reserved': True, 'active': True,
+     'ip': '192.168.128.10', 'group': 'servers', 'name': 'Meerkat'},
+    # bb was classified and given a reservation
+    {'mac': 'bb', 'known': True, 'reserved': True, 'active': True,
+     'ip': '192.168.128.20', 'group': 'tablets', 'name': 'Jasons iPad'},
+    # cc was removed, dd is new
+    {'mac': 'dd', 'known': False, 'reserved': False, 'active': True,
+     'ip': '192.168.128.40', 'group': 'unclassified', 'name': 'Doorbell'}
+]
+
+class TestDeviceTableChanges(unittest.TestCase) :
+    """Tests for DeviceTableChanges."""
+
+    def test_changes(self):
+        """Added, removed and changed devices, with the columns that changed."""
+        for backend in devicetable.BACKENDS:
+            with self.subTest(backend=backend):
+                changes = devicetablechanges.DeviceTableChanges(
+                    devicetable.DeviceTable(PREVIOUS, backend=backend),
+                    devicetable.DeviceTable(CURRENT, backend=backend))
+                self.assertEqual(len(changes), 3)
+                self.assertFalse(changes.is_empty())
+                self.assertEqual(changes.get_added(), ['dd'])
+                self.assertEqual(changes.get_removed(), ['cc'])
+                self.assertEqual(changes.get_changed(), ['bb'])
+                self.assertEqual(changes.get_macs(), ['bb', 'dd', 'cc'])
+                self.assertEqual(changes.get_changed_columns('bb'), ['known', 'reserved', 'group'])
+                self.assertEqual(changes.get_changed_columns('dd'), ['known', 'reserved', 'active', 'ip', 'group', 'name'])
+                records = {record['mac']: record for record in changes.to_records()}
+                self.assertEqual(records['bb']['change'], 'changed')
+                self.assertEqual(records['bb']['group'], 'tablets')
+                self.assertTrue(records['bb']['group_changed'])
+                self.assertFalse(records['bb']['ip_changed'])
+                self.assertEqual(records['cc']['change'], 'removed')
+                self.assertEqual(records['cc']['name'], 'Office Printer')
+
+    def test_no_previous(self):
+        """Without a previous device table every device is added."""
+        changes = devicetablechanges.DeviceTableChanges(None, devicetable.DeviceTable(CURRENT, backend='python'))
+        self.assertEqual(changes.get_added(), ['aa', 'bb', 'dd'])
+        self.assertEqual(changes.get_removed(), [])
+
+    def test_unchanged(self):
+        """The same device table has no changes."""
+        device_table = devicetable.DeviceTable(PREVIOUS, backend='python')
+        changes = devicetablechanges.DeviceTableChanges(device_table, device_table)
+        self.assertTrue(changes.is_empty())
+        self.assertEqual(changes.to_csv().splitlines(),
+                         ['change,mac,known,reserved,active,ip,group,name,'
+                          'known_changed,reserved_changed,active_changed,ip_changed,group_changed,name_changed'])
+
+    def test_export_changes(self):
+        """--export --changes exports what changed since the previous export of the changes,
+        whatever else ran in between."""
+        cursor_port = mockadapters.DeviceTableSnapshotAdapter()
+        cursor_port.save(devicetable.DeviceTable(PREVIOUS, backend='python'))
+        snapshot_port = mockadapters.DeviceTableSnapshotAdapter()
+        csv_out_port = mockadapters.DeviceTableCsvOutAdapter()
+
+        def create_app(snapshot_max_age=None):
+            return app.NetOrganizerApp(
+                mockadapters.KnownDevicesAdapter(seed_list=[
+                    ports.KnownDevice(mac='aa', name='Meerkat', group='servers'),
+                    ports.KnownDevice(mac='bb', name='Jasons iPad', group='tablets')]),
+                mockadapters.ActiveClientsAdapter(seed_list=[
+                    ports.ActiveClient(mac='aa', name='Meerkat', ip_address='192.168.128.10'),
+                    ports.ActiveClient(mac='bb', name='Jasons iPad', ip_address='192.168.128.20'),
+                    ports.ActiveClient(mac='dd', name='Doorbell', ip_address='192.168.128.40')]),
+                mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[
+                    ports.FixedIpReservation(mac='aa', name='Meerkat', ip_address='192.168.128.10'),
+                    ports.FixedIpReservation(mac='bb', name='Jasons iPad', ip_address='192.168.128.20')]),
+                device_table_csv_out_port=csv_out_port,
+                sna_hostgroup_port=None,
+                device_table_backend='python',
+                device_table_snapshot_port=snapshot_port,
+                device_table_changes_cursor_port=cursor_port,
+                snapshot_max_age=snapshot_max_age)
+
+        # Another export in between neither moves the cursor nor is affected by it
+        create_app().do_export()
+        create_app().do_export(changes=True)
+        rows = list(csv.DictReader(io.StringIO(csv_out_port.device_table_csv)))
+        self.assertEqual([(row['change'], row['mac']) for row in rows], [('changed', 'bb'), ('added', 'dd'), ('removed', 'cc')])
+        # The export moved the cursor on, so exporting again shows no changes
+        create_app().do_export(changes=True)
+        self.assertEqual(list(csv.DictReader(io.StringIO(csv_out_port.device_table_csv))), [])
+        # Organizing clears the snapshot, but not the cursor
+        create_app().do_organize()
+        create_app().do_export(changes=True)
+        self.assertNotIn('added', [row['change'] for row in csv.DictReader(io.StringIO(csv_out_port.device_table_csv))])
+        # The changes cannot come from the snapshot
+        with self.assertRaises(ValueError):
+            create_app(float('inf')).do_export(changes=True)
+
+    def test_changes_only_when_asked(self):
+        """The loader only works out the changes given a port holding the previous device table."""
+        known_devices_port = mockadapters.KnownDevicesAdapter(seed_list=[])
+        active_clients_port = mockadapters.ActiveClientsAdapter(seed_list=[])
+        fixed_ip_reservations_port = mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[])
+        device_table_loader = devicetableloader.DeviceTableLoader(
+            known_devices_port, active_clients_port, fixed_ip_reservations_port, backend='python')
+        device_table_loader.load_all()
+        self.assertIsNone(device_table_loader.changes)
+        previous_device_table_port = mockadapters.DeviceTableSnapshotAdapter()
+        previous_device_table_port.save(devicetable.DeviceTable(PREVIOUS, backend='python'))
+        device_table_loader = devicetableloader.DeviceTableLoader(
+            known_devices_port, active_clients_port, fixed_ip_reservations_port, backend='python',
+            previous_device_table_port=previous_device_table_port)
+        device_table_loader.load_all()
+        self.assertEqual(device_table_loader.changes.get_removed(), ['aa', 'bb', 'cc'])
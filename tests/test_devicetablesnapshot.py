@@ -0,0 +1,133 @@
+"""Module for testing DeviceTableSnapshotAdapter."""
+
+import os.path
+import tempfile
+import time
+import unittest
+from typing import List
+from unittest import mock
+
+from adapters import devicetablesnapshot_file
+from netorg_core import app
+from netorg_core import devicetable
+from netorg_core import ports
+from tests import mockadapters
+
+DEVICES = [
+    {'mac': 'aa', 'known': True, 'reserved': True, 'active': False,
+     'ip': '192.168.128.10', 'group': 'servers', 'name': 'Meerkat'},
+    {'mac': 'bb', 'known': False, 'reserved': False, 'active': True,
+     'ip': '192.168.128.20', 'group': 'unclassified', 'name': 'Jasons iPad é'},
+    {'mac': 'cc', 'known': True, 'reserved': False, 'active': False,
+     'ip': '', 'group': 'printers', 'name': ''}
+]
+
+class CountingActiveClientsAdapter(mockadapters.ActiveClientsAdapter):
+    """Active clients that count how many times they are loaded."""
+
+    def __init__(self, seed_list: List[ports.ActiveClient]) -> None:
+        super().__init__(seed_list)
+        self.loads = 0
+
+    def load(self) -> List[ports.ActiveClient]:
+        self.loads += 1
+        return super().load()
+
+class TestDeviceTableSnapshotAdapter(unittest.TestCase):
+    """Tests for DeviceTableSnapshotAdapter."""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.snapshot_port = devicetablesnapshot_file.DeviceTableSnapshotAdapter(
+            {'devices_yml': os.path.join(self.directory.name, 'devices.yml')})
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_filename(self):
+        """The snapshot is kept next to devices.yml unless device_table_snapshot says otherwise."""
+        self.assertEqual(self.snapshot_port.filename, os.path.join(self.directory.name, 'devices.snapshot'))
+        snapshot_port = devicetablesnapshot_file.DeviceTableSnapshotAdapter(
+            {'devices_yml': 'devices.yml', 'device_table_snapshot': '/tmp/netorg.snapshot'})
+        self.assertEqual(snapshot_port.filename, '/tmp/netorg.snapshot')
+
+    def test_round_trip(self):
+        """A saved device table loads back the same, with either backend."""
+        for backend in devicetable.BACKENDS:
+            for load_backend in devicetable.BACKENDS:
+                with self.subTest(backend=backend, load_backend=load_backend):
+                    device_table = devicetable.DeviceTable(DEVICES, backend=backend)
+                    self.snapshot_port.save(device_table)
+                    loaded = self.snapshot_port.load(60, load_backend)
+                    self.assertIsInstance(loaded, devicetable.get_backend(load_backend))
+                    self.assertEqual(loaded.to_columns(), device_table.to_columns())
+                    self.assertEqual(loaded.to_csv(), device_table.to_csv())
+
+    def test_round_trip_empty(self):
+        """An empty device table loads back empty."""
+        self.snapshot_port.save(devicetable.DeviceTable([], backend='python'))
+        loaded = self.snapshot_port.load(60, 'python')
+        self.assertEqual(loaded.get_size(), 0)
+
+    def test_max_age(self):
+        """A snapshot older than max_age is not used."""
+        self.snapshot_port.save(devicetable.DeviceTable(DEVICES, backend='python'))
+        with mock.patch('time.time', return_value=time.time() + 120):
+            self.assertIsNone(self.snapshot_port.load(60))
+            self.assertIsNotNone(self.snapshot_port.load(float('inf'), 'python'))
+
+    def test_not_a_snapshot(self):
+        """A missing, empty or foreign file is not used."""
+        self.assertIsNone(self.snapshot_port.load(60))
+        with open(self.snapshot_port.filename, 'wb'):
+            pass
+        self.assertIsNone(self.snapshot_port.load(60))
+        with open(self.snapshot_port.filename, 'wb') as snapshot_file:
+            snapshot_file.write(b'devices:\n  servers:\n    - Meerkat,aa\n')
+        self.assertIsNone(self.snapshot_port.load(60))
+
+    def test_clear(self):
+        """Clearing removes the snapshot."""
+        self.snapshot_port.save(devicetable.DeviceTable(DEVICES, backend='python'))
+        self.snapshot_port.clear()
+        self.assertFalse(os.path.exists(self.snapshot_port.filename))
+        self.assertIsNone(self.snapshot_port.load(60))
+        self.snapshot_port.clear()
+
+    def test_offline(self):
+        """Offline, scan/export/capacity use the snapshot rather than the ports, scan does not write back to
+        devices.yml, and organize clears the snapshot."""
+        active_clients_port = CountingActiveClientsAdapter(seed_list=[
+            ports.ActiveClient(mac='aa', name='Jasons iPad', ip_address='192.168.128.20')
+        ])
+        csv_out_port = mock.Mock()
+
+        def create_app(snapshot_max_age):
+            return app.NetOrganizerApp(
+                mockadapters.KnownDevicesAdapter(seed_list=[]),
+                active_clients_port,
+                mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[]),
+                device_table_csv_out_port=csv_out_port,
+                sna_hostgroup_port=None,
+                device_table_snapshot_port=self.snapshot_port,
+                snapshot_max_age=snapshot_max_age)
+
+        with self.assertRaises(ValueError):
+            create_app(float('inf')).do_export()
+        create_app(None).do_export()
+        self.assertEqual(active_clients_port.loads, 1)
+        create_app(float('inf')).do_export()
+        create_app(60).do_export()
+        self.assertEqual(active_clients_port.loads, 1)
+        self.assertEqual(csv_out_port.write.call_count, 3)
+        self.assertEqual(len(set(call.args[0] for call in csv_out_port.write.call_args_list)), 1)
+        known_devices_port = mock.Mock(wraps=mockadapters.KnownDevicesAdapter(seed_list=[]))
+        offline_app = create_app(float('inf'))
+        offline_app.known_devices_port = known_devices_port
+        with self.assertLogs('netorg', level='INFO'):
+            offline_app.do_scan()
+        known_devices_port.save.assert_not_called()
+        self.assertEqual(active_clients_port.loads, 1)
+        create_app(None).do_organize()
+        self.assertEqual(active_clients_port.loads, 2)
+        self.assertFalse(os.path.exists(self.snapshot_port.filename))
@@ -2,6 +2,7 @@
 import unittest
 from typing import List
 from adapters import fixedipreservations_meraki
+from adapters import meraki_vlans
 from netorg_core import devicetable
 from netorg_core import devicetableloader
 from netorg_core import ports
@@ -75,4 +76,27 @@ class TestFixedIpReservationsMerakiAdapter(unittest.TestCase) :
         fixed_ip_reservations = fixedipreservations_meraki.FixedIpReservationsAdapter._FixedIpReservationsAdapter__generate_fixed_ip_reservations(device_table)
         self.assertEqual(len(fixed_ip_reservations), 2, "Expected there to be 2 reservations")
         self.assertEqual(fixed_ip_reservations['__a_201']['ip'], '192.168.128.201')
-        self.assertEqual(fixed_ip_reservations['__a_202']['ip'], '192.168.128.202')
\ No newline at end of file
+        self.assertEqual(fixed_ip_reservations['__a_202']['ip'], '192.168.128.202')
+
+    def test_get_vlans(self):
+        """Test the single VLAN settings and the vlans setting."""
+        config = {'vlan_id': 100, 'vlan_subnet': '192.168.128.0/24', 'vlan_exclusions': ['192.168.128.1']}
+        self.assertListEqual([{'id': '100', 'subnet': '192.168.128.0/24', 'exclusions': ['192.168.128.1'], 'network_space': 'interval', 'groups': [], 'state_file': None}],
+            meraki_vlans.get_vlans(config))
+        config['network_space'] = 'bitmap'
+        config['vlans'] = [
+            {'id': 100, 'subnet': '192.168.128.0/24'},
+            {'id': 200, 'subnet': '192.168.129.0/24', 'groups': ['cameras']}]
+        self.assertListEqual([
+            {'id': '100', 'subnet': '192.168.128.0/24', 'exclusions': [], 'network_space': 'bitmap', 'groups': [], 'state_file': None},
+            {'id': '200', 'subnet': '192.168.129.0/24', 'exclusions': [], 'network_space': 'bitmap', 'groups': ['cameras'], 'state_file': None}],
+            meraki_vlans.get_vlans(config))
+
+    def test_get_vlans_persisted(self):
+        """Test that persisted bitmap network spaces keep their state next to devices.yml."""
+        config = {'vlan_id': 100, 'vlan_subnet': '10.0.0.0/8', 'devices_yml': '/home/netorg/devices.yml', 'persist_network_space': True}
+        vlans = meraki_vlans.get_vlans(config)
+        self.assertEqual('bitmap', vlans[0]['network_space'])
+        self.assertEqual('/home/netorg/vlan-100.bitmap', vlans[0]['state_file'])
+        config['vlan_exclusions'] = ['10.0.0.1']
+        self.assertIsNone(meraki_vlans.get_vlans(config)[0]['state_file'])
@@ -62,3 +62,17 @@ class TestKnownDevicesYamlFileAdapter(unittest.TestCase):
             config = {'devices_yml': temp_file.name }
             known_devices_yaml_file_adapter = knowndevices_yamlfile.KnownDevicesAdapter(config=config)
             self.assertRaises(ValueError, known_devices_yaml_file_adapter.load)
+
+    def test_load_columns_from_file(self):
+        """Test well-formed YAML load from file as columns."""
+        # pylint: disable=consider-using-with
+        temp_file = tempfile.NamedTemporaryFile()
+        with open(temp_file.name, 'w', encoding='utf8', newline='') as yaml_fp:
+            yaml_fp.write(TestKnownDevicesYamlFileAdapter.generate_test_data())
+            yaml_fp.close()
+            config = {'devices_yml': temp_file.name }
+            known_devices_yaml_file_adapter = knowndevices_yamlfile.KnownDevicesAdapter(config=config)
+            columns = known_devices_yaml_file_adapter.load_columns()
+            self.assertEqual(['eero', 'eero', 'kitchen_appliances'], columns['group'])
+            self.assertEqual(['18:90:88:28:eb:5b', '18:90:88:29:2b:5b', '68:a4:0e:2d:9a:91'], columns['mac'])
+            self.assertEqual(3, len(columns['name']))
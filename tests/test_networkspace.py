@@ -1,4 +1,6 @@
 """Test for ipv4privatenetworkspace."""
+import os.path
+import tempfile
 import unittest
 from typing import List
 from netorg_core import networkspace
@@ -49,6 +51,616 @@ class TestIpv4PrivateNetworkSpace(unittest.TestCase):
         self.assertEqual('192.168.128.254', allocated_address, "Expected allocate_address to return 192.168.128.254")
         self.assertRaises(ValueError, network_space.allocate_specific_address, "192.168.128.254") # Already in use
 
+    def test_allocate_skips_used_addresses(self) :
+        """Test allocation is lowest-first and skips specifically allocated addresses."""
+        network_space = networkspace.Ipv4PrivateNetworkSpace("192.168.128.248/29")
+        network_space.allocate_specific_address("192.168.128.249")
+        network_space.allocate_specific_address("192.168.128.251")
+        self.assertEqual('192.168.128.250', network_space.allocate_address())
+        self.assertEqual('192.168.128.252', network_space.allocate_address())
+        unused = network_space.get_unused_set()
+        self.assertEqual(2, len(unused))
+        self.assertListEqual(['192.168.128.253', '192.168.128.254'], list(unused))
+        self.assertNotIn('192.168.128.249', unused)
+        self.assertNotIn('8.8.8.8', unused)
+
+class TestNetworkSpaceBulkAllocation(unittest.TestCase):
+    """Tests for the bulk allocation API common to all network spaces."""
+
+    def test_allocate_addresses(self) :
+        """Bulk allocation either allocates everything or nothing."""
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            network_space = networkspace.create_network_space("192.168.128.248/29", space_type)
+            network_space.allocate_specific_address("192.168.128.250")
+            self.assertListEqual(
+                ['192.168.128.249', '192.168.128.251', '192.168.128.252'],
+                network_space.allocate_addresses(3), space_type)
+            self.assertRaises(networkspace.NetworkIsOutOfSpace, network_space.allocate_addresses, 3)
+            self.assertEqual(4, len(network_space.get_used_set()), space_type)
+            self.assertListEqual([], network_space.allocate_addresses(0))
+
+    def test_allocate_specific_addresses(self) :
+        """All out-of-range and duplicate addresses are reported together."""
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            network_space = networkspace.create_network_space("192.168.128.248/29", space_type)
+            network_space.allocate_specific_address("192.168.128.250")
+            with self.assertRaises(networkspace.InvalidAddresses) as context:
+                network_space.allocate_specific_addresses([
+                    '192.168.128.249', '8.8.8.8', '192.168.128.250',
+                    '192.168.128.251', '192.168.128.251', '192.168.129.1'])
+            self.assertListEqual(['8.8.8.8', '192.168.129.1'], context.exception.out_of_range, space_type)
+            self.assertListEqual(['192.168.128.250', '192.168.128.251'], context.exception.duplicates, space_type)
+            self.assertEqual(1, len(network_space.get_used_set()), "Expected nothing to be allocated")
+            network_space.allocate_specific_addresses(['192.168.128.249', '192.168.128.251'])
+            self.assertEqual(3, len(network_space.get_used_set()), space_type)
+
+class TestHashedAllocation(unittest.TestCase):
+    """Tests for MAC-hashed address allocation."""
+
+    macs = [f'02:00:00:00:00:{i:02x}' for i in range(40)]
+
+    def test_same_mac_same_address(self) :
+        """A MAC gets the same address from every fresh space, whatever the order."""
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            first = networkspace.create_network_space("192.168.128.0/24", space_type).allocate_addresses_for(self.macs)
+            second = networkspace.create_network_space("192.168.128.0/24", space_type).allocate_addresses_for(list(reversed(self.macs)))
+            self.assertListEqual(first, list(reversed(second)), space_type)
+            self.assertEqual(len(self.macs), len(set(first)), space_type)
+
+    def test_same_address_across_space_types(self) :
+        """All network space types agree on where a MAC lands."""
+        expected = networkspace.Ipv4PrivateNetworkSpace("192.168.128.0/24").allocate_addresses_for(self.macs)
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            actual = networkspace.create_network_space("192.168.128.0/24", space_type).allocate_addresses_for(self.macs)
+            self.assertListEqual(expected, actual, space_type)
+
+    def test_probe_wraps_around(self) :
+        """When the preferred address is taken, the next free address is used, wrapping to the start."""
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            network_space = networkspace.create_network_space("192.168.128.248/29", space_type)
+            preferred = network_space.get_next_free_address(networkspace.get_preferred_offset('aa', 6))
+            self.assertEqual(preferred, network_space.allocate_address_for('aa'), space_type)
+            for ip_address in ['192.168.128.249', '192.168.128.250', '192.168.128.251', '192.168.128.252', '192.168.128.253', '192.168.128.254']:
+                if ip_address not in network_space.get_used_set():
+                    network_space.allocate_specific_address(ip_address)
+                    break
+            self.assertEqual(4, len(network_space.allocate_addresses_for(['b', 'c', 'd', 'e'])), space_type)
+            self.assertRaises(networkspace.NetworkIsOutOfSpace, network_space.allocate_address_for, 'f')
+
+    def test_mapper_is_deterministic(self) :
+        """Re-running organize on a rebuilt table gives new devices the same addresses."""
+        def map_devices(macs):
+            data = [{'mac': mac, 'known': True, 'reserved': False, 'active': False,
+                     'ip': '', 'group': 'unclassified', 'name': mac} for mac in macs]
+            device_table = devicetable.DeviceTable(data)
+            networkspace.NetworkMapper("192.168.128.0/24", device_table).map_to_network_space()
+            return dict(zip(device_table.get_df()['mac'], device_table.get_df()['ip']))
+        self.assertDictEqual(map_devices(self.macs), map_devices(list(reversed(self.macs))))
+
+class TestGroupedAllocation(unittest.TestCase):
+    """Tests for group-contiguous block allocation."""
+
+    @staticmethod
+    def build_device_table(devices) -> devicetable.DeviceTable:
+        """Build a device table from (mac, group, ip) tuples."""
+        data = [{'mac': mac, 'known': True, 'reserved': bool(ip), 'active': False,
+                 'ip': ip, 'group': group, 'name': mac} for mac, group, ip in devices]
+        return devicetable.DeviceTable(data)
+
+    def test_summarize_addresses(self) :
+        """Contiguous addresses collapse into CIDRs."""
+        self.assertListEqual(
+            ['192.168.128.8/30', '192.168.128.20'],
+            networkspace.summarize_addresses(['192.168.128.20', '192.168.128.9', '192.168.128.8', '', '192.168.128.11', '192.168.128.10']))
+        self.assertListEqual(
+            ['192.168.128.8', 'fd00::/127'],
+            networkspace.summarize_addresses(['fd00::1', '192.168.128.8', 'fd00::']))
+
+    def test_groups_are_contiguous(self) :
+        """New members of each group are placed in the group's own aligned block."""
+        devices = [(f'lights-{i}', 'lights', '') for i in range(6)] + [(f'ring-{i}', 'ring', '') for i in range(3)]
+        device_table = TestGroupedAllocation.build_device_table(devices)
+        networkspace.NetworkMapper("192.168.128.0/24", device_table,
+            allocation_policy=networkspace.GROUPED, group_headroom=2).map_to_network_space()
+        df = device_table.get_df()
+        lights = networkspace.summarize_addresses(df.loc[df['group'] == 'lights', 'ip'].tolist())
+        ring = networkspace.summarize_addresses(df.loc[df['group'] == 'ring', 'ip'].tolist())
+        self.assertListEqual(['192.168.128.1', '192.168.128.2/31', '192.168.128.4/31', '192.168.128.6'], lights)
+        self.assertListEqual(['192.168.128.8/31', '192.168.128.10'], ring)
+
+    def test_existing_block_is_reused(self) :
+        """A group's new members join the block that already holds its members."""
+        devices = [
+            ('other', 'servers', '192.168.128.1'),
+            ('lights-0', 'lights', '192.168.128.64'),
+            ('lights-1', 'lights', '192.168.128.65'),
+            ('lights-2', 'lights', ''),
+            ('lights-3', 'lights', '')]
+        device_table = TestGroupedAllocation.build_device_table(devices)
+        networkspace.NetworkMapper("192.168.128.0/24", device_table,
+            allocation_policy=networkspace.GROUPED, group_headroom=0).map_to_network_space()
+        df = device_table.get_df()
+        self.assertListEqual(['192.168.128.64/30'],
+            networkspace.summarize_addresses(df.loc[df['group'] == 'lights', 'ip'].tolist()))
+
+    def test_other_groups_are_avoided(self) :
+        """A block shared with another group is not used."""
+        devices = [
+            ('servers-0', 'servers', '192.168.128.1'),
+            ('lights-0', 'lights', '192.168.128.2'),
+            ('lights-1', 'lights', '')]
+        device_table = TestGroupedAllocation.build_device_table(devices)
+        networkspace.NetworkMapper("192.168.128.0/24", device_table,
+            allocation_policy=networkspace.GROUPED, group_headroom=2).map_to_network_space()
+        df = device_table.get_df()
+        self.assertEqual('192.168.128.4', df.loc[df['mac'] == 'lights-1', 'ip'].iloc[0])
+
+    def test_out_of_space(self) :
+        """Grouped allocation still reports exhaustion."""
+        devices = [(f'lights-{i}', 'lights', '') for i in range(3)]
+        device_table = TestGroupedAllocation.build_device_table(devices)
+        network_mapper = networkspace.NetworkMapper("192.168.128.252/30", device_table, allocation_policy=networkspace.GROUPED)
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, network_mapper.map_to_network_space)
+
+class TestIpv6SparseNetworkSpace(unittest.TestCase):
+    """Tests for the sparse IPv6 network space."""
+
+    def test_size_without_enumerating(self) :
+        """A /64 is usable without materializing its addresses."""
+        network_space = networkspace.create_network_space("fd00:1:2:3::/64")
+        self.assertIsInstance(network_space, networkspace.Ipv6SparseNetworkSpace)
+        self.assertEqual((1 << 64) - 1, network_space.get_size())
+        self.assertEqual((1 << 64) - 1, network_space.get_free_count())
+        self.assertEqual("fd00:1:2:3::1", network_space.allocate_address())
+        self.assertEqual("fd00:1:2:3::2", network_space.allocate_address())
+        self.assertEqual((1 << 64) - 3, network_space.get_free_count())
+        self.assertIn("fd00:1:2:3::1", network_space.get_used_set())
+        self.assertNotIn("fd00:1:2:3::1", network_space.get_unused_set())
+        self.assertIn("FD00:1:2:3:ffff:ffff:ffff:ffff", network_space.get_unused_set())
+        self.assertNotIn("fd00:1:2:3::", network_space.get_address_set())
+        self.assertNotIn("fd00:1:2:4::1", network_space.get_address_set())
+        self.assertNotIn("192.168.128.1", network_space.get_address_set())
+
+    def test_allocate_specific_address(self) :
+        """Specific addresses are normalized and checked."""
+        network_space = networkspace.Ipv6SparseNetworkSpace("2001:db8::/64")
+        self.assertEqual("2001:db8::a", network_space.allocate_specific_address("2001:DB8:0::000a"))
+        self.assertRaises(ValueError, network_space.allocate_specific_address, "2001:db8::a")
+        self.assertRaises(ValueError, network_space.allocate_specific_address, "2001:db9::a")
+
+    def test_eui64(self) :
+        """In a /64 a device gets its EUI-64 address, or the next free one."""
+        network_space = networkspace.Ipv6SparseNetworkSpace("2001:db8::/64")
+        self.assertEqual("2001:db8::21b:63ff:fe84:45e6", network_space.allocate_address_for("00:1B:63:84:45:E6"))
+        self.assertEqual("2001:db8::21b:63ff:fe84:45e7", network_space.allocate_address_for("00-1b-63-84-45-e6"))
+        network_space = networkspace.Ipv6SparseNetworkSpace("2001:db8::/112")
+        ip_address = network_space.allocate_address_for("00:1b:63:84:45:e6")
+        self.assertEqual(networkspace.get_preferred_offset("00:1b:63:84:45:e6", 65535) + 1,
+                         int(networkspace.ipaddress.IPv6Address(ip_address)) & 0xffff)
+
+    def test_out_of_space(self) :
+        """A tiny IPv6 space runs out like any other."""
+        network_space = networkspace.Ipv6SparseNetworkSpace("fd00::/126")
+        self.assertEqual(3, network_space.get_size())
+        self.assertEqual(3, len(network_space.allocate_addresses_for(['a', 'b', 'c'])))
+        self.assertIsNone(network_space.get_next_free_address(0))
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, network_space.allocate_address)
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, network_space.allocate_addresses_for, ['d'])
+
+    def test_only_sparse_for_ipv6(self) :
+        """IPv4-only network space types are rejected for IPv6."""
+        self.assertRaises(ValueError, networkspace.create_network_space, "fd00::/64", 'bitmap')
+        self.assertRaises(ValueError, networkspace.create_network_space, "fd00::/64", 'interval', ["fd00::1"])
+        self.assertRaises(ValueError, networkspace.Ipv6SparseNetworkSpace, "192.168.128.0/24")
+
+    def test_dual_stack_mapping(self) :
+        """IPv4 and IPv6 addresses are mapped into separate columns of the same device table."""
+        devices = [
+            {'mac': '02:00:00:00:00:01', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'lights', 'name': 'one'},
+            {'mac': '02:00:00:00:00:02', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'lights', 'name': 'two'}]
+        device_table = devicetable.DeviceTable(devices)
+        networkspace.NetworkMapper("192.168.128.0/24", device_table, allocation_policy=networkspace.SEQUENTIAL).map_to_network_space()
+        network_mapper = networkspace.NetworkMapper("fd00:0:0:80::/64", device_table, ip_column='ipv6')
+        network_mapper.map_to_network_space()
+        df = device_table.get_df()
+        self.assertListEqual(['192.168.128.1', '192.168.128.2'], df['ip'].tolist())
+        self.assertListEqual(['fd00::80:0:ff:fe00:1', 'fd00::80:0:ff:fe00:2'], df['ipv6'].tolist())
+        self.assertEqual(2, len(network_mapper.get_network_space().get_used_set()))
+
+class TestNetworkSpacePool(unittest.TestCase):
+    """Tests for mapping several VLANs in one pass."""
+
+    @staticmethod
+    def build_pool() -> networkspace.NetworkSpacePool:
+        """Build a pool of two VLANs where cameras go to the second."""
+        network_space_pool = networkspace.NetworkSpacePool()
+        network_space_pool.add_vlan(100, "192.168.128.0/24")
+        network_space_pool.add_vlan(200, "192.168.129.0/29", space_type='interval', groups=['cameras'])
+        return network_space_pool
+
+    def test_route(self) :
+        """Devices are routed by IP address, then by group, then to the default VLAN."""
+        network_space_pool = TestNetworkSpacePool.build_pool()
+        self.assertListEqual(['100', '200', '200', '100'], network_space_pool.route(
+            ['192.168.128.9', '192.168.129.1', '', ''], ['cameras', 'lights', 'cameras', 'lights']))
+        self.assertIsNone(network_space_pool.get_vlan_for_address('192.168.127.255'))
+        self.assertIsNone(network_space_pool.get_vlan_for_address('192.168.129.8'))
+        with self.assertRaises(networkspace.InvalidAddresses) as context:
+            network_space_pool.route(['10.0.0.1'], ['lights'])
+        self.assertListEqual(['10.0.0.1'], context.exception.out_of_range)
+
+    def test_overlapping_subnets(self) :
+        """VLAN subnets must not overlap."""
+        network_space_pool = TestNetworkSpacePool.build_pool()
+        self.assertRaises(ValueError, network_space_pool.add_vlan, 300, "192.168.128.128/25")
+        self.assertRaises(ValueError, network_space_pool.add_vlan, 100, "10.0.0.0/24")
+
+    def test_ipv4_only(self) :
+        """The pool maps the ip column, so IPv6 VLANs are rejected."""
+        network_space_pool = TestNetworkSpacePool.build_pool()
+        self.assertRaises(ValueError, network_space_pool.add_vlan, 300, "fd00::/64")
+
+    def test_map_and_utilization(self) :
+        """Every VLAN is mapped in one pass and utilization is reported per VLAN and in aggregate."""
+        devices = [
+            {'mac': 'light', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'lights', 'name': 'light'},
+            {'mac': 'cam-1', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'cameras', 'name': 'cam-1'},
+            {'mac': 'cam-2', 'known': True, 'reserved': True, 'active': False, 'ip': '192.168.129.1', 'group': 'cameras', 'name': 'cam-2'},
+            {'mac': 'moved', 'known': True, 'reserved': True, 'active': False, 'ip': '192.168.129.6', 'group': 'lights', 'name': 'moved'}]
+        device_table = devicetable.DeviceTable(devices)
+        network_space_pool = TestNetworkSpacePool.build_pool()
+        network_mapper = networkspace.NetworkPoolMapper(network_space_pool, device_table, allocation_policy=networkspace.SEQUENTIAL)
+        network_mapper.map_to_network_space()
+        self.assertListEqual(['192.168.128.1', '192.168.129.2', '192.168.129.1', '192.168.129.6'], device_table.get_df()['ip'].tolist())
+        self.assertListEqual(['100', '200', '200', '200'], network_mapper.get_vlan_assignments())
+        utilization = network_mapper.get_utilization()
+        self.assertListEqual([('100', '192.168.128.0/24', 1, 254), ('200', '192.168.129.0/29', 3, 6)], [tuple(vlan) for vlan in utilization])
+        self.assertEqual(50.0, utilization[1].get_percent_used())
+        self.assertAlmostEqual(4 / 260 * 100.0, network_mapper.get_percent_used())
+
+    def test_vlan_out_of_space(self) :
+        """A VLAN that runs out of space is reported even if another VLAN has room."""
+        devices = [{'mac': f'cam-{i}', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'cameras', 'name': f'cam-{i}'}
+                   for i in range(7)]
+        network_mapper = networkspace.NetworkPoolMapper(TestNetworkSpacePool.build_pool(), devicetable.DeviceTable(devices))
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, network_mapper.map_to_network_space)
+
+class TestCapacity(unittest.TestCase):
+    """Tests for the capacity counters of the network spaces."""
+
+    def test_free_blocks_agree(self) :
+        """Every network space type reports the same free blocks for the same allocations."""
+        ip_addresses = ["10.1.0.1", "10.1.0.2", "10.1.0.9", "10.1.0.12", "10.1.0.100", "10.1.0.254"]
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            network_space = networkspace.create_network_space("10.1.0.0/24", space_type)
+            network_space.allocate_specific_addresses(ip_addresses)
+            self.assertEqual(6, network_space.get_used_count(), space_type)
+            self.assertListEqual(
+                [(3, 8), (10, 11), (13, 99), (101, 253)],
+                [(first & 0xff, last & 0xff) for first, last in network_space.iterate_free_blocks()], space_type)
+            self.assertDictEqual({2: 1, 4: 1, 64: 1, 128: 1}, network_space.get_free_block_histogram(), space_type)
+            self.assertTupleEqual(("10.1.0.101", "10.1.0.253"), network_space.get_largest_free_block(), space_type)
+
+    def test_free_blocks_from_start(self) :
+        """Every network space type can report its free blocks from a given address on."""
+        ip_addresses = ["10.1.0.1", "10.1.0.2", "10.1.0.9", "10.1.0.12", "10.1.0.100", "10.1.0.254"]
+        for space_type in networkspace.NETWORK_SPACE_TYPES:
+            network_space = networkspace.create_network_space("10.1.0.0/24", space_type)
+            network_space.allocate_specific_addresses(ip_addresses)
+            start = int(networkspace.ipaddress.IPv4Address("10.1.0.11"))
+            self.assertListEqual(
+                [(11, 11), (13, 99), (101, 253)],
+                [(first & 0xff, last & 0xff) for first, last in network_space.iterate_free_blocks(start)], space_type)
+
+    def test_histogram_is_incremental(self) :
+        """The interval network space keeps its histogram up to date as it allocates."""
+        network_space = networkspace.Ipv4IntervalNetworkSpace("10.1.0.0/24", ["10.1.0.128/25"])
+        self.assertDictEqual({64: 1}, network_space.get_free_block_histogram())
+        network_space.allocate_specific_address("10.1.0.64")
+        self.assertDictEqual({32: 2}, network_space.get_free_block_histogram())
+        network_space.allocate_addresses(63)
+        self.assertDictEqual({32: 1}, network_space.get_free_block_histogram())
+        network_space.allocate_addresses(63)
+        self.assertDictEqual({}, network_space.get_free_block_histogram())
+        self.assertIsNone(network_space.get_largest_free_block())
+
+    def test_bitmap_free_blocks_span_chunks(self) :
+        """Free blocks of a bitmap network space are found across scan chunks."""
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.0.0.0/16")
+        network_space.allocate_specific_addresses(["10.0.0.1", "10.0.255.254"])
+        self.assertListEqual([(int(networkspace.ipaddress.IPv4Address("10.0.0.2")), int(networkspace.ipaddress.IPv4Address("10.0.255.253")))],
+                             list(network_space.iterate_free_blocks()))
+        self.assertEqual(1, len(list(networkspace.create_network_space("10.0.0.0/30", 'bitmap').iterate_free_blocks())))
+
+    def test_ipv6_free_blocks(self) :
+        """The sparse IPv6 network space finds free blocks from the gaps between used addresses."""
+        network_space = networkspace.Ipv6SparseNetworkSpace("fd00::/120")
+        network_space.allocate_specific_addresses(["fd00::1", "fd00::10"])
+        self.assertTupleEqual(("fd00::11", "fd00::ff"), network_space.get_largest_free_block())
+        self.assertDictEqual({8: 1, 128: 1}, network_space.get_free_block_histogram())
+
+    def test_capacity_report(self) :
+        """The mapper reports capacity, fragmentation and group occupancy."""
+        devices = [
+            {'mac': 'a', 'known': True, 'reserved': True, 'active': False, 'ip': '192.168.128.2', 'group': 'lights', 'name': 'a'},
+            {'mac': 'b', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'lights', 'name': 'b'},
+            {'mac': 'c', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'cameras', 'name': 'c'}]
+        network_mapper = networkspace.NetworkMapper("192.168.128.0/29", devicetable.DeviceTable(devices), allocation_policy=networkspace.SEQUENTIAL)
+        network_mapper.reconcile()
+        self.assertDictEqual({'lights': 1}, network_mapper.get_capacity_report().group_occupancy)
+        network_mapper.map_to_network_space()
+        capacity_report = network_mapper.get_capacity_report('100')
+        self.assertEqual(3, capacity_report.used)
+        self.assertEqual(3, capacity_report.get_free())
+        self.assertEqual(50.0, capacity_report.get_percent_used())
+        self.assertTupleEqual(('192.168.128.4', '192.168.128.6'), capacity_report.largest_free_block)
+        self.assertEqual(0.0, capacity_report.get_fragmentation())
+        self.assertDictEqual({
+            'vlan_id': '100', 'subnet': '192.168.128.0/29', 'size': 6, 'used': 3, 'free': 3, 'percent_used': 50.0,
+            'largest_free_block': ['192.168.128.4', '192.168.128.6'], 'largest_free_block_size': 3, 'fragmentation': 0.0,
+            'free_block_histogram': {'2': 1}, 'group_occupancy': {'cameras': 1, 'lights': 2}}, capacity_report.to_dict())
+
+    def test_capacity_report_exclusions(self) :
+        """Excluded addresses are neither used nor free in the capacity report."""
+        devices = [{'mac': 'a', 'known': True, 'reserved': True, 'active': False, 'ip': '192.168.128.2', 'group': 'lights', 'name': 'a'}]
+        network_mapper = networkspace.NetworkMapper("192.168.128.0/24", devicetable.DeviceTable(devices),
+                                                    space_type='interval', exclusions=['192.168.128.100-192.168.128.200'])
+        network_mapper.reconcile()
+        capacity_report = network_mapper.get_capacity_report()
+        self.assertEqual(254, capacity_report.size)
+        self.assertEqual(152, capacity_report.get_free())
+        self.assertAlmostEqual(100.0 / 153, capacity_report.get_percent_used())
+        self.assertTupleEqual(('192.168.128.3', '192.168.128.99'), capacity_report.largest_free_block)
+        self.assertAlmostEqual((152 - 97) / 152 * 100.0, capacity_report.get_fragmentation())
+
+    def test_pool_capacity_reports(self) :
+        """The pool reports every VLAN, including those without devices."""
+        network_space_pool = networkspace.NetworkSpacePool()
+        network_space_pool.add_vlan(100, "192.168.128.0/24")
+        network_space_pool.add_vlan(200, "192.168.129.0/24")
+        devices = [{'mac': 'a', 'known': True, 'reserved': True, 'active': False, 'ip': '192.168.128.2', 'group': 'lights', 'name': 'a'}]
+        network_mapper = networkspace.NetworkPoolMapper(network_space_pool, devicetable.DeviceTable(devices))
+        network_mapper.reconcile()
+        capacity_reports = network_mapper.get_capacity_reports()
+        self.assertListEqual(['100', '200'], [capacity_report.vlan_id for capacity_report in capacity_reports])
+        self.assertListEqual([1, 0], [capacity_report.used for capacity_report in capacity_reports])
+        self.assertAlmostEqual(100.0 / 253, capacity_reports[0].get_fragmentation())
+
+class TestIpv4BitmapNetworkSpace(unittest.TestCase):
+    """Tests for Ipv4BitmapNetworkSpace."""
+
+    def test_invalid_cidr(self) :
+        """Test with an invalid CIDR."""
+        self.assertRaises(ValueError, networkspace.Ipv4BitmapNetworkSpace, "x.x.x.x")
+        self.assertRaises(ValueError, networkspace.Ipv4BitmapNetworkSpace, "192.168.128.22/24")
+        self.assertRaises(ValueError, networkspace.Ipv4BitmapNetworkSpace, "8.0.0.0/8")
+        self.assertRaises(ValueError, networkspace.Ipv4BitmapNetworkSpace, "fd00::/64")
+
+    def test_end_to_end(self) :
+        """Test exhaustion of space."""
+        # pylint: disable=line-too-long
+        network_space = networkspace.Ipv4BitmapNetworkSpace("192.168.128.252/30")
+        self.assertEqual(2,len(network_space.get_address_set()), "Expected address_set to be size 2")
+        self.assertSetEqual({'192.168.128.253', '192.168.128.254'}, set(network_space.get_address_set()))
+        self.assertEqual(0, len(network_space.get_used_set()), "Expected used_set to be size 0")
+        self.assertSetEqual({'192.168.128.253', '192.168.128.254'}, set(network_space.get_unused_set()))
+        first = network_space.allocate_address()
+        self.assertEqual('192.168.128.253', first)
+        self.assertIn(first, network_space.get_used_set())
+        self.assertNotIn(first, network_space.get_unused_set())
+        second = network_space.allocate_address()
+        self.assertEqual('192.168.128.254', second)
+        self.assertSetEqual({first, second}, set(network_space.get_used_set()))
+        self.assertEqual(0, len(network_space.get_unused_set()), "Expected unused_set to be size 0")
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, network_space.allocate_address)
+
+    def test_allocate_specific_address(self) :
+        """Test allocation of a specific address."""
+        network_space = networkspace.Ipv4BitmapNetworkSpace("192.168.128.252/30")
+        self.assertRaises(ValueError, network_space.allocate_specific_address, "8.8.8.8") # Not in CIDR
+        self.assertRaises(ValueError, network_space.allocate_specific_address, "192.168.128.255") # Broadcast
+        self.assertRaises(ValueError, network_space.allocate_specific_address, "not an ip")
+        self.assertEqual('192.168.128.254', network_space.allocate_specific_address("192.168.128.254"))
+        self.assertRaises(ValueError, network_space.allocate_specific_address, "192.168.128.254") # Already in use
+        self.assertEqual('192.168.128.253', network_space.allocate_address())
+
+    def test_large_subnet(self) :
+        """A /8 is created without enumerating its hosts."""
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.0.0.0/8")
+        self.assertEqual(2**24 - 2, network_space.get_size())
+        network_space.allocate_specific_address("10.0.0.1")
+        network_space.allocate_specific_address("10.255.255.254")
+        self.assertEqual('10.0.0.2', network_space.allocate_address())
+        self.assertSetEqual({'10.0.0.1', '10.0.0.2', '10.255.255.254'}, set(network_space.get_used_set()))
+        self.assertIn('10.128.0.1', network_space.get_unused_set())
+
+    def test_create_network_space(self) :
+        """Test the network space factory."""
+        self.assertIsInstance(networkspace.create_network_space("192.168.128.0/24"), networkspace.Ipv4PrivateNetworkSpace)
+        self.assertIsInstance(networkspace.create_network_space("192.168.128.0/24", 'bitmap'), networkspace.Ipv4BitmapNetworkSpace)
+        self.assertRaises(ValueError, networkspace.create_network_space, "192.168.128.0/24", 'unknown')
+
+class TestPersistedBitmapNetworkSpace(unittest.TestCase):
+    """Tests for a bitmap network space persisted to a state file."""
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.temp_dir.name, 'vlan-1.bitmap')
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def test_state_survives_reopening(self) :
+        """A new run starts from the previous run's allocations."""
+        network_space = networkspace.create_network_space("10.1.0.0/16", 'bitmap', state_file=self.state_file)
+        self.assertEqual("10.1.0.1", network_space.allocate_address())
+        network_space.allocate_specific_address("10.1.0.3")
+        network_space.close()
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/16", self.state_file)
+        self.assertEqual(2, len(network_space.get_used_set()))
+        self.assertListEqual(["10.1.0.1", "10.1.0.3"], list(network_space.get_used_set()))
+        self.assertEqual("10.1.0.2", network_space.allocate_address())
+        self.assertEqual("10.1.0.4", network_space.allocate_address())
+        network_space.close()
+
+    def test_different_network_starts_afresh(self) :
+        """A state file for another network is discarded."""
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/16", self.state_file)
+        network_space.allocate_address()
+        network_space.close()
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.2.0.0/30", self.state_file)
+        self.assertEqual(0, len(network_space.get_used_set()))
+        self.assertListEqual(["10.2.0.1", "10.2.0.2"], network_space.allocate_addresses(2))
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, network_space.allocate_address)
+        network_space.close()
+
+    def test_reconcile(self) :
+        """Reconciling claims new addresses, and only releases stale ones when asked to."""
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", self.state_file)
+        network_space.allocate_addresses(3)
+        network_space.reconcile(["10.1.0.2", "10.1.0.9"])
+        self.assertListEqual(["10.1.0.1", "10.1.0.2", "10.1.0.3", "10.1.0.9"], list(network_space.get_used_set()))
+        network_space.reconcile(["10.1.0.2", "10.1.0.9"], release_unused=True)
+        self.assertListEqual(["10.1.0.2", "10.1.0.9"], list(network_space.get_used_set()))
+        self.assertEqual("10.1.0.1", network_space.allocate_address())
+        with self.assertRaises(networkspace.InvalidAddresses) as context:
+            network_space.reconcile(["10.1.0.2", "10.1.0.2", "10.2.0.1"])
+        self.assertListEqual(["10.2.0.1"], context.exception.out_of_range)
+        self.assertListEqual(["10.1.0.2"], context.exception.duplicates)
+        network_space.close()
+
+    def test_shared_between_instances(self) :
+        """Allocations made through one instance are seen by another once it takes the lock."""
+        first = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", self.state_file)
+        second = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", self.state_file)
+        with first.locked():
+            self.assertEqual("10.1.0.1", first.allocate_address())
+        with second.locked():
+            self.assertIn("10.1.0.1", second.get_used_set())
+            self.assertEqual("10.1.0.2", second.allocate_address())
+        first.close()
+        second.close()
+
+    def test_mapper_reruns(self) :
+        """Re-running the mapper against the persisted state keeps existing addresses."""
+        devices = [
+            {'mac': 'known', 'known': True, 'reserved': True, 'active': False, 'ip': '10.1.0.7', 'group': 'lights', 'name': 'known'},
+            {'mac': 'new', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'lights', 'name': 'new'}]
+        for _ in range(2):
+            device_table = devicetable.DeviceTable(devices)
+            network_space = networkspace.create_network_space("10.1.0.0/24", 'bitmap', state_file=self.state_file)
+            networkspace.NetworkMapper("10.1.0.0/24", device_table, allocation_policy=networkspace.SEQUENTIAL,
+                                       network_space=network_space, release_unused=True).map_to_network_space()
+            self.assertListEqual(['10.1.0.7', '10.1.0.1'], device_table.get_df()['ip'].tolist())
+            self.assertEqual(2, len(network_space.get_used_set()))
+            network_space.close()
+
+    def test_mapper_keeps_other_allocations(self) :
+        """Without release_unused, mapping never frees an address another run allocated."""
+        other_run = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", self.state_file)
+        with other_run.locked():
+            self.assertEqual("10.1.0.1", other_run.allocate_address())
+        device_table = devicetable.DeviceTable([
+            {'mac': 'new', 'known': True, 'reserved': False, 'active': False, 'ip': '', 'group': 'lights', 'name': 'new'}])
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", self.state_file)
+        networkspace.NetworkMapper("10.1.0.0/24", device_table, allocation_policy=networkspace.SEQUENTIAL,
+                                   network_space=network_space).map_to_network_space()
+        self.assertListEqual(['10.1.0.2'], device_table.get_ips())
+        self.assertIn("10.1.0.1", network_space.get_used_set())
+        network_space.close()
+        other_run.close()
+
+    def test_read_only(self) :
+        """A read-only network space starts from the state file but never changes it."""
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", self.state_file)
+        network_space.allocate_address()
+        network_space.close()
+        with open(self.state_file, 'rb') as state_file:
+            state = state_file.read()
+        read_only = networkspace.create_network_space("10.1.0.0/24", 'bitmap', state_file=self.state_file, read_only=True)
+        with read_only.locked():
+            read_only.reconcile(["10.1.0.9"], release_unused=True)
+        self.assertListEqual(["10.1.0.9"], list(read_only.get_used_set()))
+        read_only.close()
+        with open(self.state_file, 'rb') as state_file:
+            self.assertEqual(state, state_file.read())
+        missing = os.path.join(self.temp_dir.name, 'vlan-2.bitmap')
+        networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", missing, read_only=True).close()
+        self.assertFalse(os.path.exists(missing))
+
+    @unittest.skipIf(networkspace.fcntl is None, 'file locks need fcntl')
+    def test_nested_locks(self) :
+        """The lock is held until the outermost locked() returns."""
+        network_space = networkspace.Ipv4BitmapNetworkSpace("10.1.0.0/24", self.state_file)
+        with network_space.locked():
+            with network_space.locked():
+                network_space.allocate_address()
+            with open(self.state_file, 'rb') as other_file:
+                self.assertRaises(BlockingIOError, networkspace.fcntl.flock, other_file.fileno(),
+                                  networkspace.fcntl.LOCK_EX | networkspace.fcntl.LOCK_NB)
+        network_space.close()
+
+    def test_only_bitmap_is_persisted(self) :
+        """Other network space types cannot be persisted."""
+        self.assertRaises(ValueError, networkspace.create_network_space, "10.1.0.0/24", 'set', state_file=self.state_file)
+        self.assertRaises(ValueError, networkspace.create_network_space, "10.1.0.0/24", 'interval', ["10.1.0.1"], self.state_file)
+
+class TestIpv4IntervalNetworkSpace(unittest.TestCase):
+    """Tests for Ipv4IntervalNetworkSpace."""
+
+    def test_end_to_end(self) :
+        """Test exhaustion of space."""
+        network_space = networkspace.Ipv4IntervalNetworkSpace("192.168.128.252/30")
+        self.assertEqual(2, network_space.get_free_count())
+        self.assertEqual('192.168.128.253', network_space.get_lowest_free_address())
+        self.assertEqual('192.168.128.253', network_space.allocate_address())
+        self.assertEqual('192.168.128.254', network_space.allocate_address())
+        self.assertEqual(0, len(network_space.get_unused_set()))
+        self.assertSetEqual({'192.168.128.253', '192.168.128.254'}, set(network_space.get_used_set()))
+        self.assertIsNone(network_space.get_lowest_free_address())
+        self.assertIsNone(network_space.get_largest_free_block())
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, network_space.allocate_address)
+
+    def test_exclusions(self) :
+        """Excluded addresses are never allocated but can still be claimed by a device."""
+        network_space = networkspace.Ipv4IntervalNetworkSpace("192.168.128.0/24", exclusions=[
+            '192.168.128.1',
+            '192.168.128.100-192.168.128.199',
+            '192.168.128.240/28'])
+        self.assertEqual(254 - 1 - 100 - 15, network_space.get_free_count())
+        self.assertEqual('192.168.128.2', network_space.get_lowest_free_address())
+        self.assertEqual(('192.168.128.2', '192.168.128.99'), network_space.get_largest_free_block())
+        self.assertNotIn('192.168.128.150', network_space.get_unused_set())
+        self.assertIn('192.168.128.150', network_space.get_address_set())
+        # A device with a lease in the DHCP pool keeps it
+        self.assertEqual('192.168.128.150', network_space.allocate_specific_address('192.168.128.150'))
+        self.assertRaises(ValueError, network_space.allocate_specific_address, '192.168.128.150')
+        self.assertEqual(254 - 1 - 100 - 15, network_space.get_free_count())
+        self.assertListEqual(
+            [('192.168.128.2', '192.168.128.99'), ('192.168.128.200', '192.168.128.239')],
+            network_space.get_free_intervals())
+
+    def test_largest_free_block(self) :
+        """The largest free block is kept up to date as addresses are allocated."""
+        network_space = networkspace.Ipv4IntervalNetworkSpace("10.0.0.0/8", exclusions=['10.0.1.0/24'])
+        self.assertEqual(('10.0.2.0', '10.255.255.254'), network_space.get_largest_free_block())
+        network_space.allocate_specific_address('10.128.0.0')
+        self.assertEqual(('10.128.0.1', '10.255.255.254'), network_space.get_largest_free_block())
+        network_space.allocate_specific_address('10.192.0.0')
+        self.assertEqual(('10.0.2.0', '10.127.255.255'), network_space.get_largest_free_block())
+        self.assertEqual(4, len(network_space.get_free_intervals()))
+        for _ in range(1000):
+            network_space.allocate_address()
+        self.assertEqual('10.0.4.233', network_space.get_lowest_free_address())
+        self.assertEqual(2**24 - 2 - 256 - 2 - 1000, network_space.get_free_count())
+
+    def test_invalid_exclusions(self) :
+        """Test exclusions that are malformed or outside the CIDR."""
+        self.assertRaises(ValueError, networkspace.Ipv4IntervalNetworkSpace, "192.168.128.0/24", ['192.168.129.1'])
+        self.assertRaises(ValueError, networkspace.Ipv4IntervalNetworkSpace, "192.168.128.0/24", ['192.168.128.9-192.168.128.1'])
+        self.assertRaises(ValueError, networkspace.Ipv4IntervalNetworkSpace, "192.168.128.0/24", ['nonsense'])
+        self.assertRaises(ValueError, networkspace.create_network_space, "192.168.128.0/24", 'set', ['192.168.128.1'])
+
 # pylint: disable=line-too-long
 # Test table
 #
@@ -318,6 +930,20 @@ class TestNetworkMapper(unittest.TestCase) :
         devices_with_no_ip = device_table.get_df().query("ip == ''")['mac'].tolist()
         self.assertEqual(0, len(devices_with_no_ip), "Expected there to be zero devices needing an IP")
 
+    def test_organize_bitmap(self):
+        """Tests for NetworkMapper.map_to_network_space() with a bitmap network space."""
+        device_table_loader = devicetableloader.DeviceTableLoader(
+            known_devices_port=KnownDevicesTestAdapter(),
+            active_clients_port=ActiveClientsTestAdapter(),
+            fixed_ip_reservations_port=FixedIpReservationsTestAdapter()
+        )
+        device_table = device_table_loader.load_all()
+        network_mapper = networkspace.NetworkMapper(vlan_subnet="192.168.128.0/24",device_table=device_table,space_type='bitmap')
+        network_mapper.map_to_network_space()
+        devices_with_no_ip = device_table.get_df().query("ip == ''")['mac'].tolist()
+        self.assertEqual(0, len(devices_with_no_ip), "Expected there to be zero devices needing an IP")
+        self.assertAlmostEqual(7 / 254 * 100.0, network_mapper.get_percent_used())
+
     def test_invalid_subnet(self):
         """Test NetworkMapper.map_to_network_space() where the device IPs are in a different subnet."""
         device_table_loader = devicetableloader.DeviceTableLoader(
@@ -357,4 +983,7 @@ class TestNetworkMapper(unittest.TestCase) :
         network_mapper = networkspace.NetworkMapper(
             vlan_subnet="192.168.128.0/24",
             device_table=device_table)
-        self.assertRaises(ValueError, network_mapper.map_to_network_space)
\ No newline at end of file
+        with self.assertRaises(networkspace.InvalidAddresses) as context:
+            network_mapper.map_to_network_space()
+        self.assertListEqual(['192.168.128.202'], context.exception.duplicates)
+        self.assertListEqual([], context.exception.out_of_range)
\ No newline at end of file
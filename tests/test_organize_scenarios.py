@@ -1,3 +1,4 @@
+import contextlib
 import unittest
 from typing import List
 from netorg_core import app, networkspace
@@ -197,4 +198,64 @@ class TestOrganizeScenarios(unittest.TestCase) :
             device_table_csv_out_port=None,
             sna_hostgroup_port=None,
         )
-        self.assertRaises(networkspace.NetworkIsOutOfSpace, net_organizer_app.do_organize)
\ No newline at end of file
+        self.assertRaises(networkspace.NetworkIsOutOfSpace, net_organizer_app.do_organize)
+
+    def test_capacity(self):
+        """Capacity is reported from the addresses in use, without allocating any."""
+        known_devices: List[ports.KnownDevice]= [
+            ports.KnownDevice(name='new', mac='new', group="jasons_devices"),
+            ports.KnownDevice(name='reserved', mac='reserved', group="jasons_devices")
+        ]
+        active_clients: List[ports.ActiveClient] = [
+            ports.ActiveClient(mac='active', name='active', ip_address='192.168.128.4')
+        ]
+        fixed_ip_reservations: List[ports.FixedIpReservation] = [
+            ports.FixedIpReservation(mac='reserved', ip_address='192.168.128.1', name='reserved')
+        ]
+        capacity_report_out_port = mockadapters.CapacityReportOutAdapter()
+        net_organizer_app = app.NetOrganizerApp(
+            mockadapters.KnownDevicesAdapter(seed_list=known_devices),
+            mockadapters.ActiveClientsAdapter(seed_list=active_clients),
+            mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/29',seed_list=fixed_ip_reservations),
+            device_table_csv_out_port=None,
+            sna_hostgroup_port=None,
+            capacity_report_out_port=capacity_report_out_port
+        )
+        net_organizer_app.do_capacity()
+        self.assertEqual(len(capacity_report_out_port.capacity_reports), 1)
+        capacity_report = capacity_report_out_port.capacity_reports[0]
+        self.assertEqual(capacity_report.used, 2)
+        self.assertEqual(capacity_report.get_free(), 4)
+        self.assertEqual(capacity_report.largest_free_block, ('192.168.128.2', '192.168.128.3'))
+        self.assertDictEqual(capacity_report.group_occupancy, {'jasons_devices': 1, 'unclassified': 1})
+
+    def test_organize_holds_lock(self):
+        """The reservations are loaded and saved while the fixed IP reservations port is locked."""
+        events = []
+
+        class LockingFixedIpReservationsAdapter(mockadapters.FixedIpReservationsAdapter):
+            """Records when the lock is taken and released, and the reservations loaded and saved."""
+
+            @contextlib.contextmanager
+            def locked(self):
+                events.append('lock')
+                yield self
+                events.append('unlock')
+
+            def load(self) -> List[ports.FixedIpReservation]:
+                events.append('load')
+                return super().load()
+
+            def save(self, device_table) -> None:
+                events.append('save')
+                super().save(device_table)
+
+        net_organizer_app = app.NetOrganizerApp(
+            mockadapters.KnownDevicesAdapter(seed_list=[]),
+            mockadapters.ActiveClientsAdapter(seed_list=[ports.ActiveClient(mac='aa', name='iPad', ip_address='')]),
+            LockingFixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[]),
+            device_table_csv_out_port=None,
+            sna_hostgroup_port=None,
+        )
+        net_organizer_app.do_organize()
+        self.assertEqual(events, ['lock', 'load', 'save', 'unlock'])
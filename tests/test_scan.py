@@ -110,3 +110,63 @@ class TestNetorgScanner(unittest.TestCase) :
         expected = ['__a', '_ra', 'kra']
         expected.sort()
         self.assertListEqual(actual, expected)
+
+    def test_classify(self):
+        """Test that counting the devices in each state classifies them into the findings run() finds."""
+        device_table_loader = devicetableloader.DeviceTableLoader(
+            known_devices_port=KnownDevicesTestAdapter(),
+            active_clients_port=ActiveClientsTestAdapter(),
+            fixed_ip_reservations_port=FixedIpReservationsTestAdapter()
+        )
+        device_table = device_table_loader.load_all()
+        scanner = scan.NetorgScanner(device_table)
+        scanner.run()
+        states = device_table.get_states().tolist()
+        counts = {state: states.count(state) for state in set(states)}
+        self.assertDictEqual(
+            scan.classify(lambda mask, value: sum(count for state, count in counts.items() if state & mask == value)),
+            {k: len(v['device_names']) for k, v in scanner.analysis.items()})
+
+    def test_run_backends(self):
+        """Test that NetorgScanner.run() finds the same devices with every backend."""
+        analyses = []
+        for backend in devicetable.BACKENDS:
+            device_table_loader = devicetableloader.DeviceTableLoader(
+                known_devices_port=KnownDevicesTestAdapter(),
+                active_clients_port=ActiveClientsTestAdapter(),
+                fixed_ip_reservations_port=FixedIpReservationsTestAdapter(),
+                backend=backend
+            )
+            device_table = device_table_loader.load_all()
+            states = device_table.get_states()
+            self.assertEqual(states.tolist()[0], devicetable.FLAGS['known'])
+            self.assertEqual(states.tolist()[4], devicetable.FLAGS['active'] | devicetable.UNCLASSIFIED)
+            unclassified = device_table.get_rows(device_table.get_in_state(devicetable.UNCLASSIFIED, devicetable.UNCLASSIFIED, states))
+            self.assertIn(4, unclassified)
+            self.assertNotIn(0, unclassified)
+            scanner = scan.NetorgScanner(device_table)
+            scanner.run()
+            analyses.append({k: v['device_names'] for k, v in scanner.analysis.items()})
+            self.assertListEqual(analyses[-1]['ACTIVE_UNCLASSIFIED'], ['kra', '__a', '_ra'])
+        self.assertEqual(analyses[0], analyses[1])
+
+    def test_stream(self):
+        """Test that NetorgScanner.stream() yields the devices run() finds, with every backend and any chunk size."""
+        for backend in devicetable.BACKENDS:
+            device_table_loader = devicetableloader.DeviceTableLoader(
+                known_devices_port=KnownDevicesTestAdapter(),
+                active_clients_port=ActiveClientsTestAdapter(),
+                fixed_ip_reservations_port=FixedIpReservationsTestAdapter(),
+                backend=backend
+            )
+            device_table = device_table_loader.load_all()
+            scanner = scan.NetorgScanner(device_table)
+            scanner.run()
+            for chunk_size in (1, 2, scan.STREAM_CHUNK_SIZE):
+                with self.subTest(backend=backend, chunk_size=chunk_size):
+                    scan_findings = list(scan.NetorgScanner(device_table).stream(chunk_size))
+                    for k, v in scanner.analysis.items():
+                        self.assertListEqual([scan_finding.name for scan_finding in scan_findings if scan_finding.finding == k],
+                                             v['device_names'])
+                    self.assertIn(ports.ScanFinding('ACTIVE_UNCLASSIFIED', '__a', '__a', '192.168.128.201', 'unclassified'),
+                                  scan_findings)
@@ -0,0 +1,36 @@
+"""Tests for the JSON Lines scan findings adapter."""
+import io
+import json
+import os.path
+import tempfile
+import unittest
+from unittest import mock
+from adapters import scanfindingsout_jsonl
+from netorg_core import ports
+
+SCAN_FINDINGS = [
+    ports.ScanFinding('KNOWN_RESERVED_ACTIVE', 'aa:bb:cc:dd:ee:ff', 'Doorbell camera', '192.168.128.20', 'cameras'),
+    ports.ScanFinding('KNOWN_not_reserved_not_active', '11:22:33:44:55:66', 'Café printer', '', 'printers')
+]
+
+class TestScanFindingsOutAdapter(unittest.TestCase):
+    """Tests for the JSON Lines scan findings adapter."""
+
+    def test_write_stdout(self):
+        """Each finding is written to stdout as a line of JSON."""
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            scanfindingsout_jsonl.ScanFindingsOutAdapter({}).write(iter(SCAN_FINDINGS))
+        self.assertEqual([json.loads(line) for line in stdout.getvalue().splitlines()],
+                         [scan_finding._asdict() for scan_finding in SCAN_FINDINGS])
+
+    def test_write_file(self):
+        """Each finding is written to the file as a line of JSON."""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'scan.jsonl')
+            scanfindingsout_jsonl.ScanFindingsOutAdapter({}, filename).write(iter(SCAN_FINDINGS))
+            with open(filename, encoding='utf8') as scan_findings_file:
+                lines = scan_findings_file.read().splitlines()
+        self.assertEqual(json.loads(lines[1]),
+                         {'finding': 'KNOWN_not_reserved_not_active', 'mac': '11:22:33:44:55:66',
+                          'name': 'Café printer', 'ip': '', 'group': 'printers'})
+        self.assertEqual(len(lines), 2)
@@ -0,0 +1,145 @@
+"""Tests for history.py and ScanHistoryAdapter."""
+import os
+import os.path
+import tempfile
+import unittest
+from datetime import datetime
+from adapters import scanhistory_file
+from netorg_core import app
+from netorg_core import devicetable
+from netorg_core import history
+from netorg_core import ports
+from tests import mockadapters
+
+KNOWN = devicetable.FLAGS['known']
+RESERVED = devicetable.FLAGS['reserved']
+ACTIVE = devicetable.FLAGS['active']
+UNCLASSIFIED = devicetable.UNCLASSIFIED
+
+def at(day: int, hour: int) -> float:
+    """Return the time of an hour of a day of October 2026, in local time."""
+    return datetime(2026, 10, day, hour).timestamp()
+
+class TestScanHistoryAdapter(unittest.TestCase) :
+    """Tests for ScanHistoryAdapter."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.scan_history_port = scanhistory_file.ScanHistoryAdapter({'devices_yml': os.path.join(self.directory.name, 'devices.yml')})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_timeline(self):
+        """Consecutive scans in the same state are one run, even across midnight."""
+        self.scan_history_port.append(at(1, 22), ['aa', 'aab'], [KNOWN | RESERVED | ACTIVE, ACTIVE | UNCLASSIFIED])
+        self.scan_history_port.append(at(1, 23), ['aa', 'aab'], [KNOWN | RESERVED | ACTIVE, ACTIVE | UNCLASSIFIED])
+        self.scan_history_port.append(at(2, 1), ['aa'], [KNOWN | RESERVED | ACTIVE])
+        self.scan_history_port.append(at(2, 2), ['aa', 'aab'], [KNOWN | RESERVED, ACTIVE | UNCLASSIFIED])
+        self.scan_history_port.append(at(2, 3), ['aa', 'aa'], [KNOWN | RESERVED | ACTIVE, KNOWN])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory.name, 'history'))),
+                         ['2026-10-01.history', '2026-10-02.history'])
+        self.assertEqual(list(self.scan_history_port.get_timeline('aa', at(1, 0), at(2, 23))), [
+            ports.StateRun('aa', KNOWN | RESERVED | ACTIVE, at(1, 22), at(2, 1), 3),
+            ports.StateRun('aa', KNOWN | RESERVED, at(2, 2), at(2, 2), 1),
+            ports.StateRun('aa', KNOWN | RESERVED | ACTIVE, at(2, 3), at(2, 3), 1)])
+        # aab was missing from a scan, so its runs are not consecutive
+        self.assertEqual([(run.first, run.last) for run in self.scan_history_port.get_timeline('aab', at(1, 0), at(2, 23))],
+                         [(at(1, 22), at(1, 23)), (at(2, 2), at(2, 2))])
+        self.assertEqual(list(self.scan_history_port.get_timeline('aab', at(2, 0), at(2, 23))),
+                         [ports.StateRun('aab', ACTIVE | UNCLASSIFIED, at(2, 2), at(2, 2), 1)])
+        self.assertEqual(list(self.scan_history_port.get_timeline('a', at(1, 0), at(2, 23))), [])
+        self.assertEqual(list(self.scan_history_port.get_timeline('aa', at(3, 0), at(3, 23))), [])
+
+    def test_append(self):
+        """After a day's first scan, a scan only appends the devices that changed, which is
+        compacted into runs when the next day starts, and another adapter carries on from it."""
+        filename = os.path.join(self.directory.name, 'history', '2026-10-01.history')
+        self.scan_history_port.append(at(1, 20), ['aa', 'bb', 'cc'], [ACTIVE, ACTIVE, KNOWN])
+        with open(filename, 'rb') as day_file:
+            first_scan = day_file.read()
+        self.scan_history_port.append(at(1, 21), ['aa', 'bb', 'cc'], [ACTIVE, KNOWN, KNOWN])
+        with open(filename, 'rb') as day_file:
+            day = day_file.read()
+        self.assertTrue(day.startswith(first_scan))
+        self.assertEqual(day[len(first_scan):], scanhistory_file.encode_segment(at(1, 21), {ACTIVE: 1, KNOWN: 2}, {'bb': KNOWN}, []))
+        other_port = scanhistory_file.ScanHistoryAdapter({'devices_yml': os.path.join(self.directory.name, 'devices.yml')})
+        other_port.append(at(1, 22), ['aa', 'bb'], [ACTIVE, KNOWN])
+        timelines = {mac: list(self.scan_history_port.get_timeline(mac, at(1, 0), at(2, 23))) for mac in ['aa', 'bb', 'cc']}
+        self.assertEqual(timelines['aa'], [ports.StateRun('aa', ACTIVE, at(1, 20), at(1, 22), 3)])
+        self.assertEqual(timelines['bb'], [ports.StateRun('bb', ACTIVE, at(1, 20), at(1, 20), 1),
+                                           ports.StateRun('bb', KNOWN, at(1, 21), at(1, 22), 2)])
+        self.assertEqual(timelines['cc'], [ports.StateRun('cc', KNOWN, at(1, 20), at(1, 21), 2)])
+        self.scan_history_port.append(at(2, 1), ['aa'], [ACTIVE])
+        with open(filename, 'rb') as day_file:
+            day = day_file.read()
+        index = scanhistory_file.decode_index(day)
+        self.assertEqual(scanhistory_file.decode_segments(day, index), [])
+        self.assertEqual(len(index['scans']), 3)
+        self.assertEqual({mac: list(self.scan_history_port.get_timeline(mac, at(1, 0), at(1, 23))) for mac in timelines}, timelines)
+        self.assertEqual([counts.counts for counts in self.scan_history_port.get_state_counts(at(1, 0), at(2, 23))],
+                         [{ACTIVE: 2, KNOWN: 1}, {ACTIVE: 1, KNOWN: 2}, {ACTIVE: 1, KNOWN: 1}, {ACTIVE: 1}])
+
+    def test_state_counts(self):
+        """How many devices were in each state at each scan in the range."""
+        self.scan_history_port.append(at(1, 22), ['aa', 'bb', 'cc'], [ACTIVE, ACTIVE, KNOWN])
+        self.scan_history_port.append(at(2, 1), ['aa'], [KNOWN])
+        self.assertEqual(list(self.scan_history_port.get_state_counts(at(1, 0), at(2, 23))), [
+            ports.StateCounts(at(1, 22), {ACTIVE: 2, KNOWN: 1}),
+            ports.StateCounts(at(2, 1), {KNOWN: 1})])
+        self.assertEqual(list(self.scan_history_port.get_state_counts(at(1, 23), at(2, 23))),
+                         [ports.StateCounts(at(2, 1), {KNOWN: 1})])
+
+    def test_no_history(self):
+        """Without any history there is nothing to report."""
+        self.assertEqual(list(self.scan_history_port.get_timeline('aa', at(1, 0), at(2, 23))), [])
+        self.assertEqual(list(self.scan_history_port.get_state_counts(at(1, 0), at(2, 23))), [])
+
+class TestHistory(unittest.TestCase) :
+    """Tests for history.py and NetOrganizerApp.do_history()."""
+
+    def test_count_findings_by_day(self):
+        """The most devices in each finding at a scan, by day."""
+        days = history.count_findings_by_day([
+            ports.StateCounts(at(1, 22), {ACTIVE | UNCLASSIFIED: 2, KNOWN | RESERVED | ACTIVE: 1}),
+            ports.StateCounts(at(1, 23), {ACTIVE | UNCLASSIFIED: 3}),
+            ports.StateCounts(at(2, 1), {KNOWN: 1})])
+        self.assertEqual(list(days), ['2026-10-01', '2026-10-02'])
+        scans, findings = days['2026-10-01']
+        self.assertEqual(scans, 2)
+        self.assertEqual(findings['ACTIVE_UNCLASSIFIED'], 3)
+        self.assertEqual(findings['not_known_not_reserved_ACTIVE'], 3)
+        self.assertEqual(findings['KNOWN_RESERVED_ACTIVE'], 1)
+        self.assertEqual(days['2026-10-02'][1]['KNOWN_not_reserved_not_active'], 1)
+
+    def test_describe_state(self):
+        """States are described in words."""
+        self.assertEqual(history.describe_state(ACTIVE | UNCLASSIFIED), 'not known, not reserved, active, unclassified')
+
+    def test_scan_and_history(self):
+        """Each scan records the state of every device, which --history reports on, with every backend."""
+        for backend in devicetable.BACKENDS:
+            with self.subTest(backend=backend), tempfile.TemporaryDirectory() as directory:
+                net_organizer_app = app.NetOrganizerApp(
+                    mockadapters.KnownDevicesAdapter(seed_list=[ports.KnownDevice(mac='AA-BB-CC-DD-EE-FF', name='Meerkat', group='servers')]),
+                    mockadapters.ActiveClientsAdapter(seed_list=[
+                        ports.ActiveClient(mac='aa:bb:cc:dd:ee:ff', name='Meerkat', ip_address='192.168.128.10'),
+                        ports.ActiveClient(mac='11:22:33:44:55:66', name='Doorbell', ip_address='192.168.128.20')]),
+                    mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[]),
+                    device_table_csv_out_port=None,
+                    sna_hostgroup_port=None,
+                    device_table_backend=backend,
+                    scan_history_port=scanhistory_file.ScanHistoryAdapter({'devices_yml': os.path.join(directory, 'devices.yml')}))
+                with self.assertLogs('netorg', level='INFO'):
+                    net_organizer_app.do_scan()
+                start, end = datetime.now().timestamp() - 60, datetime.now().timestamp() + 60
+                with self.assertLogs('netorg', level='INFO') as logs:
+                    net_organizer_app.do_history(start, end, 'AABB.CCDD.EEFF')
+                self.assertRegex(logs.records[0].getMessage(), r'^.* to .*: known, not reserved, active \(1 scans\)$')
+                self.assertRegex(logs.records[1].getMessage(), r'^aa:bb:cc:dd:ee:ff was last active at ')
+                with self.assertLogs('netorg', level='INFO') as logs:
+                    net_organizer_app.do_history(start, end)
+                self.assertIn('   ACTIVE_UNCLASSIFIED: 1', [record.getMessage() for record in logs.records])
+                with self.assertLogs('netorg', level='INFO') as logs:
+                    net_organizer_app.do_history(start, end, 'de:ad:be:ef:00:00')
+                self.assertRegex(logs.records[0].getMessage(), r'^No history of de:ad:be:ef:00:00 between ')
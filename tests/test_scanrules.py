@@ -0,0 +1,92 @@
+"""Tests for scanrules.py and ScanRulesAdapter."""
+import os.path
+import tempfile
+import unittest
+from unittest import mock
+from adapters import scanrules_yamlfile
+from netorg_core import devicetable
+from netorg_core import ports
+from netorg_core import scan
+from netorg_core import scanrules
+
+DEVICES = [
+    {'mac': 'aa', 'known': True, 'reserved': True, 'active': True,
+     'ip': '192.168.128.70', 'group': 'cameras', 'name': 'Driveway camera'},
+    {'mac': 'bb', 'known': True, 'reserved': True, 'active': True,
+     'ip': '192.168.128.20', 'group': 'cameras', 'name': 'Doorbell camera'},
+    {'mac': 'cc', 'known': True, 'reserved': False, 'active': False,
+     'ip': '', 'group': 'printers', 'name': 'HP LaserJet'},
+    {'mac': 'dd', 'known': False, 'reserved': False, 'active': True,
+     'ip': '192.168.128.40', 'group': 'unclassified', 'name': 'Printer Upstairs'}
+]
+
+RULES = [
+    {'name': 'cameras_outside_block',
+     'description': 'active cameras outside 192.168.128.64/26',
+     'action': 'Move them into the block',
+     'where': {'active': True, 'group': 'cameras', 'ip_outside': '192.168.128.64/26'}},
+    {'name': 'printers_misnamed',
+     'where': {'name_matches': '^(?!Printer )', 'group': ['printers', 'scanners']}},
+    {'name': 'inside_block',
+     'where': {'ip_in': ['192.168.128.64/26', '10.0.0.0/8'], 'has_ip': True, 'not_group': 'printers'}}
+]
+
+RULES_YAML = """rules:
+  - name: cameras_outside_block
+    where:
+      active: true
+      group: cameras
+      ip_outside: 192.168.128.64/26
+"""
+
+class TestScanRules(unittest.TestCase) :
+    """Tests for compiling and evaluating scan rules."""
+
+    def test_rules(self):
+        """Each rule selects the devices for which all its conditions hold, with every backend."""
+        rules = scanrules.compile_rules(ports.ScanRules('1', RULES))
+        self.assertEqual(rules[1].description, "name_matches ^(?!Printer ) and group ['printers', 'scanners']")
+        for backend in devicetable.BACKENDS:
+            with self.subTest(backend=backend):
+                device_table = devicetable.DeviceTable(DEVICES, backend=backend)
+                self.assertEqual([device_table.get_names(rule.evaluate(device_table)) for rule in rules],
+                                 [['Doorbell camera'], ['HP LaserJet'], ['Driveway camera']])
+                scanner = scan.NetorgScanner(device_table, rules)
+                scanner.run()
+                self.assertEqual(scanner.analysis['cameras_outside_block']['device_names'], ['Doorbell camera'])
+                self.assertEqual(scanner.analysis['ACTIVE_UNCLASSIFIED']['device_names'], ['Printer Upstairs'])
+
+    def test_bad_rules(self):
+        """Rules that cannot be compiled are refused, naming the rule."""
+        for rule in [{'where': {'active': True}},
+                     {'name': 'empty'},
+                     {'name': 'unknown', 'where': {'colour': 'red'}},
+                     {'name': 'bad_pattern', 'where': {'name_matches': '('}},
+                     {'name': 'bad_subnet', 'where': {'ip_in': '192.168.128.0/33'}}]:
+            with self.subTest(rule=rule):
+                with self.assertRaises(ValueError):
+                    scanrules.compile_rule(rule)
+        with self.assertRaises(ValueError):
+            scan.NetorgScanner(devicetable.DeviceTable(DEVICES, backend='python'),
+                               [scanrules.compile_rule({'name': 'KNOWN_RESERVED_ACTIVE', 'where': {'known': True}})])
+
+class TestScanRulesAdapter(unittest.TestCase) :
+    """Tests for ScanRulesAdapter."""
+
+    def test_load(self):
+        """The rules file is only parsed again, even by another run, when its contents change."""
+        with tempfile.TemporaryDirectory() as directory:
+            scan_rules_port = scanrules_yamlfile.ScanRulesAdapter({'devices_yml': os.path.join(directory, 'devices.yml')})
+            self.assertEqual(scan_rules_port.load(), ports.ScanRules('', []))
+            with open(os.path.join(directory, 'scan_rules.yml'), 'w', encoding='utf8') as scan_rules_file:
+                scan_rules_file.write(RULES_YAML)
+            scan_rules = scan_rules_port.load()
+            self.assertEqual(scan_rules.rules[0]['where']['ip_outside'], '192.168.128.64/26')
+            self.assertTrue(os.path.exists(os.path.join(directory, 'scan_rules.cache')))
+            with mock.patch('yaml.safe_load') as safe_load:
+                next_run_port = scanrules_yamlfile.ScanRulesAdapter({'devices_yml': os.path.join(directory, 'devices.yml')})
+                self.assertEqual(next_run_port.load(), scan_rules)
+                safe_load.assert_not_called()
+            with open(os.path.join(directory, 'scan_rules.yml'), 'a', encoding='utf8') as scan_rules_file:
+                scan_rules_file.write("      name_matches: camera\n")
+            self.assertNotEqual(scan_rules_port.load().digest, scan_rules.digest)
@@ -0,0 +1,110 @@
+"""Tests for validation.py."""
+import ipaddress
+import unittest
+from netorg_core import app
+from netorg_core import devicetable
+from netorg_core import networkspace
+from netorg_core import ports
+from netorg_core import validation
+from tests import mockadapters
+
+DEVICES = [
+    {'mac': 'aa', 'known': True, 'reserved': False, 'active': True,
+     'ip': '192.168.128.10', 'group': 'servers', 'name': 'Meerkat'},
+    {'mac': 'bb', 'known': True, 'reserved': True, 'active': True,
+     'ip': '192.168.128.10', 'group': 'servers', 'name': 'Badger'},
+    {'mac': 'cc', 'known': True, 'reserved': True, 'active': False,
+     'ip': '10.0.0.30', 'group': 'printers', 'name': 'Office Printer'},
+    {'mac': 'dd', 'known': False, 'reserved': False, 'active': True,
+     'ip': '192.168.128.40', 'group': 'unclassified', 'name': 'Doorbell'},
+    {'mac': 'ee', 'known': False, 'reserved': False, 'active': False,
+     'ip': '', 'group': 'unclassified', 'name': 'Camera'}
+]
+
+class TestValidation(unittest.TestCase) :
+    """Tests for validate()."""
+
+    def test_validate(self):
+        """Every duplicate IP, out-of-subnet IP and drifted lease is found at once."""
+        for backend in devicetable.BACKENDS:
+            with self.subTest(backend=backend):
+                report = validation.validate(
+                    devicetable.DeviceTable(DEVICES, backend=backend),
+                    subnets=['192.168.128.0/24'],
+                    leases={'aa': '192.168.128.10', 'bb': '192.168.128.11', 'dd': '192.168.128.40'})
+                self.assertEqual(len(report), 4)
+                self.assertEqual(
+                    [(issue.kind, issue.mac, issue.ip_address, issue.detail) for issue in report.get_issues()],
+                    [(validation.DUPLICATE_IP, 'aa', '192.168.128.10', 'bb'),
+                     (validation.DUPLICATE_IP, 'bb', '192.168.128.10', 'aa'),
+                     (validation.LEASE_DRIFT, 'bb', '192.168.128.10', '192.168.128.11'),
+                     (validation.OUT_OF_SUBNET, 'cc', '10.0.0.30', '')])
+                self.assertEqual(len(report.get_conflicts()), 3)
+                # bb has the reservation, so keeps the address
+                self.assertEqual(report.get_rows_to_reassign(), [0, 2])
+                self.assertEqual(len(report.to_dict()[validation.DUPLICATE_IP]), 2)
+
+    def test_validate_clean(self):
+        """A device table without conflicts has an empty report."""
+        report = validation.validate(
+            devicetable.DeviceTable(DEVICES[2:], backend='python'), subnets=['192.168.128.0/24', '10.0.0.0/24'])
+        self.assertTrue(report.is_empty())
+        self.assertEqual(report.get_rows_to_reassign(), [])
+
+    def test_outside_non_ipv4(self):
+        """Addresses that are not IPv4 are checked too."""
+        devices = [dict(DEVICES[3], ip='2001:db8::1'), dict(DEVICES[4], ip='2001:db9::1')]
+        for backend in devicetable.BACKENDS:
+            with self.subTest(backend=backend):
+                outside = devicetable.DeviceTable(devices, backend=backend).get_outside(
+                    [ipaddress.ip_network('2001:db8::/64')])
+                self.assertEqual(outside.tolist(), [False, True])
+
+class TestOrganizeValidationPolicy(unittest.TestCase) :
+    """Tests for what organize does about conflicts."""
+
+    @staticmethod
+    def create_app(validation_policy):
+        """Create an app whose reservations hold a duplicate and an out-of-subnet IP."""
+        fixed_ip_reservations_port = mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[
+            ports.FixedIpReservation(mac='aa', name='Meerkat', ip_address='192.168.128.10'),
+            ports.FixedIpReservation(mac='bb', name='Badger', ip_address='192.168.128.10'),
+            ports.FixedIpReservation(mac='cc', name='Office Printer', ip_address='10.0.0.30')])
+        known_devices_port = mockadapters.KnownDevicesAdapter(seed_list=[
+            ports.KnownDevice(mac='aa', name='Meerkat', group='servers'),
+            ports.KnownDevice(mac='bb', name='Badger', group='servers'),
+            ports.KnownDevice(mac='cc', name='Office Printer', group='printers')])
+        net_organizer_app = app.NetOrganizerApp(
+            known_devices_port,
+            mockadapters.ActiveClientsAdapter(seed_list=[]),
+            fixed_ip_reservations_port,
+            device_table_csv_out_port=None,
+            sna_hostgroup_port=None,
+            validation_policy=validation_policy)
+        return net_organizer_app, fixed_ip_reservations_port
+
+    def test_abort(self):
+        """Every conflict is reported and nothing is changed."""
+        net_organizer_app, fixed_ip_reservations_port = TestOrganizeValidationPolicy.create_app(validation.ABORT)
+        with self.assertLogs('netorg', level='WARNING'):
+            with self.assertRaises(networkspace.InvalidAddresses) as context:
+                net_organizer_app.do_organize()
+        self.assertEqual(context.exception.duplicates, ['192.168.128.10'])
+        self.assertEqual(context.exception.out_of_range, ['10.0.0.30'])
+        self.assertEqual(len(fixed_ip_reservations_port.load()), 3)
+
+    def test_reassign(self):
+        """The conflicting devices are given new addresses."""
+        net_organizer_app, fixed_ip_reservations_port = TestOrganizeValidationPolicy.create_app(validation.REASSIGN)
+        with self.assertLogs('netorg', level='WARNING'):
+            net_organizer_app.do_organize()
+        ip_addresses = {reservation.mac: reservation.ip_address for reservation in fixed_ip_reservations_port.load()}
+        self.assertEqual(len(set(ip_addresses.values())), 3)
+        self.assertEqual(ip_addresses['aa'], '192.168.128.10')
+        for ip_address in ip_addresses.values():
+            self.assertTrue(ip_address.startswith('192.168.128.'))
+
+    def test_unknown_policy(self):
+        """An unknown policy is refused."""
+        with self.assertRaises(ValueError):
+            TestOrganizeValidationPolicy.create_app('ignore')
@@ -0,0 +1,99 @@
+"""Tests for watch.py and NetOrganizerApp.do_watch()."""
+import unittest
+from unittest import mock
+from netorg_core import app
+from netorg_core import devicetable
+from netorg_core import devicetablechanges
+from netorg_core import ports
+from netorg_core import watch
+from tests import mockadapters
+
+PREVIOUS = [
+    {'mac': 'aa', 'known': True, 'reserved': True, 'active': False,
+     'ip': '192.168.128.10', 'group': 'servers', 'name': 'Meerkat'},
+    {'mac': 'bb', 'known': False, 'reserved': False, 'active': True,
+     'ip': '192.168.128.20', 'group': 'unclassified', 'name': 'Jasons iPad'}
+]
+
+CURRENT = [
+    {'mac': 'aa', 'known': True, 'reserved': True, 'active': True,
+     'ip': '192.168.128.10', 'group': 'servers', 'name': 'Meerkat'},
+    {'mac': 'cc', 'known': False, 'reserved': False, 'active': True,
+     'ip': '192.168.128.30', 'group': 'unclassified', 'name': ''}
+]
+
+class TestWatch(unittest.TestCase) :
+    """Tests for watch.py."""
+
+    def test_get_delay(self):
+        """The delay doubles for each failure, up to MAX_BACKOFF, and is jittered."""
+        self.assertEqual(watch.get_delay(60, jitter=0), 60)
+        self.assertEqual(watch.get_delay(60, 3, jitter=0), 480)
+        self.assertEqual(watch.get_delay(60, 100, jitter=0), watch.MAX_BACKOFF)
+        self.assertEqual(watch.get_delay(7200, 2, jitter=0), 7200)
+        delays = [watch.get_delay(60) for _ in range(100)]
+        self.assertTrue(all(54 <= delay <= 66 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_describe_changes(self):
+        """Each device that was added, removed or changed is described, with every backend."""
+        for backend in devicetable.BACKENDS:
+            with self.subTest(backend=backend):
+                changes = devicetablechanges.DeviceTableChanges(
+                    devicetable.DeviceTable(PREVIOUS, backend=backend),
+                    devicetable.DeviceTable(CURRENT, backend=backend))
+                self.assertEqual(changes.get_transitions('aa'), [('active', False, True)])
+                self.assertEqual(watch.describe_changes(changes), [
+                    'Meerkat (aa): not active -> active',
+                    'unnamed (cc): new, not known, not reserved, active',
+                    'Jasons iPad (bb): gone, was not known, not reserved, active'])
+        self.assertEqual(watch.describe_transition('ip', '', '192.168.128.30'), 'ip none -> 192.168.128.30')
+
+class TestDoWatch(unittest.TestCase) :
+    """Tests for NetOrganizerApp.do_watch()."""
+
+    def test_do_watch(self):
+        """Only what changed between ticks is reported, and a failed load backs off."""
+        active_clients_port = mockadapters.ActiveClientsAdapter(seed_list=[])
+        net_organizer_app = app.NetOrganizerApp(
+            mockadapters.KnownDevicesAdapter(seed_list=[ports.KnownDevice(mac='aa', name='Meerkat', group='servers')]),
+            active_clients_port,
+            mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[]),
+            device_table_csv_out_port=None,
+            sna_hostgroup_port=None,
+            device_table_backend='python',
+            watch_jitter=0)
+        loads = [
+            [],
+            [ports.ActiveClient(mac='aa', name='Meerkat', ip_address='192.168.128.10')],
+            ConnectionError('Meraki is down'),
+            [ports.ActiveClient(mac='aa', name='Meerkat', ip_address='192.168.128.10')],
+            []]
+        with mock.patch.object(active_clients_port, 'load', side_effect=loads), \
+             mock.patch('time.sleep') as sleep, \
+             self.assertLogs('netorg', level='INFO') as logs:
+            net_organizer_app.do_watch(interval=60, ticks=5)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [60, 60, 120, 60])
+        self.assertEqual([record.getMessage() for record in logs.records], [
+            'watch: watching 1 devices',
+            'Meerkat (aa): not active -> active, ip none -> 192.168.128.10',
+            'watch: loading the device table failed (1 in a row): Meraki is down',
+            'Meerkat (aa): active -> not active, ip 192.168.128.10 -> none'])
+
+    def test_do_watch_snapshot(self):
+        """The first tick reports what changed since the snapshot, and the snapshot is kept up to date."""
+        snapshot_port = mockadapters.DeviceTableSnapshotAdapter()
+        snapshot_port.save(devicetable.DeviceTable(PREVIOUS[:1], backend='python'))
+        net_organizer_app = app.NetOrganizerApp(
+            mockadapters.KnownDevicesAdapter(seed_list=[ports.KnownDevice(mac='aa', name='Meerkat', group='servers')]),
+            mockadapters.ActiveClientsAdapter(seed_list=[]),
+            mockadapters.FixedIpReservationsAdapter(vlan_subnet='192.168.128.0/24', seed_list=[]),
+            device_table_csv_out_port=None,
+            sna_hostgroup_port=None,
+            device_table_backend='python',
+            device_table_snapshot_port=snapshot_port)
+        with self.assertLogs('netorg', level='INFO') as logs:
+            net_organizer_app.do_watch(ticks=1)
+        self.assertEqual([record.getMessage() for record in logs.records],
+                         ['Meerkat (aa): reserved -> not reserved, ip 192.168.128.10 -> none'])
+        self.assertEqual(snapshot_port.load(float('inf'), 'python').get_ips(), [''])